@@ -23,8 +23,10 @@
 from __future__ import absolute_import, print_function, division
 from six import PY2
 import numpy as np
+import scipy.sparse
 from sklearn import cluster
 from sklearn import mixture
+from ._commonc import _predict_labels_euclidean
 
 __all__ = ['KMeans', 'MiniBatchKMeans', 'AffinityPropagation', 'MeanShift',
            'GMM', 'SpectralClustering', 'Ward', 'KCenters', 'NDGrid',
@@ -35,6 +37,13 @@ __all__ = ['KMeans', 'MiniBatchKMeans', 'AffinityPropagation', 'MeanShift',
 # Code
 #-----------------------------------------------------------------------------
 
+def _n_samples(X):
+    # len() of a scipy.sparse matrix is ambiguous, so it raises a TypeError
+    if scipy.sparse.issparse(X):
+        return X.shape[0]
+    return len(X)
+
+
 class MultiSequenceClusterMixin(object):
 
     # The API for the scikit-learn Cluster object is, in fit(), that
@@ -72,9 +81,13 @@ class MultiSequenceClusterMixin(object):
         return self
 
     def _concat(self, sequences):
-        self.__lengths = [len(s) for s in sequences]
+        self.__lengths = [_n_samples(s) for s in sequences]
         if len(sequences) > 0 and isinstance(sequences[0], np.ndarray):
             concat = np.concatenate(sequences)
+        elif len(sequences) > 0 and scipy.sparse.issparse(sequences[0]):
+            # e.g. contact maps from SparseContactFeaturizer, which can be
+            # clustered by KMeans without ever being densified
+            concat = scipy.sparse.vstack(sequences, format='csr')
         else:
             # if the input sequences are not numpy arrays, we need to guess
             # how to concatenate them. this operation below works for mdtraj
@@ -83,7 +96,7 @@ class MultiSequenceClusterMixin(object):
             # give us a generic way to make sure we merged sequences
             concat = sequences[0].join(sequences[1:])
 
-        assert sum(self.__lengths) == len(concat)
+        assert sum(self.__lengths) == _n_samples(concat)
         return concat
 
     def _split(self, concat):
@@ -174,7 +187,17 @@ def _replace_labels(doc):
 # New "multisequence" versions of all of the clustering algorithims in sklearn
 #-----------------------------------------------------------------------------
 
-class KMeans(MultiSequenceClusterMixin, cluster.KMeans):
+class _KMeans(cluster.KMeans):
+    def predict(self, X):
+        # use the same (triangle inequality pruned / blocked GEMM, and
+        # multithreaded) assignment engine as KCenters and RegularSpatial
+        if (hasattr(self, 'cluster_centers_') and isinstance(X, np.ndarray)
+                and X.ndim == 2 and X.dtype in (np.float32, np.float64)):
+            return _predict_labels_euclidean(X, self.cluster_centers_)
+        return super(_KMeans, self).predict(X)
+
+
+class KMeans(MultiSequenceClusterMixin, _KMeans):
     __doc__ = _replace_labels(cluster.KMeans.__doc__)
 
 
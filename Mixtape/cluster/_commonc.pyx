@@ -24,11 +24,25 @@ from blas cimport *
 from libc.math cimport sqrt
 cimport cython
 cimport numpy as np
+from cython.parallel cimport prange
 import numpy as np
 from numpy import zeros
 import scipy.linalg.blas
+import mdtraj as md
 
-__all__ = ['_assign_labels_array']
+__all__ = ['_assign_labels_array', '_assign_labels_triangle']
+
+# _predict_labels_euclidean uses the triangle inequality search when there
+# are at most this many features. In higher dimensions the bounds prune less,
+# and a blocked GEMM over all of the centers is faster.
+cdef int TRIANGLE_MAX_FEATURES = 16
+# Maximum size of the (block of samples) x (centers) matrix of inner
+# products formed by the GEMM path, in bytes
+cdef Py_ssize_t GEMM_BLOCK_BYTES = 2**26
+# Relative slack with which the triangle-inequality bounds are applied, so
+# that rounding error in the bounds can never prune a center that is tied
+# with (or closer than) the best one found so far
+cdef double BOUND_SLACK = 1e-4
 
 #-----------------------------------------------------------------------------
 # Typedefs
@@ -39,24 +53,48 @@ ctypedef cython.floating real
 cdef extern from "f2pyptr.h":
     void *f2py_pointer(object) except NULL
 cdef extern from "sdot.h":
-    float sdot_(const int N, const float* x, const float* y)
-cdef ddot_t *ddot = <ddot_t*>f2py_pointer(scipy.linalg.blas.ddot._cpointer)
+    float sdot_(const int N, const float* x, const float* y) nogil
+    double ddot_c(const int N, const double* x, const double* y) nogil
+cdef extern from "math.h":
+    double HUGE_VAL
 
 #-----------------------------------------------------------------------------
 # Code
 #-----------------------------------------------------------------------------
 
 def _predict_labels_euclidean(X, cluster_centers):
-    # fast path
+    """Assign each sample to its closest cluster center (euclidean metric)
+
+    This is the assignment engine shared by the clustering estimators. With
+    few features, it prunes the search over the centers with the triangle
+    inequality (see `_assign_labels_triangle`), in parallel over samples.
+    Otherwise, it computes the distances to all of the centers in blocks
+    of samples with a (multithreaded) BLAS matrix-matrix product.
+    """
     X = np.asarray(X, order='c')
+    if X.dtype not in (np.float64, np.float32):
+        raise KeyError('Only double and float are supported')
     centers = np.asarray(cluster_centers, dtype=X.dtype, order='c')
     labels = np.zeros(len(X), dtype=np.int64)
-    if X.dtype == np.float64:
-        _assign_labels_array[cython.double](X, centers, labels, np.zeros(0))
-    elif X.dtype == np.float32:
-        _assign_labels_array[cython.float](X, centers, labels, np.zeros(0, dtype=np.float32))
-    else:
-        raise KeyError('Only double and float are supported')
+    if len(X) == 0:
+        return labels
+
+    if X.shape[1] <= TRIANGLE_MAX_FEATURES:
+        if X.dtype == np.float64:
+            _assign_labels_triangle[cython.double](X, centers, labels, np.zeros(0))
+        else:
+            _assign_labels_triangle[cython.float](X, centers, labels, np.zeros(0, dtype=np.float32))
+        return labels
+
+    # ||a - b||^2 = ||a||^2 + ||b||^2 -2 <a, b>. ||a||^2 is the same for
+    # every center, so it doesn't affect the argmin
+    center_squared_norms = np.einsum('ij,ij->i', centers, centers)
+    block = max(1, GEMM_BLOCK_BYTES // (X.itemsize * len(centers)))
+    for start in range(0, len(X), block):
+        inner = np.dot(X[start:start+block], centers.T)
+        inner *= -2
+        inner += center_squared_norms
+        labels[start:start+block] = np.argmin(inner, axis=1)
     return labels
 
 def _predict_labels(X, cluster_centers, metric_function):
@@ -72,6 +110,26 @@ def _predict_labels(X, cluster_centers, metric_function):
 
     return labels
 
+def _predict_labels_rmsd(X, cluster_centers):
+    # fast path for the RMSD metric: center the frames and the cluster
+    # centers once, instead of once per call to md.rmsd
+    X = md.Trajectory(X.xyz.copy(), X.topology)
+    X.center_coordinates()
+    centers = md.Trajectory(cluster_centers.xyz.copy(), cluster_centers.topology)
+    centers.center_coordinates()
+
+    labels = np.zeros(len(X), dtype=int)
+    distances = np.empty(len(X), dtype=float)
+    distances.fill(np.inf)
+
+    for i in range(len(centers)):
+        d = md.rmsd(X, centers, i, precentered=True)
+        mask = (d < distances)
+        distances[mask] = d[mask]
+        labels[mask] = i
+
+    return labels
+
 
 @cython.boundscheck(False)
 @cython.wraparound(False)
@@ -112,51 +170,287 @@ cpdef np.float64_t _assign_labels_array(real[:, ::1] X,
         real dist
         real[::1] x_squared_norms
         real[::1] center_squared_norms
-        int one = 1
 
     if n_samples == distances.shape[0]:
         store_distances = 1
 
-    # First get the squared norms
     if real == double:
         center_squared_norms = zeros(n_clusters, dtype=np.double)
         x_squared_norms = zeros(n_samples, dtype=np.double)
-        for j in range(n_samples):
-            x_squared_norms[j] = ddot(&n_features, <double*> &X[j,0], &one,
-                                      <double*> &X[j,0], &one)
-        for j in range(n_clusters):
-            center_squared_norms[j] = ddot(&n_features, <double*> &centers[j,0], &one,
-                                           <double*> &centers[j,0], &one)
     else:
         center_squared_norms = zeros(n_clusters, dtype=np.float32)
         x_squared_norms = zeros(n_samples, dtype=np.float32)
-        for j in range(n_samples):
-            x_squared_norms[j] = sdot_(n_features, <np.float32_t*> &X[j,0],
-                                       <np.float32_t*> &X[j,0])
-        for j in range(n_clusters):
-            center_squared_norms[j] = sdot_(n_features, <np.float32_t*> &centers[j,0],
-                                            <np.float32_t*> &centers[j,0])
 
-
-    for i in range(n_samples):
-        min_dist = -1
+    with nogil:
+        # First get the squared norms
+        for j in prange(n_samples, schedule='static'):
+            if real == double:
+                x_squared_norms[j] = ddot_c(n_features, <double*> &X[j,0],
+                                            <double*> &X[j,0])
+            else:
+                x_squared_norms[j] = sdot_(n_features, <np.float32_t*> &X[j,0],
+                                           <np.float32_t*> &X[j,0])
         for j in range(n_clusters):
-            # hardcoded: minimize euclidean distance to cluster center:
-            # ||a - b||^2 = ||a||^2 + ||b||^2 -2 <a, b>
-            dist = x_squared_norms[i] + center_squared_norms[j]
             if real == double:
-                dist += - 2*ddot(&n_features, <double*> &centers[j, 0], &one,
-                                 <double*> &X[i, 0], &one)
+                center_squared_norms[j] = ddot_c(n_features, <double*> &centers[j,0],
+                                                 <double*> &centers[j,0])
             else:
-                dist += - 2*sdot_(n_features, <np.float32_t*> &centers[j, 0],
-                                  <np.float32_t*> &X[i, 0])
+                center_squared_norms[j] = sdot_(n_features, <np.float32_t*> &centers[j,0],
+                                                <np.float32_t*> &centers[j,0])
+
+        for i in prange(n_samples, schedule='static'):
+            min_dist = -1
+            for j in range(n_clusters):
+                # hardcoded: minimize euclidean distance to cluster center:
+                # ||a - b||^2 = ||a||^2 + ||b||^2 -2 <a, b>
+                dist = x_squared_norms[i] + center_squared_norms[j]
+                if real == double:
+                    dist = dist - 2*ddot_c(n_features, <double*> &centers[j, 0],
+                                           <double*> &X[i, 0])
+                else:
+                    dist = dist - 2*sdot_(n_features, <np.float32_t*> &centers[j, 0],
+                                          <np.float32_t*> &X[i, 0])
 
-            if min_dist == -1 or dist < min_dist:
-                labels[i] = j
-                min_dist = dist
+                if min_dist == -1 or dist < min_dist:
+                    labels[i] = j
+                    min_dist = dist
 
-        if store_distances:
-            distances[i] = sqrt(min_dist)
-        inertia += min_dist
+            if store_distances:
+                distances[i] = sqrt(min_dist)
+            inertia += min_dist
 
     return inertia
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cpdef _assign_labels_triangle(real[:, ::1] X,
+                              real[:, ::1] centers,
+                              long long[::1] labels,
+                              real[::1] distances,
+                              int n_neighbors=32):
+    """Compute label assignment, pruning centers with the triangle inequality
+
+    Two bounds are used. First, if d(c, c') >= 2 d(x, c), then
+    d(x, c') >= d(x, c) [1]. For each center, its `n_neighbors` nearest
+    other centers are precomputed. Each sample starts from the center
+    assigned to the previous sample (consecutive frames of a trajectory
+    are usually close), and walks to any closer center on this neighbor
+    list, until the bound shows that no center beyond the ones checked can
+    be closer.
+
+    If the neighbor list is too short to certify the assignment (e.g. for
+    the first sample of each block, or a sample far from all of the
+    centers), an exact search is done instead. The centers are sorted by
+    their distance, r_j, to an anchor point (the mean of the centers). The
+    distance from a sample at a distance r from the anchor to center j is
+    at least |r - r_j| [2], so the search starts from the centers with r_j
+    closest to r, moves outward in both directions, and stops as soon as
+    this bound exceeds the distance to the closest center found so far.
+
+    In both cases, the distance to each candidate center is abandoned as
+    soon as its partial sum exceeds that distance. The bounds are loosened
+    by a small relative slack, so that rounding can't prune a center at the
+    same distance as the best one, and the result is the same as that of a
+    brute force search, with ties broken in favor of the lowest index.
+    Samples with nan or inf entries are assigned to center 0. Blocks of samples are processed in parallel with OpenMP.
+
+    Parameters
+    ----------
+    X : 2d array [INPUT]
+        The data array
+    centers : 2d array [INPUT]
+        The array with the cluster centers
+    labels : 1d array [OUTPUT]
+        The output labels for each data point (integers from 0 to n_clusters-1) will
+        be written into this array
+    distances : 1d array [OUTPUT]
+        If distances is supplied and is an array of length == len(X), the distances
+        from each X to its assigned cluster center will be written here
+    n_neighbors : int, default=32
+        Length of the list of nearest centers stored for each center
+
+    References
+    ----------
+    .. [1] Elkan, C. "Using the triangle inequality to accelerate k-means."
+       ICML (2003).
+    .. [2] Drake, J., and G. Hamerly. "Accelerated k-means with adaptive
+       distance bounds." NIPS Workshop on Optimization for Machine Learning
+       (2012).
+    """
+    cdef:
+        int n_clusters = centers.shape[0]
+        int n_features = centers.shape[1]
+        np.int64_t n_samples = X.shape[0]
+        np.int64_t i, blk, n_blocks
+        np.int64_t block_size = 256
+        int c, j, k, t, lo, hi, mid, best, search, lower
+        int store_distances = 0
+        real r, gap, gap_lo, gap_hi, d2, min_d2, diff
+        real[::1] anchor
+        real[::1] radii
+        real[:, ::1] sorted_centers
+        np.int64_t[::1] order
+        np.int64_t[::1] rank
+        np.int64_t[:, ::1] neighbors
+        real[:, ::1] neighbor_distances
+
+    if n_clusters == 0:
+        raise ValueError('At least one cluster center is required')
+    if n_samples == distances.shape[0]:
+        store_distances = 1
+    n_neighbors = max(0, min(n_neighbors, n_clusters - 1))
+
+    centers_array = np.asarray(centers)
+    dtype = centers_array.dtype
+
+    # sort the centers by their distance from the anchor
+    anchor = centers_array.mean(axis=0)
+    radii_array = np.sqrt(np.sum((centers_array - anchor)**2, axis=1))
+    order = np.argsort(radii_array, kind='mergesort').astype(np.int64)
+    rank = np.argsort(order).astype(np.int64)
+    radii = np.ascontiguousarray(radii_array[order])
+    sorted_centers = np.ascontiguousarray(centers_array[order])
+
+    # the nearest centers to each center, in order of distance, with the
+    # inner products for the candidates computed by a blocked GEMM but the
+    # stored distances recomputed directly, since they certify assignments
+    neighbors_array = zeros((n_clusters, n_neighbors), dtype=np.int64)
+    neighbor_distances_array = zeros((n_clusters, n_neighbors), dtype=dtype)
+    if n_neighbors > 0:
+        c64 = centers_array.astype(np.float64)
+        sq = np.sum(c64**2, axis=1)
+        step = max(1, GEMM_BLOCK_BYTES // (8 * n_clusters))
+        for start in range(0, n_clusters, step):
+            block = np.arange(start, min(start + step, n_clusters))
+            d2_block = sq[block, np.newaxis] + sq - 2 * np.dot(c64[block], c64.T)
+            d2_block[np.arange(len(block)), block] = np.inf
+            if n_neighbors < n_clusters - 1:
+                nbrs = np.argpartition(d2_block, n_neighbors - 1, axis=1)[:, :n_neighbors]
+            else:
+                nbrs = np.argsort(d2_block, axis=1)[:, :n_neighbors]
+            nbr_d = np.sqrt(np.sum((c64[block, np.newaxis, :] - c64[nbrs])**2, axis=2))
+            ind = np.argsort(nbr_d, axis=1, kind='mergesort')
+            rows = np.arange(len(block))[:, np.newaxis]
+            neighbors_array[block] = nbrs[rows, ind]
+            neighbor_distances_array[block] = nbr_d[rows, ind]
+    neighbors = neighbors_array
+    neighbor_distances = neighbor_distances_array
+
+    n_blocks = (n_samples + block_size - 1) // block_size
+
+    with nogil:
+        for blk in prange(n_blocks, schedule='dynamic'):
+            c = -1
+            for i in range(blk * block_size, min((blk + 1) * block_size, n_samples)):
+                search = 1
+                if c >= 0:
+                    min_d2 = 0
+                    for k in range(n_features):
+                        diff = X[i, k] - centers[c, k]
+                        min_d2 = min_d2 + diff * diff
+                    if not min_d2 < HUGE_VAL:
+                        # nan or inf in this row: the bounds below are useless
+                        c = -1
+
+                if c >= 0:
+                    t = 0
+                    while t < n_neighbors:
+                        if neighbor_distances[c, t] * neighbor_distances[c, t] > \
+                                4 * min_d2 * (1 + BOUND_SLACK):
+                            # no center beyond this one can be closer than c
+                            search = 0
+                            break
+                        j = neighbors[c, t]
+                        d2 = 0
+                        for k in range(n_features):
+                            diff = X[i, k] - centers[j, k]
+                            d2 = d2 + diff * diff
+                            if d2 > min_d2:
+                                break
+                        if d2 < min_d2 or (d2 == min_d2 and j < c):
+                            # walk to the closer center, and check its neighbors
+                            c = j
+                            min_d2 = d2
+                            t = 0
+                        else:
+                            t = t + 1
+                    if n_neighbors == n_clusters - 1:
+                        # every other center was on the list
+                        search = 0
+
+                if search:
+                    r = 0
+                    for k in range(n_features):
+                        diff = X[i, k] - anchor[k]
+                        r = r + diff * diff
+                    r = sqrt(r)
+
+                    # binary search for the first center with radius >= r
+                    lo = 0
+                    hi = n_clusters
+                    while lo < hi:
+                        mid = (lo + hi) // 2
+                        if radii[mid] < r:
+                            lo = mid + 1
+                        else:
+                            hi = mid
+                    hi = lo
+                    lo = lo - 1
+
+                    if c >= 0:
+                        best = rank[c]
+                    else:
+                        best = -1
+                        min_d2 = HUGE_VAL
+
+                    while lo >= 0 or hi < n_clusters:
+                        # take the next center from whichever side is closer in radius
+                        gap_lo = r - radii[lo] if lo >= 0 else -1
+                        gap_hi = radii[hi] - r if hi < n_clusters else -1
+                        if gap_hi < 0 or (gap_lo >= 0 and gap_lo <= gap_hi):
+                            j = lo
+                            lo = lo - 1
+                            gap = gap_lo
+                            lower = 1
+                        else:
+                            j = hi
+                            hi = hi + 1
+                            gap = gap_hi
+                            lower = 0
+                        # a lower bound on the distance to center j (and every
+                        # center further out on this side), less the rounding
+                        # error of r and the radii
+                        gap = gap - BOUND_SLACK * (r + radii[j])
+                        if gap > 0 and gap * gap > min_d2 * (1 + BOUND_SLACK):
+                            if lower:
+                                lo = -1
+                            else:
+                                hi = n_clusters
+                            continue
+
+                        d2 = 0
+                        for k in range(n_features):
+                            diff = X[i, k] - sorted_centers[j, k]
+                            d2 = d2 + diff * diff
+                            if d2 > min_d2:
+                                break
+                        if d2 < min_d2 or (d2 == min_d2 and best >= 0 and
+                                           order[j] < order[best]):
+                            min_d2 = d2
+                            best = j
+                    if best >= 0:
+                        c = order[best]
+                    else:
+                        # no finite distance (a row with nan or inf): assign to
+                        # center 0, like the brute-force search does
+                        c = 0
+                        min_d2 = 0
+                        for k in range(n_features):
+                            diff = X[i, k] - centers[0, k]
+                            min_d2 = min_d2 + diff * diff
+
+                labels[i] = c
+                if store_distances:
+                    distances[i] = sqrt(min_d2)
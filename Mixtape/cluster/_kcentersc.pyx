@@ -24,12 +24,14 @@ from blas cimport *
 from libc.math cimport sqrt
 cimport cython
 cimport numpy as np
+from cython.parallel cimport prange
 from libc.string cimport memcpy
 import numpy as np
 from numpy import zeros, ones, array
 import scipy.linalg.blas
+import mdtraj as md
 
-__all__ = ['_kcenters_euclidean']
+__all__ = ['_kcenters_euclidean', '_kcenters_rmsd']
 
 #-----------------------------------------------------------------------------
 # Typedefs
@@ -39,12 +41,12 @@ ctypedef cython.floating real
 cdef extern from "f2pyptr.h":
     void *f2py_pointer(object) except NULL
 cdef extern from "sdot.h":
-    float sdot_(const int N, const float* x, const float* y)
+    float sdot_(const int N, const float* x, const float* y) nogil
+    double ddot_c(const int N, const double* x, const double* y) nogil
 cdef extern from "math.h":
     double HUGE_VAL
     float HUGE_VALF
 
-cdef ddot_t *ddot = <ddot_t*>f2py_pointer(scipy.linalg.blas.ddot._cpointer)
 cdef idamax_t *idamax = <idamax_t*>f2py_pointer(scipy.linalg.blas.idamax._cpointer)
 cdef isamax_t *isamax = <isamax_t*>f2py_pointer(scipy.linalg.blas.isamax._cpointer)
 
@@ -58,11 +60,32 @@ cdef isamax_t *isamax = <isamax_t*>f2py_pointer(scipy.linalg.blas.isamax._cpoint
 cpdef _kcenters_euclidean(real[:, ::1] X,
                           np.int64_t n_clusters,
                           np.int64_t seed):
+    """K-centers clustering with a euclidean distance metric
+
+    The sweep over the samples which updates the distance from each sample
+    to its nearest center is parallelized with OpenMP.
+
+    Parameters
+    ----------
+    X : 2d array
+        The data array
+    n_clusters : int
+        The number of cluster centers to find
+    seed : int
+        The index in X of the first cluster center
+
+    Returns
+    -------
+    cluster_centers : 2d array, shape=(n_clusters, n_features)
+    distances : 1d array, shape=(n_samples,)
+        The distance from each sample to its assigned center
+    labels : 1d array, shape=(n_samples,)
+        The index of the center each sample is assigned to
+    """
     cdef:
         int n_samples = X.shape[0]
         int n_features = X.shape[1]
-        int new_center
-        np.int64_t i, j, k
+        np.int64_t i, j
         real dist
         real[::1] distances
         real[::1] x_squared_norms
@@ -76,43 +99,91 @@ cpdef _kcenters_euclidean(real[:, ::1] X,
         cluster_centers = zeros((n_clusters, n_features), dtype=np.double)
         cluster_center_squared_norms = zeros(n_clusters, dtype=np.double)
         x_squared_norms = zeros(n_samples, dtype=np.double)
-        for j in range(n_samples):
-            distances[j] = HUGE_VAL
-            x_squared_norms[j] = ddot(&n_features, <double*> &X[j,0], &one,
-                                      <double*> &X[j,0], &one)
     else:
         distances = zeros(n_samples, dtype=np.float32)
         cluster_centers = zeros((n_clusters, n_features), dtype=np.float32)
         cluster_center_squared_norms = zeros(n_clusters, dtype=np.float32)
         x_squared_norms = zeros(n_samples, dtype=np.float32)
-        for j in range(n_samples):
-            distances[j] = HUGE_VALF
-            x_squared_norms[j] = sdot_(n_features, <float*> &X[j,0], <float*> &X[j,0])
 
-    for i in range(n_clusters):
-        memcpy(&cluster_centers[i, 0], &X[seed, 0], n_features*sizeof(real))
-        cluster_center_squared_norms[i] = x_squared_norms[seed]
+    with nogil:
+        for j in prange(n_samples, schedule='static'):
+            if real == double:
+                distances[j] = HUGE_VAL
+                x_squared_norms[j] = ddot_c(n_features, <double*> &X[j,0], <double*> &X[j,0])
+            else:
+                distances[j] = HUGE_VALF
+                x_squared_norms[j] = sdot_(n_features, <float*> &X[j,0], <float*> &X[j,0])
+
+        for i in range(n_clusters):
+            memcpy(&cluster_centers[i, 0], &X[seed, 0], n_features*sizeof(real))
+            cluster_center_squared_norms[i] = x_squared_norms[seed]
+
+            # each sample's distance to the new center is independent of
+            # the others, so the sweep can be split over threads
+            for j in prange(n_samples, schedule='static'):
+                # ||a - b||^2 = ||a||^2 + ||b||^2 -2 <a, b>
+                dist = cluster_center_squared_norms[i] + x_squared_norms[j]
+                if real == double:
+                    dist = dist - 2*ddot_c(n_features, <double*> &cluster_centers[i, 0],
+                                           <double*> &X[j, 0])
+                else:
+                    dist = dist - 2*sdot_(n_features, <float*> &cluster_centers[i, 0],
+                                          <float*> &X[j, 0])
 
-        for j in range(n_samples):
-            dist = cluster_center_squared_norms[i] + x_squared_norms[j]
+                if dist < distances[j]:
+                    distances[j] = dist
+                    labels[j] = i
+
+            # -1 needed because of fortran 1-based indexing
             if real == double:
-                dist += - 2*ddot(&n_features, <double*> &cluster_centers[i, 0],
-                                 &one, <double*> &X[j, 0], &one)
+                seed = idamax(&n_samples, <double*> &distances[0], &one) - 1
             else:
-                dist += - 2*sdot_(n_features, <float*> &cluster_centers[i, 0],
-                                  <float*> &X[j, 0])
-
-            if dist < distances[j]:
-                distances[j] = dist
-                labels[j] = i
-
-        # -1 needed because of fortran 1-based indexing
-        if real == double:
-            seed = idamax(&n_samples, <double*> &distances[0], &one) - 1
-        else:
-            seed = isamax(&n_samples, <float*> &distances[0], &one) - 1
-
-    for j in range(n_samples):
-        distances[j] = sqrt(distances[j])
-    
+                seed = isamax(&n_samples, <float*> &distances[0], &one) - 1
+
+        for j in prange(n_samples, schedule='static'):
+            distances[j] = sqrt(distances[j])
+
     return array(cluster_centers), array(distances), array(labels)
+
+
+def _kcenters_rmsd(X, n_clusters, seed):
+    """K-centers clustering of an MD trajectory with the RMSD metric
+
+    The coordinates of (a copy of) the trajectory are centered, and their
+    traces are computed, only once. Each iteration is then a single call
+    to the precentered, OpenMP-parallel RMSD kernel in MDTraj.
+
+    Parameters
+    ----------
+    X : md.Trajectory
+        The trajectory to cluster
+    n_clusters : int
+        The number of cluster centers to find
+    seed : int
+        The index in X of the first cluster center
+
+    Returns
+    -------
+    cluster_centers : md.Trajectory, length=n_clusters
+    distances : 1d array, shape=(n_samples,)
+        The RMSD from each frame to its assigned center
+    labels : 1d array, shape=(n_samples,)
+        The index of the center each frame is assigned to
+    """
+    centered = md.Trajectory(X.xyz.copy(), X.topology)
+    centered.center_coordinates()
+
+    labels = zeros(X.n_frames, dtype=np.int64)
+    distances = np.empty(X.n_frames, dtype=np.double)
+    distances.fill(np.inf)
+    center_indices = zeros(n_clusters, dtype=np.int64)
+
+    for i in range(n_clusters):
+        center_indices[i] = seed
+        d = md.rmsd(centered, centered, seed, precentered=True)
+        mask = (d < distances)
+        distances[mask] = d[mask]
+        labels[mask] = i
+        seed = np.argmax(distances)
+
+    return X[center_indices], distances, labels
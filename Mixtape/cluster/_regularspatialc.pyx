@@ -24,10 +24,14 @@ from blas cimport *
 import numpy as np
 from numpy import zeros
 cimport cython
+cimport numpy as np
+from libc.math cimport floor
 import scipy.linalg.blas
 
 cdef int INITIAL_CENTERS_BUFFER_SIZE = 8
 cdef int CENTERS_BUFFER_GROWTH_MULTIPLE = 2
+cdef int INITIAL_GRID_TABLE_SIZE = 64
+cdef np.uint64_t GRID_HASH_MULTIPLIER = 0x9E3779B97F4A7C15
 
 #-----------------------------------------------------------------------------
 # Typedefs
@@ -190,3 +194,160 @@ def _rspatial_euclidean(real[:, ::1] X, double d_min):
         n_centers += 1
 
     return np.asarray(centers_buffer[:n_centers])
+
+
+#-----------------------------------------------------------------------------
+# Grid-hashed regular spatial clustering
+#-----------------------------------------------------------------------------
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef Py_ssize_t _grid_find(np.int64_t[::1] cell, np.int64_t[:, ::1] center_cells,
+                           np.int64_t[::1] table):
+    """Find the slot of the hash table which holds the centers in `cell`,
+    or the empty slot where they would be inserted."""
+    cdef Py_ssize_t k, slot
+    cdef Py_ssize_t mask = table.shape[0] - 1
+    cdef np.int64_t head
+    cdef np.uint64_t h = 0
+    cdef int n_features = cell.shape[0]
+
+    for k in range(n_features):
+        h = (h ^ <np.uint64_t> cell[k]) * GRID_HASH_MULTIPLIER
+    slot = <Py_ssize_t> ((h ^ (h >> 29)) & <np.uint64_t> mask)
+
+    while True:
+        head = table[slot]
+        if head < 0:
+            return slot
+        for k in range(n_features):
+            if center_cells[head, k] != cell[k]:
+                break
+        else:
+            return slot
+        slot = (slot + 1) & mask
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+def _rspatial_euclidean_grid(real[:, ::1] X, double d_min):
+    """Regular spatial clustering with a euclidean distance metric, with the
+    cluster centers bucketed into a uniform grid
+
+    Space is divided into cubic cells with edge length `d_min`, and the
+    centers are stored in a hash table keyed on their cell. Any center
+    within `d_min` of a point lies in one of the 3**n_features cells
+    adjacent to (or equal to) the point's cell, so only those cells are
+    checked. When there are fewer centers than neighboring cells (in many
+    dimensions), all of the centers are checked instead.
+
+    Parameters
+    ----------
+    X : 2d array
+        The data array
+    d_min : double
+        The minimum distance between clusters
+
+    Returns
+    -------
+    cluster_centers : 2d array
+        The same subset of the data points in X as `_rspatial_euclidean`.
+    """
+    cdef Py_ssize_t i, j, k, slot, n_centers = 0, n_occupied = 0
+    cdef Py_ssize_t n_samples = X.shape[0]
+    cdef int n_features = X.shape[1]
+    cdef double d2_min = d_min*d_min
+    cdef double n_neighbor_cells = 3.0 ** n_features
+    cdef double dist2, diff
+    cdef np.int64_t c
+    cdef bint is_center
+    cdef np.int64_t[::1] cell = zeros(n_features, dtype=np.int64)
+    cdef np.int64_t[::1] neighbor = zeros(n_features, dtype=np.int64)
+    cdef np.int64_t[::1] offset = zeros(n_features, dtype=np.int64)
+    cdef np.int64_t[::1] table, old_table
+    cdef np.int64_t[::1] next_center
+    cdef np.int64_t[:, ::1] center_cells
+    cdef np.int64_t[::1] center_indices
+
+    center_indices = zeros(INITIAL_CENTERS_BUFFER_SIZE, dtype=np.int64)
+    center_cells = zeros((INITIAL_CENTERS_BUFFER_SIZE, n_features), dtype=np.int64)
+    next_center = zeros(INITIAL_CENTERS_BUFFER_SIZE, dtype=np.int64)
+    table = -np.ones(INITIAL_GRID_TABLE_SIZE, dtype=np.int64)
+
+    for i in range(n_samples):
+        for k in range(n_features):
+            cell[k] = <np.int64_t> floor(X[i, k] / d_min)
+
+        is_center = True
+        if n_centers < n_neighbor_cells:
+            # scan all of the centers
+            for j in range(n_centers):
+                dist2 = 0
+                for k in range(n_features):
+                    diff = X[i, k] - X[center_indices[j], k]
+                    dist2 += diff*diff
+                    if dist2 >= d2_min:
+                        break
+                if dist2 < d2_min:
+                    is_center = False
+                    break
+        else:
+            # scan the centers in the neighboring cells, enumerating the
+            # offsets in {-1, 0, 1}**n_features like an odometer
+            for k in range(n_features):
+                offset[k] = -1
+            while is_center:
+                for k in range(n_features):
+                    neighbor[k] = cell[k] + offset[k]
+                c = table[_grid_find(neighbor, center_cells, table)]
+                while c >= 0:
+                    dist2 = 0
+                    for k in range(n_features):
+                        diff = X[i, k] - X[center_indices[c], k]
+                        dist2 += diff*diff
+                        if dist2 >= d2_min:
+                            break
+                    if dist2 < d2_min:
+                        is_center = False
+                        break
+                    c = next_center[c]
+
+                k = 0
+                while k < n_features and offset[k] == 1:
+                    offset[k] = -1
+                    k += 1
+                if k == n_features:
+                    break
+                offset[k] += 1
+
+        if not is_center:
+            continue
+
+        # add X[i] as a new center, enlarging the buffers if necessary
+        if n_centers == center_indices.shape[0]:
+            center_indices = np.concatenate(
+                (center_indices, zeros(n_centers, dtype=np.int64)))
+            center_cells = np.concatenate(
+                (center_cells, zeros((n_centers, n_features), dtype=np.int64)))
+            next_center = np.concatenate(
+                (next_center, zeros(n_centers, dtype=np.int64)))
+        center_indices[n_centers] = i
+        center_cells[n_centers, :] = cell
+
+        slot = _grid_find(cell, center_cells, table)
+        next_center[n_centers] = table[slot]
+        if table[slot] < 0:
+            n_occupied += 1
+        table[slot] = n_centers
+        n_centers += 1
+
+        if 2 * n_occupied > table.shape[0]:
+            # rehash the occupied cells into a table twice as large
+            old_table = table
+            table = -np.ones(2 * old_table.shape[0], dtype=np.int64)
+            for j in range(old_table.shape[0]):
+                if old_table[j] >= 0:
+                    table[_grid_find(center_cells[old_table[j]], center_cells, table)] = old_table[j]
+
+    return np.asarray(X)[np.asarray(center_indices[:n_centers])]
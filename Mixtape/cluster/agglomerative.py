@@ -40,14 +40,24 @@ except ImportError:
 #-----------------------------------------------------------------------------
 
 
-__all__ = ['_LandmarkAgglomerative']
-
-POOLING_FUNCTIONS = {
-    'average': lambda x: np.mean(x, axis=1),
-    'complete': lambda x: np.max(x, axis=1),
-    'single': lambda x: np.min(x, axis=1),
+__all__ = ['_LandmarkAgglomerative', 'nn_chain_linkage']
+
+# ufuncs that pool distances over the landmarks in each cluster, by
+# reduceat() over landmarks sorted by label. 'average' divides the sums by
+# the cluster sizes afterwards.
+POOLING_UFUNCS = {
+    'average': np.add,
+    'complete': np.maximum,
+    'single': np.minimum,
 }
 
+# Largest condensed distance matrix (in bytes) for which fit() uses the
+# standard linkage. Above this, `nn_chain_linkage` is used instead.
+MAX_CONDENSED_BYTES = 2**30
+# Approximate size (in bytes) of the blocks of distances computed at a time
+# by predict() and `nn_chain_linkage`
+BLOCK_BYTES = 2**26
+
 
 #-----------------------------------------------------------------------------
 # Utilities
@@ -58,11 +68,15 @@ def pdist(X, metric='euclidean'):
     if isinstance(metric, six.string_types):
         return scipy.spatial.distance.pdist(X, metric)
 
+    # fill the condensed matrix one row at a time, computing only the
+    # distances to the later samples
     n = len(X)
-    d = np.empty((n, n))
-    for i in range(n):
-        d[i, :] = metric(X, X, i)
-    return scipy.spatial.distance.squareform(d, checks=False)
+    d = np.empty(n * (n - 1) // 2)
+    start = 0
+    for i in range(n - 1):
+        d[start:start + n - i - 1] = metric(X[i + 1:], X, i)
+        start += n - i - 1
+    return d
 
 
 def cdist(XA, XB, metric='euclidean'):
@@ -76,6 +90,112 @@ def cdist(XA, XB, metric='euclidean'):
     return d
 
 
+def nn_chain_linkage(X, metric='euclidean', method='average'):
+    """Hierarchical clustering with the nearest-neighbor chain algorithm,
+    without storing the matrix of pairwise distances.
+
+    The distances between clusters are recomputed from the data points as
+    needed, in blocks, so the memory required is O(n_samples) rather than
+    O(n_samples**2), at the cost of more distance evaluations. The single,
+    complete and average linkages are reducible, so the nearest-neighbor
+    chain gives the same hierarchy as the standard algorithms [1].
+
+    Parameters
+    ----------
+    X : array-like, shape=(n_samples, n_features)
+        The data points
+    metric : string or callable, default="euclidean"
+        Metric used to compute the distance between samples.
+    method : {'single', 'complete', 'average'}, default='average'
+        The linkage criterion.
+
+    Returns
+    -------
+    Z : np.ndarray, shape=(n_samples - 1, 4)
+        The hierarchical clustering encoded as a linkage matrix, in the
+        same format as `scipy.cluster.hierarchy.linkage`.
+
+    References
+    ----------
+    .. [1] Mullner, D. "Modern hierarchical, agglomerative clustering
+        algorithms." arXiv:1109.2378 (2011).
+    """
+    try:
+        ufunc = POOLING_UFUNCS[method]
+    except KeyError:
+        raise ValueError('linkage=%s is not supported' % method)
+
+    n = len(X)
+    # every cluster is identified by one of its points, its "slot"
+    slots = np.arange(n)
+    sizes = np.ones(n)
+    active = np.ones(n, dtype=bool)
+    block = max(1, BLOCK_BYTES // (8 * n))
+
+    def cluster_distances(a):
+        # distance from cluster `a` to every active cluster
+        members = np.where(slots == a)[0]
+        pooled = None
+        for start in range(0, len(members), block):
+            d = ufunc.reduce(cdist(X[members[start:start+block]], X, metric), axis=0)
+            pooled = d if pooled is None else ufunc(pooled, d)
+
+        if method == 'average':
+            d = np.bincount(slots, weights=pooled, minlength=n) / (len(members) * sizes)
+        else:
+            d = np.empty(n)
+            d.fill(np.inf if method == 'single' else -np.inf)
+            ufunc.at(d, slots, pooled)
+        d[~active] = np.inf
+        d[a] = np.inf
+        return d
+
+    merges = []
+    chain = []
+    for _ in range(n - 1):
+        while True:
+            if len(chain) == 0:
+                chain.append(np.where(active)[0][0])
+            a = chain[-1]
+            d = cluster_distances(a)
+            b = np.argmin(d)
+            # prefer the previous element of the chain in case of ties
+            if len(chain) > 1 and d[chain[-2]] <= d[b]:
+                b = chain[-2]
+                break
+            chain.append(b)
+
+        # a and b are reciprocal nearest neighbors: merge them
+        chain = chain[:-2]
+        merges.append((a, b, d[b]))
+        slots[slots == b] = a
+        sizes[a] += sizes[b]
+        active[b] = False
+
+    # sort the merges by distance, and relabel the clusters following the
+    # conventions of scipy.cluster.hierarchy.linkage
+    merges.sort(key=lambda m: m[2])
+    parent = np.arange(n)
+    cluster_id = np.arange(n)
+    cluster_size = np.ones(n)
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    Z = np.zeros((n - 1, 4))
+    for k, (a, b, dist) in enumerate(merges):
+        ra, rb = find(a), find(b)
+        Z[k] = [min(cluster_id[ra], cluster_id[rb]), max(cluster_id[ra], cluster_id[rb]),
+                dist, cluster_size[ra] + cluster_size[rb]]
+        parent[rb] = ra
+        cluster_id[ra] = n + k
+        cluster_size[ra] += cluster_size[rb]
+    return Z
+
+
 #-----------------------------------------------------------------------------
 # Main Code
 #-----------------------------------------------------------------------------
@@ -175,15 +295,21 @@ class _LandmarkAgglomerative(BaseEstimator, ClusterMixin, TransformerMixin):
         if isinstance(memory, six.string_types):
             memory = Memory(cachedir=memory, verbose=0)
         if self.n_landmarks is None:
-            distances = memory.cache(pdist)(X, self.metric)
+            landmarks = X
         else:
             if self.landmark_strategy == 'random':
                 land_indices = check_random_state(self.random_state).randint(len(X), size=self.n_landmarks)
             else:
-                land_indices = np.arange(len(X))[::(len(X)/self.n_landmarks)][:self.n_landmarks]
-            distances = memory.cache(pdist)(X[land_indices], self.metric)
+                land_indices = np.arange(len(X))[::(len(X)//self.n_landmarks)][:self.n_landmarks]
+            landmarks = X[land_indices]
 
-        tree = memory.cache(linkage)(distances, method=self.linkage)
+        n = len(landmarks)
+        if 8 * n * (n - 1) / 2 <= MAX_CONDENSED_BYTES:
+            distances = memory.cache(pdist)(landmarks, self.metric)
+            tree = memory.cache(linkage)(distances, method=self.linkage)
+        else:
+            # the condensed distance matrix won't fit in memory
+            tree = memory.cache(nn_chain_linkage)(landmarks, self.metric, self.linkage)
         self.landmark_labels_ = fcluster(tree, criterion='maxclust', t=self.n_clusters) - 1
         
         if self.n_landmarks is None:
@@ -207,23 +333,29 @@ class _LandmarkAgglomerative(BaseEstimator, ClusterMixin, TransformerMixin):
             Index of the cluster each sample belongs to.
         """
 
-        dists = cdist(X, self.landmarks_, self.metric)
-
         try:
-            pooling_func = POOLING_FUNCTIONS[self.linkage]
+            ufunc = POOLING_UFUNCS[self.linkage]
         except KeyError:
             raise ValueError('linkage=%s is not supported' % self.linkage)
 
-        pooled_distances = np.empty(len(X))
-        pooled_distances.fill(np.infty)
-        labels = np.zeros(len(X), dtype=int)
+        # sort the landmarks by label, so that the distances to the
+        # landmarks in each cluster can be pooled with one reduceat()
+        order = np.argsort(self.landmark_labels_, kind='mergesort')
+        cluster_labels, starts = np.unique(
+            self.landmark_labels_[order], return_index=True)
+        counts = np.diff(np.append(starts, len(order)))
+        landmarks = self.landmarks_[order]
 
-        for i in range(self.n_clusters):
-            if np.any(self.landmark_labels_ == i):
-                d = pooling_func(dists[:, self.landmark_labels_ == i])
-                mask = (d < pooled_distances)
-                pooled_distances[mask] = d[mask]
-                labels[mask] = i
+        # stream X in blocks, so that the full matrix of distances from X
+        # to the landmarks is never stored
+        labels = np.zeros(len(X), dtype=int)
+        block = max(1, BLOCK_BYTES // (8 * len(landmarks)))
+        for start in range(0, len(X), block):
+            dists = cdist(X[start:start+block], landmarks, self.metric)
+            pooled = ufunc.reduceat(dists, starts, axis=1)
+            if self.linkage == 'average':
+                pooled /= counts
+            labels[start:start+block] = cluster_labels[np.argmin(pooled, axis=1)]
 
         return labels
 
@@ -22,13 +22,15 @@
 
 from __future__ import absolute_import, print_function, division
 import numpy as np
+import mdtraj as md
 from six import string_types, PY2
 from scipy.spatial.distance import cdist
 from sklearn.utils import check_random_state
 from sklearn.base import BaseEstimator, ClusterMixin, TransformerMixin
 
-from mixtape.cluster._commonc import _predict_labels, _predict_labels_euclidean
-from mixtape.cluster._kcentersc import _kcenters_euclidean
+from mixtape.cluster._commonc import (_predict_labels, _predict_labels_euclidean,
+                                      _predict_labels_rmsd)
+from mixtape.cluster._kcentersc import _kcenters_euclidean, _kcenters_rmsd
 from mixtape.cluster import MultiSequenceClusterMixin
 from mixtape.cluster.regularspatial import _arrayify
 
@@ -52,11 +54,16 @@ class _KCenters(BaseEstimator, ClusterMixin, TransformerMixin):
         function should have the signature shown below in
         the Notes. Alternatively, `metric` can be a string. In
         that case, it should be one of the metric strings
-        accepted by scipy.spatial.distance.
+        accepted by scipy.spatial.distance, or 'rmsd' (equivalent
+        to md.rmsd) to cluster MD trajectories.
     random_state : integer or numpy.RandomState, optional
         The generator used to initialize the centers. If an integer is
         given, it fixes the seed. Defaults to the global numpy random
         number generator.
+    opt : bool, default=True
+        Use an optimized, multithreaded code path for fit() and predict()
+        applicable when metric=='euclidean' and the data are numpy arrays,
+        or when metric is 'rmsd' or md.rmsd and the data are trajectories.
 
     Notes
     -----
@@ -108,13 +115,18 @@ class _KCenters(BaseEstimator, ClusterMixin, TransformerMixin):
                 _kcenters_euclidean(X, self.n_clusters, new_center_index)
             return self
 
+        if self.opt and self._is_rmsd and isinstance(X, md.Trajectory):
+            self.cluster_centers_, self.distances_, self.labels_ = \
+                _kcenters_rmsd(X, self.n_clusters, new_center_index)
+            return self
+
         self.labels_ = np.zeros(n_samples, dtype=int)
         self.distances_ = np.empty(n_samples, dtype=float)
         self.distances_.fill(np.inf)
 
         metric_function = self._metric_function
 
-        if isinstance(self.metric, string_types):
+        if isinstance(self.metric, string_types) and not self._is_rmsd:
             self.cluster_centers_ = np.zeros((self.n_clusters, X.shape[1]))
         else:
             # this should be a list, not a numpy array, so that
@@ -130,7 +142,7 @@ class _KCenters(BaseEstimator, ClusterMixin, TransformerMixin):
             self.cluster_centers_[i] = X[new_center_index]
             new_center_index = np.argmax(self.distances_)
 
-        if not isinstance(self.metric, string_types):
+        if not isinstance(self.metric, string_types) or self._is_rmsd:
             self.cluster_centers_ = _arrayify(self.cluster_centers_)
 
         return self
@@ -154,6 +166,8 @@ class _KCenters(BaseEstimator, ClusterMixin, TransformerMixin):
         """
         if self.opt and self.metric == 'euclidean' and isinstance(X, np.ndarray):
             return _predict_labels_euclidean(X, self.cluster_centers_)
+        if self.opt and self._is_rmsd and isinstance(X, md.Trajectory):
+            return _predict_labels_rmsd(X, self.cluster_centers_)
 
         metric_function = self._metric_function
         return _predict_labels(X, self.cluster_centers_, metric_function)
@@ -161,8 +175,15 @@ class _KCenters(BaseEstimator, ClusterMixin, TransformerMixin):
     def fit_predict(self, X, y=None):
         return self.fit(X, y).labels_
 
+    @property
+    def _is_rmsd(self):
+        return self.metric is md.rmsd or (
+            isinstance(self.metric, string_types) and self.metric == 'rmsd')
+
     @property
     def _metric_function(self):
+        if self._is_rmsd:
+            return md.rmsd
         if isinstance(self.metric, string_types):
             # distance from r[i] to each frame in t (output is a vector of length len(t)
             # using scipy.spatial.distance.cdist
@@ -26,6 +26,7 @@ import numpy as np
 from sklearn.utils import array2d
 from sklearn.base import BaseEstimator, ClusterMixin, TransformerMixin
 from mixtape.cluster import MultiSequenceClusterMixin
+from mixtape.cluster._commonc import _predict_labels_euclidean
 
 __all__ = ['NDGrid']
 EPS = 1e-10
@@ -54,21 +55,46 @@ class _NDGrid(BaseEstimator, ClusterMixin, TransformerMixin):
     max : {float, array-like, None}, optional
         Upper bin edge. If None (default), the min and max for each feature
         will be fit during training.
+    sparse : bool, default=False
+        If True, only the grid cells that are occupied by the training data
+        become states. Each occupied tuple of bin indices is hashed to a
+        compact state index during fit, so the number of states is at most
+        the number of training samples, instead of
+        :math:`n_bins^{n_features}`. Use this for grids in more than a
+        handful of dimensions, where the dense state space is mostly empty
+        (and its size may not even fit in a 64-bit integer). See `unseen`
+        for how samples in cells that were not occupied during training
+        are labeled.
+    unseen : {'label', 'nearest'}, default='label'
+        Only used if `sparse`. How predict labels samples that fall in a
+        grid cell that was not occupied during training. With 'label',
+        they get the label -1. **Note that -1 is not a valid state index**:
+        these samples must be removed (or the trajectories split at them)
+        before the labels are passed to e.g. MarkovStateModel. With
+        'nearest', they are assigned to the occupied cell whose center is
+        closest (in euclidean distance) to the sample.
 
     Attributes
     ----------
     n_features : int
         Number of features
     n_bins : int
-        The total number of bins
+        The total number of bins. If `sparse`, this is the number of
+        occupied bins.
     grid : np.ndarray, shape=[n_features, n_bins_per_feature+1]
         Bin edges
+    occupied_bins_ : np.ndarray, shape=[n_bins, n_features]
+        Only if `sparse`. The bin indices, along each feature, of the
+        cell corresponding to each state.
     """
 
-    def __init__(self, n_bins_per_feature=2, min=None, max=None):
+    def __init__(self, n_bins_per_feature=2, min=None, max=None, sparse=False,
+                 unseen='label'):
         self.n_bins_per_feature = n_bins_per_feature
         self.min = min
         self.max = max
+        self.sparse = sparse
+        self.unseen = unseen
         # unknown until we have the number of features
         self.n_features = None
         self.n_bins = None
@@ -87,8 +113,17 @@ class _NDGrid(BaseEstimator, ClusterMixin, TransformerMixin):
         self
         """
         X = array2d(X)
+        if self.unseen not in ('label', 'nearest'):
+            raise ValueError("unseen must be one of 'label' or 'nearest'. "
+                             "you supplied %r" % (self.unseen,))
         self.n_features = X.shape[1]
-        self.n_bins = self.n_bins_per_feature**self.n_features
+        # with python ints, so that this can't silently wrap around if
+        # n_bins_per_feature is a numpy integer
+        self.n_bins = int(self.n_bins_per_feature)**self.n_features
+        if not self.sparse and self.n_bins > np.iinfo(np.int64).max:
+            raise ValueError('%d bins in %d dimensions overflows the state '
+                             'index. Use sparse=True.' % (
+                             self.n_bins_per_feature, self.n_features))
 
         if self.min is None:
             min = np.min(X, axis=0)
@@ -110,8 +145,32 @@ class _NDGrid(BaseEstimator, ClusterMixin, TransformerMixin):
         
         self.grid = np.array([np.linspace(min[i]-EPS, max[i]+EPS, self.n_bins_per_feature + 1) for i in range(self.n_features)])
 
+        if self.sparse:
+            # the sorted, unique bin tuples form the lookup table for
+            # predict(). their position in the table is the state index
+            self._bin_keys = np.unique(self._bin_keys_of(self._binassign(X)))
+            self.occupied_bins_ = self._bin_keys.view(np.int64).reshape(
+                -1, self.n_features)
+            self.n_bins = len(self._bin_keys)
+
         return self
 
+    def _binassign(self, X):
+        """Index of the bin containing each sample, along each feature"""
+        if np.any(X < self.grid[:, 0]) or np.any(X > self.grid[:, -1]):
+            raise ValueError('data out of min/max bounds')
+
+        binassign = np.zeros((len(X), self.n_features), dtype=np.int64)
+        for i in range(self.n_features):
+            binassign[:, i] = np.digitize(X[:, i], self.grid[i]) - 1
+        return binassign
+
+    def _bin_keys_of(self, binassign):
+        """View each row of bin indices as a single hashable/sortable
+        scalar, so that the rows can be looked up with searchsorted"""
+        binassign = np.ascontiguousarray(binassign, dtype=np.int64)
+        return binassign.view(np.dtype((np.void, 8*self.n_features))).ravel()
+
     def predict(self, X):
         """Get the index of the grid cell containing each sample in X
         
@@ -123,19 +182,38 @@ class _NDGrid(BaseEstimator, ClusterMixin, TransformerMixin):
         Returns
         -------
         y : array, shape = [n_samples,]
-            Index of the grid cell containing each sample
+            Index of the grid cell containing each sample. If `sparse` and
+            `unseen='label'`, samples in cells that were unoccupied during
+            fit get -1.
         """
-        if np.any(X < self.grid[:, 0]) or np.any(X > self.grid[:, -1]):
-            raise ValueError('data out of min/max bounds')
-
-        binassign = np.zeros((self.n_features, len(X)), dtype=int)
-        for i in range(self.n_features):
-            binassign[i] = np.digitize(X[:, i], self.grid[i]) - 1
-        labels = np.dot(self.n_features**np.arange(self.n_features), binassign)
+        binassign = self._binassign(X)
+
+        if self.sparse:
+            keys = self._bin_keys_of(binassign)
+            labels = np.searchsorted(self._bin_keys, keys)
+            labels[labels == self.n_bins] = 0
+            missing = self._bin_keys[labels] != keys
+            if self.unseen == 'nearest' and np.any(missing):
+                labels[missing] = _predict_labels_euclidean(
+                    np.asarray(X, dtype=np.float64)[missing],
+                    self._cell_centers())
+            else:
+                labels[missing] = -1
+            return labels
+
+        strides = self.n_bins_per_feature**np.arange(self.n_features, dtype=np.int64)
+        labels = np.dot(binassign, strides)
 
         assert np.max(labels) < self.n_bins
         return labels
 
+    def _cell_centers(self):
+        """Coordinates of the center of each occupied cell"""
+        index = np.arange(self.n_features)
+        lower = self.grid[index, self.occupied_bins_]
+        upper = self.grid[index, self.occupied_bins_ + 1]
+        return 0.5 * (lower + upper)
+
     def fit_predict(self, X, y=None):
         return self.fit(X).predict(X)
 
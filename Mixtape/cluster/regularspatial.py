@@ -21,7 +21,9 @@
 #-----------------------------------------------------------------------------
 
 from __future__ import absolute_import, print_function, division
+import itertools
 import numpy as np
+import mdtraj as md
 from six import string_types, PY2
 from scipy.spatial.distance import cdist
 from sklearn.base import BaseEstimator, ClusterMixin, TransformerMixin
@@ -32,6 +34,13 @@ from mixtape.cluster import MultiSequenceClusterMixin
 
 __all__ = ['RegularSpatial']
 
+# scipy.spatial.distance metrics which satisfy the triangle inequality (for
+# which the pivot grid in `_rspatial_pivots` is valid)
+_TRIANGLE_METRICS = ('euclidean', 'cityblock', 'chebyshev', 'minkowski',
+                     'canberra', 'hamming', 'jaccard')
+# number of pivots used by `_rspatial_pivots` for such metrics
+_N_PIVOTS = 3
+
 #-----------------------------------------------------------------------------
 # Code
 #-----------------------------------------------------------------------------
@@ -49,6 +58,68 @@ def _arrayify(list_like):
     else:
         return list_like[0].join(list_like[1:])
 
+def _rspatial_pivots(X, d_min, metric_function, n_pivots):
+    """Regular spatial clustering with an arbitrary metric, with the cluster
+    centers bucketed into a grid over their distances to a set of pivots
+
+    Each sample is keyed on floor(d(x, p) / d_min) for each pivot p. If the
+    metric satisfies the triangle inequality, a center within `d_min` of a
+    sample has a key which differs from the sample's by at most one in each
+    pivot, so only the centers in those 3**n_pivots buckets are checked.
+    With `n_pivots=0`, all of the centers are checked, which is valid for
+    any metric.
+
+    Parameters
+    ----------
+    X : array-like or md.Trajectory
+        The data
+    d_min : float
+        The minimum distance between clusters
+    metric_function : callable
+        Metric with the signature ``metric_function(X, Y, yi)``
+    n_pivots : int
+        Number of pivots. The pivots are chosen from X by farthest point
+        traversal.
+
+    Returns
+    -------
+    center_indices : np.ndarray, dtype=int
+        The indices in X of the cluster centers
+    """
+    n_samples = len(X)
+    if n_pivots > 0:
+        pivot = 0
+        pivot_distances = []
+        for _ in range(n_pivots):
+            pivot_distances.append(np.asarray(metric_function(X, X, pivot), dtype=float))
+            pivot = np.argmax(np.min(pivot_distances, axis=0))
+        keys = np.floor(np.array(pivot_distances).T / d_min).astype(np.int64)
+        keys = [tuple(key) for key in keys]
+        offsets = list(itertools.product((-1, 0, 1), repeat=n_pivots))
+
+    buckets = {}
+    center_indices = []
+    for i in range(n_samples):
+        if n_pivots > 0:
+            candidates = []
+            for offset in offsets:
+                neighbor = tuple(k + o for k, o in zip(keys[i], offset))
+                candidates.extend(buckets.get(neighbor, ()))
+        else:
+            candidates = center_indices
+
+        if len(candidates) > 0:
+            d = metric_function(X[np.array(candidates)], X, i)
+            if not np.all(d > d_min):
+                continue
+
+        center_indices.append(i)
+        if n_pivots > 0:
+            buckets.setdefault(keys[i], []).append(i)
+
+    return np.array(center_indices, dtype=int)
+
+
 class _RegularSpatial(BaseEstimator, ClusterMixin, TransformerMixin):
     """Regular spatial clustering.
 
@@ -65,7 +136,13 @@ class _RegularSpatial(BaseEstimator, ClusterMixin, TransformerMixin):
         that case, it should be one of the metric strings
         accepted by scipy.spatial.distance.
     opt : bool, default=True
-        Use an optimized code path for fit() applicable when metric=='euclidean'
+        Use an optimized code path for fit(). When metric=='euclidean' and
+        the data are numpy arrays, the cluster centers are bucketed in a
+        uniform grid with cell width d_min, so that each point is only
+        compared to the centers in the neighboring cells. For md.rmsd and
+        the scipy.spatial.distance metrics which satisfy the triangle
+        inequality, the centers are bucketed by their distances to a few
+        pivot points instead.
 
     Notes
     -----
@@ -105,7 +182,7 @@ class _RegularSpatial(BaseEstimator, ClusterMixin, TransformerMixin):
     def fit(self, X, y=None):
         if self.opt and self.metric == 'euclidean' and isinstance(X, np.ndarray):
             X = np.asarray(X, dtype=np.float64, order='c')
-            self.cluster_centers_ = _regularspatialc._rspatial_euclidean(X, float(self.d_min))
+            self.cluster_centers_ = _regularspatialc._rspatial_euclidean_grid(X, float(self.d_min))
             self.n_clusters_ = len(self.cluster_centers_)
             return self
 
@@ -114,6 +191,16 @@ class _RegularSpatial(BaseEstimator, ClusterMixin, TransformerMixin):
         if len(X) == 0:
             raise ValueError('len(X) must be greater than 0')
 
+        if self.opt:
+            if self.metric is md.rmsd or self.metric in _TRIANGLE_METRICS:
+                n_pivots = _N_PIVOTS
+            else:
+                n_pivots = 0
+            center_indices = _rspatial_pivots(X, self.d_min, metric_function, n_pivots)
+            self.cluster_centers_ = X[center_indices]
+            self.n_clusters_ = len(self.cluster_centers_)
+            return self
+
         self.cluster_centers_ = [X[0]]
         for i in range(1, len(X)):
             d = metric_function(_arrayify(self.cluster_centers_), X, i)
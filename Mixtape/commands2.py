@@ -36,7 +36,7 @@ from mixtape.sparsetica import SparseTICA
 from mixtape.cluster import KMeans, KCenters
 from mixtape.featurizer import (ContactFeaturizer, DihedralFeaturizer,
                                 AtomPairsFeaturizer, SuperposeFeaturizer,
-                                DRIDFeaturizer)
+                                DRIDFeaturizer, iterfeaturize)
 from mixtape.cmdline import NumpydocClassCommand, argument
 
 #-----------------------------------------------------------------------------
@@ -52,6 +52,9 @@ class ContactFeaturizerCommand(NumpydocClassCommand):
         using mdtraj.iterload''', default=10000, type=int)
     out = argument('--out', required=True, help='Output path')
     stride = argument('--stride', default=1, type=int, help='Load only every stride-th frame')
+    n_jobs = argument('--n-jobs', default=1, type=int, help='''Number of
+        worker processes to featurize trajectories with. Use -1 for one
+        process per CPU.''')
 
     def _contacts_type(self, val):
         if val is 'all':
@@ -66,16 +69,18 @@ class ContactFeaturizerCommand(NumpydocClassCommand):
         else:
             top = None
 
+        filenames = [fn for item in self.trjs for fn in glob.glob(item)]
+        n_jobs = None if self.n_jobs < 0 else self.n_jobs
+
         dataset = []
-        for item in self.trjs:
-            for trjfn in glob.glob(item):
-                trajectory = []
-                for i, chunk in enumerate(md.iterload(trjfn, stride=self.stride, chunk=self.chunk, top=top)):
-                    print('\r{} chunk {}'.format(os.path.basename(trjfn), i), end='')
-                    sys.stdout.flush()
-                    trajectory.append(self.instance.partial_transform(chunk))
-                print()
-                dataset.append(np.concatenate(trajectory))
+        for i, trjfn, features, seconds in iterfeaturize(
+                filenames, self.instance, top, chunk=self.chunk,
+                stride=self.stride, n_jobs=n_jobs):
+            print('{} ({}/{}): {} frames in {:.2f} s ({:.1f} frames/s)'.format(
+                os.path.basename(trjfn), i + 1, len(filenames), len(features),
+                seconds, len(features) / max(seconds, 1e-9)))
+            sys.stdout.flush()
+            dataset.append(features)
 
         verbosedump(dataset, self.out)
         print('All done')
@@ -0,0 +1,386 @@
+# Copyright (c) 2014, Stanford University and the Authors
+# All rights reserved.
+#
+# Mixtape is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation, either version 2.1
+# of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with Mixtape. If not, see <http://www.gnu.org/licenses/>.
+
+"""Content-addressed on-disk cache for featurized trajectories.
+
+Featurizing MD trajectories is often the most expensive step in a
+pipeline, and it is usually repeated with identical inputs every time the
+pipeline (or a parameter sweep over the later stages) is rerun. The
+`FeatureCache` stores featurized trajectories as ``.npy`` files in a
+directory, keyed on a hash of the featurizer's parameters and either the
+identity of the trajectory file (path, size and modification time), the
+topology used to load it and the frame range, or the coordinates of an
+in-memory trajectory.
+"""
+
+#-----------------------------------------------------------------------------
+# Imports
+#-----------------------------------------------------------------------------
+
+from __future__ import print_function, division, absolute_import
+
+import os
+import sys
+import numbers
+import hashlib
+import tempfile
+import numpy as np
+import mdtraj as md
+import sklearn.base
+from mixtape.featurizer import Featurizer
+
+__all__ = ['FeatureCache', 'CachedFeaturizer']
+
+#-----------------------------------------------------------------------------
+# Code
+#-----------------------------------------------------------------------------
+
+
+# types whose repr is deterministic (and doesn't include an address)
+_REPR_TYPES = (numbers.Number, np.generic, str, bytes, type(u''))
+
+
+def _hash_update(h, obj):
+    """Update the hash object `h` with a deterministic digest of `obj`"""
+    if isinstance(obj, np.ndarray):
+        h.update(('ndarray %s %s;' % (obj.dtype.str, obj.shape)).encode('utf-8'))
+        h.update(np.ascontiguousarray(obj).view(np.uint8))
+    elif isinstance(obj, md.Trajectory):
+        h.update(b'Trajectory;')
+        _hash_update(h, obj.xyz)
+        _hash_update(h, obj.unitcell_vectors)
+        _hash_update(h, [(a.name, a.residue.name, a.residue.index)
+                         for a in obj.topology.atoms])
+    elif isinstance(obj, md.Topology):
+        h.update(b'Topology;')
+        atoms = '\n'.join('%s %s %s %d %d' % (
+            a.name, a.element.symbol if a.element is not None else '',
+            a.residue.name, a.residue.index, a.residue.chain.index)
+            for a in obj.atoms)
+        h.update(atoms.encode('utf-8'))
+        _hash_update(h, np.array([(a.index, b.index) for a, b in obj.bonds],
+                                 dtype=int).reshape(-1, 2))
+    elif isinstance(obj, sklearn.base.BaseEstimator):
+        h.update(('%s;' % obj.__class__.__name__).encode('utf-8'))
+        _hash_update(h, obj.get_params(deep=False))
+    elif isinstance(obj, dict):
+        h.update(b'dict;')
+        for key in sorted(obj.keys()):
+            _hash_update(h, key)
+            _hash_update(h, obj[key])
+    elif isinstance(obj, (list, tuple)):
+        h.update(('%s %d;' % (type(obj).__name__, len(obj))).encode('utf-8'))
+        for item in obj:
+            _hash_update(h, item)
+    elif obj is None or isinstance(obj, _REPR_TYPES):
+        h.update(('%r;' % (obj,)).encode('utf-8'))
+    else:
+        # functions and classes are identified by name. the repr of anything
+        # else (e.g. a lambda) may include its address.
+        name = _qualified_name(obj)
+        if name is None:
+            raise TypeError("can't compute a cache key for %r: only numbers, "
+                            "strings, arrays, containers, and functions and "
+                            "classes defined at module level are supported"
+                            % (obj,))
+        h.update(('qualname %s;' % name).encode('utf-8'))
+
+
+def _qualified_name(obj):
+    """The full name of a function or class, or None if `obj` can't be
+    looked up by name (e.g. a lambda, or a bound method)"""
+    module = getattr(obj, '__module__', None)
+    name = getattr(obj, '__qualname__', getattr(obj, '__name__', None))
+    if not isinstance(module, str) or not isinstance(name, str):
+        return None
+    found = sys.modules.get(module)
+    for part in name.split('.'):
+        found = getattr(found, part, None)
+    if found is not obj:
+        return None
+    return '%s.%s' % (module, name)
+
+
+class FeatureCache(object):
+    """Content-addressed on-disk cache of featurized trajectories.
+
+    Each entry is stored as a ``.npy`` file, which can be read back
+    memory-mapped. When the total size of the cache exceeds `max_bytes`,
+    the least recently used entries are evicted. The cache is safe to
+    share between processes, so it can be passed to
+    `featurizer.featurize_all` or `featurizer.featurize_all_parallel`.
+
+    Parameters
+    ----------
+    directory : str
+        Directory in which to store the cached arrays. It will be created
+        if it does not exist.
+    max_bytes : int, optional
+        Maximum total size of the cached arrays, in bytes. If None, the
+        cache is allowed to grow without bound.
+    mmap_mode : {None, 'r', 'c'}, default='r'
+        Memory-map mode with which cached arrays are loaded. See `np.load`.
+
+    Notes
+    -----
+    The size of the cache is tracked in memory, by adding the size of each
+    new entry to the total found by the last scan of the directory, and the
+    directory is only rescanned when that running total exceeds
+    `max_bytes`. Entries are then evicted until the cache is 10% below the
+    limit, so that a full cache isn't rescanned on every write. When
+    several processes share a cache, each only sees the others' writes
+    when it rescans, so the limit is enforced approximately.
+
+    The parameters of a featurizer must be numbers, strings, arrays,
+    trajectories, topologies, estimators, containers of these, or functions
+    and classes defined at module level, so that the keys are the same in
+    every process. Other parameters (e.g. lambdas) raise a TypeError.
+    Entries that can't be read (e.g. truncated files) are removed, and
+    count as misses.
+    """
+
+    def __init__(self, directory, max_bytes=None, mmap_mode='r'):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.mmap_mode = mmap_mode
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        # running total of the size of the cache, or None before the first
+        # scan of the directory
+        self._n_bytes = None
+        # digests of recently hashed topologies, keyed on id()
+        self._topology_digests = {}
+
+    def _topology_digest(self, top):
+        """Digest of the topology used to load a trajectory file"""
+        if top is None:
+            return None
+        if isinstance(top, str):
+            stat = os.stat(top)
+            return ('file', os.path.abspath(top), stat.st_size, stat.st_mtime)
+        if isinstance(top, md.Trajectory):
+            top = top.topology
+
+        # hashing a large topology is expensive, so remember the digest of
+        # the same object when it's used to load many files. the topology
+        # itself is stored so that its id() can't be reused.
+        digests = self._topology_digests
+        cached = digests.get(id(top))
+        if cached is not None and cached[0] is top:
+            return cached[1]
+        h = hashlib.sha1()
+        _hash_update(h, top)
+        digests.clear()
+        digests[id(top)] = (top, h.hexdigest())
+        return h.hexdigest()
+
+    def file_key(self, featurizer, filename, skip=0, n_frames=None, stride=1,
+                 top=None):
+        """Compute the cache key for featurizing (part of) a trajectory file
+
+        Parameters
+        ----------
+        featurizer : Featurizer
+            The featurizer. Its class and `get_params()` enter the key.
+        filename : str
+            Path to the trajectory file. The absolute path, size and
+            modification time of the file enter the key.
+        skip : int
+            Index of the first frame to be featurized
+        n_frames : int, optional
+            Number of (strided) frames to be featurized, or None to read
+            through to the end of the file.
+        stride : int
+            Only every stride-th frame is featurized.
+        top : str, Topology, Trajectory, optional
+            Topology, or path to a topology file, used to load the file.
+            The contents of a Topology, or the path, size and modification
+            time of a topology file, enter the key.
+        """
+        stat = os.stat(filename)
+        h = hashlib.sha1()
+        _hash_update(h, featurizer)
+        _hash_update(h, (os.path.abspath(filename), stat.st_size,
+                         stat.st_mtime, skip, n_frames, stride,
+                         self._topology_digest(top)))
+        return h.hexdigest()
+
+    def trajectory_key(self, featurizer, traj):
+        """Compute the cache key for featurizing an in-memory trajectory
+
+        Parameters
+        ----------
+        featurizer : Featurizer
+            The featurizer. Its class and `get_params()` enter the key.
+        traj : mdtraj.Trajectory
+            The trajectory. Its coordinates, unit cell and topology enter
+            the key.
+        """
+        h = hashlib.sha1()
+        _hash_update(h, featurizer)
+        _hash_update(h, traj)
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.npy')
+
+    def get(self, key):
+        """Retrieve a cached array, or None if `key` is not in the cache"""
+        path = self._path(key)
+        try:
+            value = np.load(path, mmap_mode=self.mmap_mode)
+        except (IOError, ValueError, EOFError):
+            # missing, or truncated or corrupted: count it as a miss, and
+            # remove it so that it's rewritten
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        # mark this entry as recently used
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return value
+
+    def put(self, key, value):
+        """Store an array in the cache under `key`"""
+        # write to a temporary file and then rename it into place, so that
+        # concurrent readers never see a partially written array
+        fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, np.asarray(value))
+        path = self._path(key)
+        n_bytes = os.path.getsize(tmp)
+        try:
+            # replacing an existing entry
+            n_bytes -= os.path.getsize(path)
+        except OSError:
+            pass
+        os.rename(tmp, path)
+
+        if self.max_bytes is None:
+            return
+        if self._n_bytes is None:
+            self._n_bytes = self.n_bytes
+        else:
+            self._n_bytes += n_bytes
+        if self._n_bytes > self.max_bytes:
+            self._evict()
+
+    def _entries(self):
+        entries = []
+        for fn in os.listdir(self.directory):
+            if not fn.endswith('.npy'):
+                continue
+            path = os.path.join(self.directory, fn)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                # evicted by another process
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    @property
+    def n_bytes(self):
+        """Total size of the cached arrays, in bytes"""
+        return sum(size for _, size, _ in self._entries())
+
+    def _evict(self):
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        if total > self.max_bytes:
+            # remove the least recently used entries first
+            target = 0.9 * self.max_bytes
+            for _, size, path in entries:
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                total -= size
+        self._n_bytes = total
+
+    def clear(self):
+        """Remove all of the entries in the cache"""
+        for _, _, path in self._entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self._n_bytes = 0
+
+
+class CachedFeaturizer(Featurizer):
+    """Featurizer that caches the output of another featurizer on disk.
+
+    Trajectories are keyed on their coordinates, unit cell and topology,
+    together with the class and parameters of the wrapped featurizer. To
+    also skip loading the trajectory files, pass a `FeatureCache` to
+    `featurizer.featurize_all` instead, which keys on the identity of the
+    trajectory files.
+
+    Parameters
+    ----------
+    featurizer : Featurizer
+        The featurizer whose output is cached
+    directory : str
+        Directory in which to store the cached arrays
+    max_bytes : int, optional
+        Maximum total size of the cache, in bytes. If None, the cache is
+        allowed to grow without bound.
+    """
+
+    def __init__(self, featurizer, directory, max_bytes=None):
+        self.featurizer = featurizer
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._cache = FeatureCache(directory, max_bytes=max_bytes)
+
+    @property
+    def n_features(self):
+        return self.featurizer.n_features
+
+    def partial_transform(self, traj):
+        """Featurize an MD trajectory into a vector space, reusing cached
+        features if this trajectory has been featurized before.
+
+        Parameters
+        ----------
+        traj : mdtraj.Trajectory
+            A molecular dynamics trajectory to featurize.
+
+        Returns
+        -------
+        features : np.ndarray, dtype=float, shape=(n_samples, n_features)
+            A featurized trajectory is a 2D array of shape
+            `(length_of_trajectory x n_features)` where each `features[i]`
+            vector is computed by applying the featurization function
+            to the `i`th snapshot of the input trajectory.
+
+        See Also
+        --------
+        transform : simultaneously featurize a collection of MD trajectories
+        """
+        key = self._cache.trajectory_key(self.featurizer, traj)
+        features = self._cache.get(key)
+        if features is None:
+            features = self.featurizer.partial_transform(traj)
+            self._cache.put(key, features)
+        return features
@@ -22,12 +22,20 @@
 #-----------------------------------------------------------------------------
 from __future__ import print_function, division, absolute_import
 
+import os
+import json
+import time
+import itertools
+import multiprocessing
 from six.moves import cPickle
 import numpy as np
+import scipy.sparse
+import scipy.spatial
 import mdtraj as md
 import sklearn.base, sklearn.pipeline
 import warnings
 from sklearn.externals.joblib import Parallel, delayed
+from mixtape.utils import iterobjects
 
 
 #-----------------------------------------------------------------------------
@@ -35,7 +43,8 @@ from sklearn.externals.joblib import Parallel, delayed
 #-----------------------------------------------------------------------------
 
 
-def featurize_all(filenames, featurizer, topology, chunk=1000, stride=1):
+def featurize_all(filenames, featurizer, topology, chunk=1000, stride=1,
+                  cache=None):
     """Load and featurize many trajectory files.
 
     Parameters
@@ -54,6 +63,10 @@ def featurize_all(filenames, featurizer, topology, chunk=1000, stride=1):
         to be in memory at once)
     stride : int, default=1
         Only read every stride-th frame.
+    cache : FeatureCache, optional
+        If supplied, featurized trajectories are looked up in (and saved
+        to) this on-disk cache, keyed on the trajectory file, the topology
+        and the parameters of the featurizer.
 
     Returns
     -------
@@ -70,6 +83,17 @@ def featurize_all(filenames, featurizer, topology, chunk=1000, stride=1):
 
     for file in filenames:
         kwargs = {} if file.endswith('.h5') else {'top': topology}
+        if cache is not None:
+            key = cache.file_key(featurizer, file, stride=stride,
+                                 top=kwargs.get('top'))
+            x = cache.get(key)
+            if x is not None:
+                data.append(x)
+                indices.append(stride*np.arange(len(x)))
+                fns.extend([file] * len(x))
+                continue
+            start = len(data)
+
         count = 0
         for t in md.iterload(file, chunk=chunk, stride=stride, **kwargs):
             x = featurizer.partial_transform(t)
@@ -79,12 +103,272 @@ def featurize_all(filenames, featurizer, topology, chunk=1000, stride=1):
             indices.append(count + (stride*np.arange(n_frames)))
             fns.extend([file] * n_frames)
             count += (stride*n_frames)
+
+        if cache is not None and len(data) > start:
+            cache.put(key, np.concatenate(data[start:]))
     if len(data) == 0:
         raise ValueError("None!")
 
     return np.concatenate(data), np.concatenate(indices), np.array(fns)
 
 
+# Per-process state for the featurization worker pool. The featurizer,
+# topology and cache are sent to each worker once, by the pool initializer,
+# rather than being pickled along with every task.
+_worker_featurizer = None
+_worker_topology = None
+_worker_cache = None
+
+
+def _init_featurize_worker(featurizer, topology, cache=None):
+    global _worker_featurizer, _worker_topology, _worker_cache
+    _worker_featurizer = featurizer
+    _worker_topology = topology
+    _worker_cache = cache
+
+
+def _featurize_task(task):
+    """Featurize `n_frames` (strided) frames of a trajectory file, starting
+    at frame `skip`. If `n_frames` is None, read through to the end of the file.
+    """
+    file_index, filename, skip, n_frames, chunk, stride = task
+    start = time.time()
+
+    kwargs = {} if filename.endswith('.h5') else {'top': _worker_topology}
+    if _worker_cache is not None:
+        key = _worker_cache.file_key(_worker_featurizer, filename, skip=skip,
+                                     n_frames=n_frames, stride=stride,
+                                     top=kwargs.get('top'))
+        x = _worker_cache.get(key)
+        if x is not None:
+            # the task results are pickled back to the parent process, so
+            # there's no point in keeping this memory-mapped
+            x = np.asarray(x)
+            return file_index, [x], len(x), time.time() - start
+
+    if skip > 0:
+        kwargs['skip'] = skip
+
+    features = []
+    count = 0
+    for t in md.iterload(filename, chunk=chunk, stride=stride, **kwargs):
+        if n_frames is not None and count + len(t) > n_frames:
+            t = t[:n_frames - count]
+        features.append(_worker_featurizer.partial_transform(t))
+        count += len(t)
+        if n_frames is not None and count >= n_frames:
+            break
+
+    if _worker_cache is not None and len(features) > 0:
+        _worker_cache.put(key, np.concatenate(features))
+
+    return file_index, features, count, time.time() - start
+
+
+def _featurize_tasks(filenames, chunk, stride, frames_per_task):
+    for i, filename in enumerate(filenames):
+        if frames_per_task is None:
+            yield (i, filename, 0, None, chunk, stride)
+            continue
+
+        # split the file into ranges of `frames_per_task` strided frames,
+        # which can be featurized independently of one another
+        with md.open(filename) as f:
+            n_raw_frames = len(f)
+        step = frames_per_task * stride
+        for skip in range(0, max(n_raw_frames, 1), step):
+            yield (i, filename, skip, frames_per_task, chunk, stride)
+
+
+def _n_workers(n_jobs):
+    """Number of worker processes to start for `n_jobs`"""
+    if n_jobs is None:
+        return multiprocessing.cpu_count()
+    if n_jobs == 0:
+        raise ValueError('n_jobs == 0 has no meaning. use None or a '
+                         'positive integer for the number of processes, or '
+                         'a negative one to count back from the number of '
+                         'CPUs')
+    if n_jobs < 0:
+        return max(multiprocessing.cpu_count() + 1 + n_jobs, 1)
+    return n_jobs
+
+
+def iterfeaturize(filenames, featurizer, topology, chunk=1000, stride=1,
+                  n_jobs=None, frames_per_task=None, cache=None):
+    """Featurize many trajectory files in parallel, yielding the results in order.
+
+    The trajectory files (or, with `frames_per_task`, ranges of frames
+    within each file) are distributed over a pool of worker processes.
+    Results are yielded one file at a time, in the same order as
+    `filenames`, as soon as each file is complete, so that they can be
+    written to disk incrementally.
+
+    Parameters
+    ----------
+    filenames : list of strings
+        List of paths to MD trajectory files
+    featurizer : Featurizer
+        The featurizer to be invoked on each trajectory trajectory as
+        it is loaded. It must be picklable.
+    topology : str, Topology, Trajectory
+        Topology or path to a topology file, used to load trajectories with
+        MDTraj
+    chunk : int
+        Number of frames to load at once with md.iterload
+    stride : int, default=1
+        Only read every stride-th frame.
+    n_jobs : int, default=None
+        Number of worker processes. If None, use one process per CPU. If 1,
+        the featurization is done serially in this process. Negative
+        values count back from the number of CPUs, as in joblib (-1 for
+        all of them, -2 for all but one, ...).
+    frames_per_task : int, default=None
+        If not None, large files are split into ranges of this many
+        (strided) frames, which are featurized by different workers.
+    cache : FeatureCache, optional
+        If supplied, featurized trajectories (or ranges of frames) are
+        looked up in (and saved to) this on-disk cache.
+
+    Yields
+    ------
+    index : int
+        Index of the trajectory file in `filenames`
+    filename : str
+        Path to the trajectory file
+    features : np.ndarray, shape=(n_frames, n_features)
+        The featurized trajectory. features[i] is the featurized version
+        of the (stride*i)-th frame in the file.
+    seconds : float
+        Total time spent by the workers featurizing this file.
+    """
+    n_jobs = _n_workers(n_jobs)
+    tasks = _featurize_tasks(filenames, chunk, stride, frames_per_task)
+
+    if n_jobs == 1:
+        _init_featurize_worker(featurizer, topology, cache)
+        pool = None
+        results = (_featurize_task(task) for task in tasks)
+    else:
+        pool = multiprocessing.Pool(n_jobs, initializer=_init_featurize_worker,
+                                    initargs=(featurizer, topology, cache))
+        # imap returns the results in task order, even though they may
+        # be computed out of order
+        results = pool.imap(_featurize_task, tasks)
+
+    try:
+        grouped = itertools.groupby(results, key=lambda result: result[0])
+        for file_index, file_results in grouped:
+            features, seconds = [], 0
+            for _, x, _, elapsed in file_results:
+                features.extend(x)
+                seconds += elapsed
+            if len(features) == 0:
+                raise ValueError('No frames were loaded from %s' % filenames[file_index])
+            yield file_index, filenames[file_index], np.concatenate(features), seconds
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+
+def featurize_all_parallel(filenames, featurizer, topology, out, chunk=1000,
+                           stride=1, n_jobs=None, frames_per_task=None,
+                           cache=None):
+    """Featurize many trajectory files in parallel, writing the results to disk.
+
+    The featurized trajectories are written incrementally, in the same
+    order as `filenames`, to the directory `out`. Each trajectory is
+    saved as a separate ``.npy`` file, and a ``manifest.jsonl`` file
+    records the source filename, number of frames and featurization
+    throughput for each one. Use `load_featurized` to read the results.
+
+    Parameters
+    ----------
+    filenames : list of strings
+        List of paths to MD trajectory files
+    featurizer : Featurizer
+        The featurizer to be invoked on each trajectory trajectory as
+        it is loaded. It must be picklable.
+    topology : str, Topology, Trajectory
+        Topology or path to a topology file, used to load trajectories with
+        MDTraj
+    out : str
+        Path to the output directory. It will be created if it does not
+        exist.
+    chunk : int
+        Number of frames to load at once with md.iterload
+    stride : int, default=1
+        Only read every stride-th frame.
+    n_jobs : int, default=None
+        Number of worker processes. If None, use one process per CPU.
+        Negative values count back from the number of CPUs, as in joblib.
+    frames_per_task : int, default=None
+        If not None, large files are split into ranges of this many
+        (strided) frames, which are featurized by different workers.
+    cache : FeatureCache, optional
+        If supplied, featurized trajectories (or ranges of frames) are
+        looked up in (and saved to) this on-disk cache.
+
+    Returns
+    -------
+    manifest : list of dict
+        One entry per trajectory file, with the same contents as the lines
+        of ``manifest.jsonl``.
+
+    See Also
+    --------
+    iterfeaturize, load_featurized
+    """
+    if not os.path.exists(out):
+        os.makedirs(out)
+
+    manifest = []
+    with open(os.path.join(out, 'manifest.jsonl'), 'w') as f:
+        for i, filename, features, seconds in iterfeaturize(
+                filenames, featurizer, topology, chunk=chunk, stride=stride,
+                n_jobs=n_jobs, frames_per_task=frames_per_task, cache=cache):
+            fn = '%06d.npy' % i
+            np.save(os.path.join(out, fn), features)
+
+            fps = len(features) / seconds if seconds > 0 else float('inf')
+            print('%s: %d frames in %.2f s (%.1f frames/s)' % (
+                filename, len(features), seconds, fps))
+
+            record = {'index': i, 'filename': filename, 'features': fn,
+                      'n_frames': len(features), 'stride': stride,
+                      'seconds': seconds}
+            manifest.append(record)
+            f.write(json.dumps(record) + '\n')
+            f.flush()
+
+    return manifest
+
+
+def load_featurized(out, mmap_mode=None):
+    """Load trajectories featurized by `featurize_all_parallel`.
+
+    Parameters
+    ----------
+    out : str
+        Path to the directory written by `featurize_all_parallel`
+    mmap_mode : {None, 'r', 'r+', 'c'}
+        If not None, memory-map the featurized trajectories instead of
+        reading them into memory. See `np.load`.
+
+    Returns
+    -------
+    features : list of np.ndarray
+        The featurized trajectories, in the order of the original filenames
+    filenames : list of str
+        The original trajectory filenames
+    """
+    records = sorted(iterobjects(os.path.join(out, 'manifest.jsonl')),
+                     key=lambda r: r['index'])
+    features = [np.load(os.path.join(out, r['features']), mmap_mode=mmap_mode)
+                for r in records]
+    return features, [r['filename'] for r in records]
+
+
 def load(filename):
     """Load a featurizer from a cPickle file."""
     with open(filename, 'rb') as f:
@@ -156,6 +440,42 @@ class Featurizer(sklearn.base.BaseEstimator, sklearn.base.TransformerMixin):
             cPickle.dump(self, f)
 
 
+def _superposed_deviations(xyz, ref):
+    """Per-atom distances between each frame of `xyz` and `ref` after
+    optimal superposition of the frame onto `ref`.
+
+    The optimal rotation of each frame is found from the 3x3 inner-product
+    matrix between the centered coordinates (Kabsch), and applied to the
+    centered coordinates of the frame on the fly. The input is not
+    modified, and every step is vectorized over frames.
+
+    Parameters
+    ----------
+    xyz : np.ndarray, shape=(n_frames, n_atoms, 3)
+    ref : np.ndarray, shape=(n_atoms, 3)
+
+    Returns
+    -------
+    deviations : np.ndarray, shape=(n_frames, n_atoms)
+    """
+    X = np.asarray(xyz, dtype=np.float64)
+    X = X - X.mean(axis=1)[:, np.newaxis, :]
+    Y = np.asarray(ref, dtype=np.float64)
+    Y = Y - Y.mean(axis=0)
+
+    M = np.einsum('fni,nj->fij', X, Y)
+    U, _, Vt = np.linalg.svd(M)
+    # flip the last singular vector when the optimal orthogonal transform
+    # would be a reflection rather than a rotation
+    d = np.sign(np.linalg.det(U) * np.linalg.det(Vt))
+    d[d == 0] = 1.0
+    U[:, :, 2] *= d[:, np.newaxis]
+    R = np.einsum('fik,fkj->fij', U, Vt)
+
+    diff = np.einsum('fni,fij->fnj', X, R) - Y
+    return np.sqrt(np.sum(diff ** 2, axis=2))
+
+
 class SuperposeFeaturizer(Featurizer):
     """Featurizer based on euclidian atom distances to reference structure.
 
@@ -166,6 +486,12 @@ class SuperposeFeaturizer(Featurizer):
     reference_traj : md.Trajectory
         The reference conformation to superpose each frame with respect to
         (only the first frame in reference_traj is used)
+
+    Notes
+    -----
+    Only the atoms in `atom_indices` are read: the optimal rotation is
+    computed from them and applied to them alone, so the input trajectory
+    is not modified.
     """
 
     def __init__(self, atom_indices, reference_traj):
@@ -194,11 +520,9 @@ class SuperposeFeaturizer(Featurizer):
         --------
         transform : simultaneously featurize a collection of MD trajectories
         """
-        traj.superpose(self.reference_traj, atom_indices=self.atom_indices)
-        diff2 = (traj.xyz[:, self.atom_indices] -
-                 self.reference_traj.xyz[0, self.atom_indices]) ** 2
-        x = np.sqrt(np.sum(diff2, axis=2))
-        return x
+        x = _superposed_deviations(traj.xyz[:, self.atom_indices],
+                                   self.reference_traj.xyz[0, self.atom_indices])
+        return x.astype(np.float32)
 
 
 class AtomPairsFeaturizer(Featurizer):
@@ -250,6 +574,18 @@ class AtomPairsFeaturizer(Featurizer):
         return d ** self.exponent
 
 
+def _same_topology(cached, topology):
+    """Whether a cached topology is the same as `topology`, checking object
+    identity and a few counts before the full comparison"""
+    if cached is topology:
+        return True
+    if cached is None or \
+            (cached.n_atoms, cached.n_residues, cached.n_chains) != \
+            (topology.n_atoms, topology.n_residues, topology.n_chains):
+        return False
+    return cached == topology
+
+
 class DihedralFeaturizer(Featurizer):
     """Featurizer based on dihedral angles.
 
@@ -259,6 +595,14 @@ class DihedralFeaturizer(Featurizer):
         One or more of ['phi', 'psi', 'omega', 'chi1', 'chi2', 'chi3', 'chi4']
     sincos : bool
         Transform to sine and cosine (double the number of featurizers)
+
+    Notes
+    -----
+    The atom indices of every dihedral are looked up from the topology
+    once (in `fit()`, or on the first call to `partial_transform()`) and
+    cached. Each chunk of frames is then featurized with a single call
+    to `md.compute_dihedrals`, with the sines and cosines written
+    directly into a preallocated float32 array.
     """
 
     def __init__(self, types, sincos=True):
@@ -272,6 +616,32 @@ class DihedralFeaturizer(Featurizer):
             raise ValueError('angles must be a subset of %s. you supplied %s' % (
                 str(known), str(types)))
 
+        self._topology = None
+        self._indices = None
+        self._n_angles = None
+
+    def _index(self, topology):
+        """Look up (and cache) the atom indices of the dihedrals in `topology`"""
+        if _same_topology(self._topology, topology):
+            # make later chunks of the same trajectory hit the identity check
+            self._topology = topology
+            return
+
+        dummy = md.Trajectory(np.zeros((1, topology.n_atoms, 3)), topology)
+        indices = []
+        for a in self.types:
+            func = getattr(md, 'compute_%s' % a)
+            indices.append(np.asarray(func(dummy)[0], dtype=int).reshape(-1, 4))
+
+        self._n_angles = [len(ind) for ind in indices]
+        self._indices = np.concatenate(indices)
+        self._topology = topology
+
+    def fit(self, traj_list, y=None):
+        if len(traj_list) > 0:
+            self._index(traj_list[0].topology)
+        return self
+
     def partial_transform(self, traj):
         """Featurize an MD trajectory into a vector space via calculation
         of dihedral (torsion) angles
@@ -293,15 +663,24 @@ class DihedralFeaturizer(Featurizer):
         --------
         transform : simultaneously featurize a collection of MD trajectories
         """
-        x = []
-        for a in self.types:
-            func = getattr(md, 'compute_%s' % a)
-            y = func(traj)[1]
-            if self.sincos:
-                x.extend([np.sin(y), np.cos(y)])
-            else:
-                x.append(y)
-        return np.hstack(x)
+        self._index(traj.topology)
+        if len(self._indices) > 0:
+            angles = md.compute_dihedrals(traj, self._indices)
+        else:
+            angles = np.zeros((traj.n_frames, 0), dtype=np.float32)
+
+        if not self.sincos:
+            return np.asarray(angles, dtype=np.float32)
+
+        # the output columns are [sin(type_0), cos(type_0), sin(type_1), ...]
+        x = np.empty((traj.n_frames, 2 * len(self._indices)), dtype=np.float32)
+        start = 0
+        for n in self._n_angles:
+            y = angles[:, start:start + n]
+            np.sin(y, out=x[:, 2 * start:2 * start + n])
+            np.cos(y, out=x[:, 2 * start + n:2 * (start + n)])
+            start += n
+        return x
 
 
 class ContactFeaturizer(Featurizer):
@@ -361,6 +740,282 @@ class ContactFeaturizer(Featurizer):
         return distances
 
 
+class SparseContactFeaturizer(Featurizer):
+    """Featurizer based on residue-residue contacts, in a sparse matrix
+
+    Unlike :class:`ContactFeaturizer`, which computes the distance between
+    every pair of residues in every frame, this featurizer uses a
+    neighbor search to find only the pairs of residues which are within
+    `cutoff` of one another, and returns them as a `scipy.sparse.csr_matrix`.
+    This makes contact maps of large proteins, in which most pairs of
+    residues are never in contact, fit in memory.
+
+    Parameters
+    ----------
+    contacts : np.ndarray or 'all'
+        numpy array containing (0-indexed) residues to compute the
+        contacts for. (e.g. np.array([[0, 10], [0, 11]]) would compute
+        the contact between residue 0 and residue 10 as well as
+        the contact between residue 0 and residue 11.) [NOTE: if no
+        array is passed then 'all' contacts are calculated. This means
+        that the result will contain all contacts between residues
+        separated by at least 3 residues.]
+    scheme : {'ca', 'closest', 'closest-heavy'}
+        scheme to determine the distance between two residues:
+            'ca' : distance between two residues is given by the distance
+                between their alpha carbons
+            'closest' : distance is the closest distance between any
+                two atoms in the residues
+            'closest-heavy' : distance is the closest distance between
+                any two non-hydrogen atoms in the residues
+    ignore_nonprotein : bool
+        When using `contact==all`, don't compute contacts between
+        "residues" which are not protein (i.e. do not contain an alpha
+        carbon).
+    cutoff : float, default=0.45
+        Two residues are in contact when the distance between them is less
+        than this cutoff, in nm.
+    binary : bool, default=True
+        If True, each feature is 1 if the residues are in contact and 0
+        otherwise. If False, the feature is the distance between the
+        residues when they are in contact, and 0 otherwise.
+
+    Notes
+    -----
+    Distances are computed without periodic boundary conditions, so the
+    protein should be whole in each frame.
+    """
+
+    def __init__(self, contacts='all', scheme='closest-heavy',
+                 ignore_nonprotein=True, cutoff=0.45, binary=True):
+        self.contacts = contacts
+        self.scheme = scheme
+        self.ignore_nonprotein = ignore_nonprotein
+        self.cutoff = cutoff
+        self.binary = binary
+        self._setup_cache = None
+
+    def _residue_pairs(self, topology):
+        if isinstance(self.contacts, str) and self.contacts == 'all':
+            residues = np.arange(topology.n_residues)
+            if self.ignore_nonprotein:
+                residues = np.array([r.index for r in topology.residues
+                                     if any(a.name == 'CA' for a in r.atoms)],
+                                    dtype=int)
+            i, j = np.triu_indices(len(residues), k=1)
+            pairs = np.column_stack((residues[i], residues[j]))
+            return pairs[pairs[:, 1] - pairs[:, 0] > 2].reshape(-1, 2)
+        return np.asarray(self.contacts, dtype=int).reshape(-1, 2)
+
+    def _setup(self, topology):
+        """Look up (and cache) the atoms and residue-pair lookup table for
+        a topology"""
+        cached = self._setup_cache
+        params = (self.scheme, self.ignore_nonprotein)
+        if cached is not None and cached[1] is self.contacts and \
+                cached[2] == params and _same_topology(cached[0], topology):
+            result = cached[3]
+        else:
+            result = self._compute_setup(topology)
+        # keyed on the latest topology object, so that later chunks of the
+        # same trajectory hit the identity check
+        self._setup_cache = (topology, self.contacts, params, result)
+        return result
+
+    def _compute_setup(self, topology):
+        if self.scheme not in ('ca', 'closest', 'closest-heavy'):
+            raise ValueError('scheme must be one of ca, closest, or '
+                             'closest-heavy. you supplied %s' % self.scheme)
+        pairs = self._residue_pairs(topology)
+        residues = set(pairs.flatten())
+
+        atoms = []
+        for residue in topology.residues:
+            if residue.index not in residues:
+                continue
+            for atom in residue.atoms:
+                if self.scheme == 'ca' and atom.name != 'CA':
+                    continue
+                if self.scheme == 'closest-heavy' and \
+                        atom.element == md.element.hydrogen:
+                    continue
+                atoms.append((atom.index, residue.index))
+        atoms = np.array(atoms, dtype=int).reshape(-1, 2)
+
+        # map an unordered pair of residues to its column with a sorted
+        # table of hashed pairs
+        n = topology.n_residues
+        keys = pairs.min(axis=1) * n + pairs.max(axis=1)
+        order = np.argsort(keys)
+        return atoms[:, 0], atoms[:, 1], n, keys[order], order
+
+    def partial_transform(self, traj):
+        """Featurize an MD trajectory into a sparse matrix of residue-residue
+        contacts
+
+        Parameters
+        ----------
+        traj : mdtraj.Trajectory
+            A molecular dynamics trajectory to featurize.
+
+        Returns
+        -------
+        features : scipy.sparse.csr_matrix, shape=(n_samples, n_features)
+            A featurized trajectory is a 2D sparse matrix of shape
+            `(length_of_trajectory x n_features)` where each `features[i]`
+            vector is computed by applying the featurization function
+            to the `i`th snapshot of the input trajectory.
+
+        See Also
+        --------
+        transform : simultaneously featurize a collection of MD trajectories
+        """
+        atom_indices, atom_residues, n, keys, columns = self._setup(traj.topology)
+        shape = (traj.n_frames, len(keys))
+        if traj.n_frames == 0 or len(keys) == 0:
+            return scipy.sparse.csr_matrix(shape)
+
+        indptr = [0]
+        indices = []
+        data = []
+        for xyz in traj.xyz[:, atom_indices]:
+            tree = scipy.spatial.cKDTree(xyz)
+            try:
+                near = tree.query_pairs(self.cutoff, output_type='ndarray')
+            except TypeError:
+                near = np.array(sorted(tree.query_pairs(self.cutoff)), dtype=int)
+            near = near.reshape(-1, 2)
+
+            ra = atom_residues[near[:, 0]]
+            rb = atom_residues[near[:, 1]]
+            key = np.minimum(ra, rb) * n + np.maximum(ra, rb)
+            position = np.minimum(np.searchsorted(keys, key), len(keys) - 1)
+            found = keys[position] == key
+            cols = columns[position[found]]
+
+            if self.binary:
+                cols = np.unique(cols)
+                values = np.ones(len(cols))
+            else:
+                # the distance between two residues is the minimum over
+                # their pairs of atoms
+                d = np.sqrt(np.sum((xyz[near[found, 0]] - xyz[near[found, 1]]) ** 2, axis=1))
+                order = np.lexsort((d, cols))
+                cols, d = cols[order], d[order]
+                first = np.ones(len(cols), dtype=bool)
+                first[1:] = cols[1:] != cols[:-1]
+                cols, values = cols[first], d[first]
+
+            indices.append(cols)
+            data.append(values)
+            indptr.append(indptr[-1] + len(cols))
+
+        return scipy.sparse.csr_matrix(
+            (np.concatenate(data), np.concatenate(indices), np.array(indptr)),
+            shape=shape)
+
+
+def _solvent_fingerprint_frame(solute, solvent, box, sigma, cutoff):
+    """Sum of the solvent kernels around each solute atom in a single frame,
+    using a cell list so that only solvent atoms within `cutoff` of each
+    solute atom are visited.
+
+    Parameters
+    ----------
+    solute : np.ndarray, shape=(n_solute, 3)
+    solvent : np.ndarray, shape=(n_solvent, 3)
+    box : np.ndarray, shape=(3,), or None
+        Lengths of the (orthorhombic) periodic box, or None for a
+        non-periodic system
+    sigma : float
+    cutoff : float
+        Distance cutoff, in the same units as the coordinates
+
+    Returns
+    -------
+    fingerprint : np.ndarray, shape=(n_solute,)
+    """
+    n_solute = len(solute)
+    if box is not None:
+        origin = np.zeros(3)
+        extent = box
+        solute = solute - box * np.floor(solute / box)
+        solvent = solvent - box * np.floor(solvent / box)
+    else:
+        origin = np.minimum(solute.min(axis=0), solvent.min(axis=0))
+        extent = np.maximum(solute.max(axis=0), solvent.max(axis=0)) - origin
+
+    # cells are at least `cutoff` wide, so every solvent atom within the
+    # cutoff of a solute atom is in the same or an adjacent cell
+    n_cells = np.maximum(np.floor(extent / cutoff), 1).astype(int)
+    width = extent / n_cells
+    width[width == 0] = 1.0
+
+    def cell_coords(xyz):
+        c = np.floor((xyz - origin) / width).astype(int)
+        return np.clip(c, 0, n_cells - 1)
+
+    def linear(c):
+        return (c[:, 0] * n_cells[1] + c[:, 1]) * n_cells[2] + c[:, 2]
+
+    # sort the solvent atoms by cell, and find the range of each cell
+    solvent_cells = linear(cell_coords(solvent))
+    order = np.argsort(solvent_cells, kind='mergesort')
+    solvent = solvent[order]
+    cell_start = np.searchsorted(solvent_cells[order], np.arange(np.prod(n_cells) + 1))
+
+    solute_cells = cell_coords(solute)
+    offsets = []
+    for n in n_cells:
+        if box is not None and n < 3:
+            # with fewer than three cells, the -1 and +1 neighbors wrap
+            # around onto cells we'd already visit
+            offsets.append(range(n))
+        else:
+            offsets.append((-1, 0, 1))
+
+    fingerprint = np.zeros(n_solute)
+    for dx in offsets[0]:
+        for dy in offsets[1]:
+            for dz in offsets[2]:
+                neighbor = solute_cells + (dx, dy, dz)
+                if box is not None:
+                    neighbor %= n_cells
+                    valid = np.arange(n_solute)
+                else:
+                    valid = np.where(np.all((neighbor >= 0) & (neighbor < n_cells), axis=1))[0]
+                cells = linear(neighbor[valid])
+                start, stop = cell_start[cells], cell_start[cells + 1]
+                counts = stop - start
+                total = counts.sum()
+                if total == 0:
+                    continue
+
+                # expand the [start, stop) ranges into flat index arrays
+                solute_index = np.repeat(valid, counts)
+                solvent_index = np.repeat(start - np.cumsum(counts) + counts, counts) + np.arange(total)
+
+                diff = solvent[solvent_index] - solute[solute_index]
+                if box is not None:
+                    diff -= box * np.round(diff / box)
+                d = np.sqrt(np.sum(diff ** 2, axis=1))
+                mask = d < cutoff
+                fingerprint += np.bincount(
+                    solute_index[mask], weights=np.exp(-d[mask] / (2 * sigma * sigma)),
+                    minlength=n_solute)
+
+    return fingerprint
+
+
+def _solvent_fingerprint_frames(solute_xyz, solvent_xyz, boxes, sigma, cutoff):
+    fingerprints = np.zeros((len(solute_xyz), solute_xyz.shape[1]))
+    for i in range(len(solute_xyz)):
+        box = None if boxes is None else boxes[i]
+        fingerprints[i] = _solvent_fingerprint_frame(
+            solute_xyz[i], solvent_xyz[i], box, sigma, cutoff)
+    return fingerprints
+
+
 class GaussianSolventFeaturizer(Featurizer):
     """Featurizer on weighted pairwise distance between solute and solvent.
 
@@ -381,7 +1036,20 @@ class GaussianSolventFeaturizer(Featurizer):
         Sets the length scale for the gaussian kernel
     periodic : bool
         Whether to consider a periodic system in distance calculations
+    cutoff : float, optional
+        If not None, only solvent atoms within `cutoff * sigma` of each
+        solute atom are included in the sum, and they are located with a
+        cell list instead of computing every solute-solvent distance. Each
+        neglected term is smaller than exp(-cutoff / (2 * sigma)).
+    n_jobs : int, default=1
+        Number of processes over which to divide the frames of each
+        trajectory, when `cutoff` is not None.
 
+    Notes
+    -----
+    The cell-list code path supports orthorhombic periodic boxes and
+    non-periodic systems. Trajectories with triclinic boxes use the exact
+    calculation.
 
     References
     ----------
@@ -389,11 +1057,14 @@ class GaussianSolventFeaturizer(Featurizer):
     (January 21, 2013): S8. doi:10.1186/1471-2105-14-S2-S8.
     """
 
-    def __init__(self, solute_indices, solvent_indices, sigma, periodic=False):
+    def __init__(self, solute_indices, solvent_indices, sigma, periodic=False,
+                 cutoff=None, n_jobs=1):
         self.solute_indices = solute_indices[:, 0]
         self.solvent_indices = solvent_indices[:, 0]
         self.sigma = sigma
         self.periodic = periodic
+        self.cutoff = cutoff
+        self.n_jobs = n_jobs
         self.n_features = len(self.solute_indices)
 
     def partial_transform(self, traj):
@@ -417,6 +1088,17 @@ class GaussianSolventFeaturizer(Featurizer):
         --------
         transform : simultaneously featurize a collection of MD trajectories
         """
+        if self.cutoff is not None:
+            if traj.unitcell_vectors is None:
+                boxes = None
+            elif np.allclose(traj.unitcell_angles, 90):
+                boxes = np.asarray(traj.unitcell_lengths, dtype=np.float64)
+            else:
+                boxes = False
+
+            if boxes is not False:
+                return self._partial_transform_cell_list(traj, boxes)
+
         # The result vector
         fingerprints = np.zeros((traj.n_frames, self.n_features))
         atom_pairs = np.zeros((len(self.solvent_indices), 2))
@@ -436,6 +1118,24 @@ class GaussianSolventFeaturizer(Featurizer):
 
         return fingerprints
 
+    def _partial_transform_cell_list(self, traj, boxes):
+        solute_xyz = np.asarray(traj.xyz[:, self.solute_indices], dtype=np.float64)
+        solvent_xyz = np.asarray(traj.xyz[:, self.solvent_indices], dtype=np.float64)
+        cutoff = self.cutoff * self.sigma
+
+        if self.n_jobs == 1 or traj.n_frames < 2:
+            return _solvent_fingerprint_frames(
+                solute_xyz, solvent_xyz, boxes, self.sigma, cutoff)
+
+        n_blocks = min(traj.n_frames, 4 * abs(self.n_jobs))
+        blocks = np.array_split(np.arange(traj.n_frames), n_blocks)
+        results = Parallel(n_jobs=self.n_jobs)(
+            delayed(_solvent_fingerprint_frames)(
+                solute_xyz[b], solvent_xyz[b],
+                None if boxes is None else boxes[b], self.sigma, cutoff)
+            for b in blocks)
+        return np.concatenate(results)
+
 
 class RawPositionsFeaturizer(Featurizer):
 
@@ -469,6 +1169,126 @@ class RawPositionsFeaturizer(Featurizer):
         return value
 
 
+def _centered(xyz):
+    """Center each frame of `xyz` at the origin, in double precision, and
+    compute the traces G = sum |x|^2 of the centered frames."""
+    xyz = np.asarray(xyz, dtype=np.float64)
+    xyz = xyz - xyz.mean(axis=1)[:, np.newaxis, :]
+    traces = np.einsum('fai,fai->f', xyz, xyz)
+    return xyz, traces
+
+
+def _qcp_max_eigenvalue(M, G, n_iter=50, precision=1e-11):
+    """Largest eigenvalue of the QCP key matrix for a stack of 3x3
+    inner-product matrices, by Newton iteration on its characteristic
+    polynomial [1]. The iteration is vectorized over all of the matrices.
+
+    Parameters
+    ----------
+    M : np.ndarray, shape=(..., 3, 3)
+        Inner-product matrices, M[..., i, j] = sum_atoms x_i y_j
+    G : np.ndarray, shape=(...)
+        Starting guess for the eigenvalue, (G_x + G_y) / 2, which is an
+        upper bound on it.
+
+    References
+    ----------
+    .. [1] Theobald, D. L. Acta Crystallogr. A 61.4 (2005): 478-480.
+    """
+    Sxx, Sxy, Sxz = M[..., 0, 0], M[..., 0, 1], M[..., 0, 2]
+    Syx, Syy, Syz = M[..., 1, 0], M[..., 1, 1], M[..., 1, 2]
+    Szx, Szy, Szz = M[..., 2, 0], M[..., 2, 1], M[..., 2, 2]
+
+    Sxx2, Syy2, Szz2 = Sxx * Sxx, Syy * Syy, Szz * Szz
+    Sxy2, Syz2, Sxz2 = Sxy * Sxy, Syz * Syz, Sxz * Sxz
+    Syx2, Szy2, Szx2 = Syx * Syx, Szy * Szy, Szx * Szx
+
+    SyzSzymSyySzz2 = 2.0 * (Syz * Szy - Syy * Szz)
+    Sxx2Syy2Szz2Syz2Szy2 = Syy2 + Szz2 - Sxx2 + Syz2 + Szy2
+    C2 = -2.0 * (Sxx2 + Syy2 + Szz2 + Sxy2 + Syx2 + Sxz2 + Szx2 + Syz2 + Szy2)
+    C1 = 8.0 * (Sxx * Syz * Szy + Syy * Szx * Sxz + Szz * Sxy * Syx) - \
+         8.0 * (Sxx * Syy * Szz + Syz * Szx * Sxy + Szy * Syx * Sxz)
+
+    SxzpSzx, SyzpSzy, SxypSyx = Sxz + Szx, Syz + Szy, Sxy + Syx
+    SyzmSzy, SxzmSzx, SxymSyx = Syz - Szy, Sxz - Szx, Sxy - Syx
+    SxxpSyy, SxxmSyy = Sxx + Syy, Sxx - Syy
+    Sxy2Sxz2Syx2Szx2 = Sxy2 + Sxz2 - Syx2 - Szx2
+
+    C0 = Sxy2Sxz2Syx2Szx2 * Sxy2Sxz2Syx2Szx2 \
+        + (Sxx2Syy2Szz2Syz2Szy2 + SyzSzymSyySzz2) * (Sxx2Syy2Szz2Syz2Szy2 - SyzSzymSyySzz2) \
+        + (-SxzpSzx * SyzmSzy + SxymSyx * (SxxmSyy - Szz)) * (-SxzmSzx * SyzpSzy + SxymSyx * (SxxmSyy + Szz)) \
+        + (-SxzpSzx * SyzpSzy - SxypSyx * (SxxpSyy - Szz)) * (-SxzmSzx * SyzmSzy - SxypSyx * (SxxpSyy + Szz)) \
+        + (SxypSyx * SyzpSzy + SxzpSzx * (SxxmSyy + Szz)) * (-SxymSyx * SyzmSzy + SxzpSzx * (SxxpSyy + Szz)) \
+        + (SxypSyx * SyzmSzy + SxzmSzx * (SxxmSyy - Szz)) * (-SxymSyx * SyzpSzy + SxzmSzx * (SxxpSyy - Szz))
+
+    eigenvalue = np.array(G, dtype=np.float64, copy=True)
+    for i in range(n_iter):
+        x2 = eigenvalue * eigenvalue
+        b = (x2 + C2) * eigenvalue
+        a = b + C1
+        denominator = 2.0 * x2 * eigenvalue + b + a
+        delta = (a * eigenvalue + C0) / np.where(denominator == 0, 1.0, denominator)
+        eigenvalue -= delta
+        if np.all(np.abs(delta) <= np.abs(precision * eigenvalue)):
+            break
+    return eigenvalue
+
+
+# Peak memory used per (frame, reference) pair while a block is processed:
+# the 3x3 inner-product matrix, and the ~40 float64 temporaries of the
+# vectorized QCP characteristic polynomial and Newton iteration
+_QCP_BYTES_PER_PAIR = 360
+
+
+def _rmsd_to_references(xyz, ref_xyz, max_block_bytes=2**26):
+    """Compute the minimal RMSD between every frame of `xyz` and every
+    frame of `ref_xyz` after optimal superposition.
+
+    Both sets of coordinates are centered and their traces computed once.
+    The 3x3 inner-product matrices between all pairs of frames are then
+    computed for a block of references at a time with a single matrix
+    multiply, and the optimal superposition of every pair is found with
+    the quaternion characteristic polynomial (QCP) method.
+
+    Parameters
+    ----------
+    xyz : np.ndarray, shape=(n_frames, n_atoms, 3)
+    ref_xyz : np.ndarray, shape=(n_refs, n_atoms, 3)
+    max_block_bytes : int
+        Approximate upper bound on the peak memory of the temporaries used
+        for each block of references. This doesn't include the inputs or
+        the (n_frames, n_refs) output.
+
+    Returns
+    -------
+    rmsd : np.ndarray, shape=(n_frames, n_refs)
+    """
+    n_frames, n_atoms, _ = xyz.shape
+    n_refs = ref_xyz.shape[0]
+    X, G_x = _centered(xyz)
+    Y, G_y = _centered(ref_xyz)
+
+    # X is laid out as (n_frames*3, n_atoms) and Y as (n_atoms, n_refs*3),
+    # so that their product holds the inner-product matrices of every pair
+    X = np.ascontiguousarray(X.transpose(0, 2, 1)).reshape(n_frames * 3, n_atoms)
+    Y = Y.transpose(1, 0, 2).reshape(n_atoms, n_refs * 3)
+
+    rmsd = np.empty((n_frames, n_refs))
+    block = max(1, int(max_block_bytes //
+                       (_QCP_BYTES_PER_PAIR * max(n_frames, 1))))
+    for start in range(0, n_refs, block):
+        stop = min(start + block, n_refs)
+        M = np.dot(X, Y[:, 3 * start:3 * stop])
+        M = M.reshape(n_frames, 3, stop - start, 3).transpose(0, 2, 1, 3)
+
+        G = G_x[:, np.newaxis] + G_y[np.newaxis, start:stop]
+        eigenvalue = _qcp_max_eigenvalue(M, 0.5 * G)
+        msd = (G - 2 * eigenvalue) / n_atoms
+        rmsd[:, start:stop] = np.sqrt(np.maximum(msd, 0))
+
+    return rmsd
+
+
 class RMSDFeaturizer(Featurizer):
     """Featurizer based on RMSD to a series of reference frames.
 
@@ -481,6 +1301,13 @@ class RMSDFeaturizer(Featurizer):
         Which atom indices to use during RMSD calculation.  If None, MDTraj
         should default to all atoms.
 
+    Notes
+    -----
+    The RMSDs to all of the reference frames are computed together: the
+    trajectory is centered once, the inner products between every frame
+    and every reference are computed with blocked matrix multiplies (which
+    are parallelized by the BLAS library), and the optimal superpositions
+    are found with a vectorized QCP kernel.
     """
 
     def __init__(self, trj0, atom_indices=None):
@@ -509,11 +1336,12 @@ class RMSDFeaturizer(Featurizer):
         --------
         transform : simultaneously featurize a collection of MD trajectories
         """
-        X = np.zeros((traj.n_frames, self.n_features))
-
-        for frame in range(self.n_features):
-            X[:, frame] = md.rmsd(traj, self.trj0, atom_indices=self.atom_indices, frame=frame)
-        return X
+        if self.atom_indices is None:
+            xyz, ref_xyz = traj.xyz, self.trj0.xyz
+        else:
+            xyz = traj.xyz[:, self.atom_indices]
+            ref_xyz = self.trj0.xyz[:, self.atom_indices]
+        return _rmsd_to_references(xyz, ref_xyz)
 
 
 class DRIDFeaturizer(Featurizer):
@@ -553,13 +1381,117 @@ class DRIDFeaturizer(Featurizer):
         return md.geometry.compute_drid(traj, self.atom_indices)
 
 
+def _union_partial_transform(transformer_list, transformer_weights, traj, chunk):
+    """Featurize one trajectory with every transformer in a TrajFeatureUnion.
+
+    All of the transformers are run on each chunk of `chunk` frames in turn,
+    while that chunk is hot in cache, and each transformer's output is
+    written into its own column slice of a single preallocated array.
+
+    Returns
+    -------
+    features : np.ndarray, shape=(n_frames, n_features)
+    timings : list of float
+        Time spent in each transformer, in seconds
+    """
+    n_frames = len(traj)
+    step = chunk if chunk else max(n_frames, 1)
+    bounds = [(s, min(s + step, n_frames)) for s in range(0, n_frames, step)]
+    if len(bounds) == 0:
+        bounds = [(0, 0)]
+
+    timings = [0.0] * len(transformer_list)
+    features = None
+    offsets = None
+
+    for start, stop in bounds:
+        piece = traj if (start == 0 and stop == n_frames) else traj[start:stop]
+
+        if features is None:
+            # the widths of the blocks aren't known until the transformers
+            # have been run once, so the first chunk sets up the output array
+            blocks = []
+            for k, (name, trans) in enumerate(transformer_list):
+                t0 = time.time()
+                blocks.append(trans.partial_transform(piece))
+                timings[k] += time.time() - t0
+            offsets = np.cumsum([0] + [b.shape[1] for b in blocks])
+            features = np.empty((n_frames, offsets[-1]),
+                                dtype=np.result_type(*blocks))
+            for k, block in enumerate(blocks):
+                features[start:stop, offsets[k]:offsets[k+1]] = block
+            del blocks
+        else:
+            for k, (name, trans) in enumerate(transformer_list):
+                t0 = time.time()
+                features[start:stop, offsets[k]:offsets[k+1]] = \
+                    trans.partial_transform(piece)
+                timings[k] += time.time() - t0
+
+    if transformer_weights is not None:
+        for k, (name, trans) in enumerate(transformer_list):
+            if name in transformer_weights:
+                features[:, offsets[k]:offsets[k+1]] *= transformer_weights[name]
+
+    return features, timings
+
+
 class TrajFeatureUnion(sklearn.pipeline.FeatureUnion):
     """Mixtape version of sklearn.pipeline.FeatureUnion
 
+    Parameters
+    ----------
+    transformer_list : list of (string, Featurizer) tuples
+        List of featurizers to be applied to the trajectories.
+    n_jobs : int, default=1
+        Number of trajectories to featurize in parallel.
+    transformer_weights : dict, optional
+        Multiplicative weights for the features of each featurizer, keyed
+        by name.
+    chunk : int, optional
+        If not None, each trajectory is featurized in chunks of this many
+        frames. All of the featurizers are run on one chunk before moving
+        on to the next.
+
+    Attributes
+    ----------
+    timings_ : dict
+        Total time, in seconds, spent in each featurizer (keyed by name)
+        during the last call to `transform()`.
+
     Notes
     -----
-    Works on lists of trajectories.
+    Works on lists of trajectories. The output of every featurizer is
+    written into a column slice of a single preallocated array per
+    trajectory.
     """
+    def __init__(self, transformer_list, n_jobs=1, transformer_weights=None,
+                 chunk=None):
+        super(TrajFeatureUnion, self).__init__(
+            transformer_list, n_jobs=n_jobs,
+            transformer_weights=transformer_weights)
+        self.chunk = chunk
+
+    def partial_transform(self, traj):
+        """Featurize an MD trajectory with each featurizer, concatenating
+        the results.
+
+        Parameters
+        ----------
+        traj : mdtraj.Trajectory
+            A molecular dynamics trajectory to featurize.
+
+        Returns
+        -------
+        features : np.ndarray, shape=(n_samples, n_features)
+            The concatenated features of each featurizer.
+        """
+        features, timings = _union_partial_transform(
+            self.transformer_list, self.transformer_weights, traj, self.chunk)
+        self.timings_ = dict((name, t) for (name, _), t in
+                             zip(self.transformer_list, timings))
+        return features
+
     def fit_transform(self, traj_list, y=None, **fit_params):
         """Fit all transformers using `trajectories`, transform the data
         and concatenate results.
@@ -602,10 +1534,21 @@ class TrajFeatureUnion(sklearn.pipeline.FeatureUnion):
             concatenated list of featurizers.
 
         """
-        Xs = Parallel(n_jobs=self.n_jobs)(
-            delayed(sklearn.pipeline._transform_one)(trans, name, traj_list, self.transformer_weights)
-            for name, trans in self.transformer_list)
-
-        X_i_stacked = [np.hstack([Xs[feature_ind][trj_ind] for feature_ind in range(len(Xs))]) for trj_ind in range(len(Xs[0]))]
-
-        return X_i_stacked
+        if self.n_jobs == 1:
+            results = [_union_partial_transform(
+                self.transformer_list, self.transformer_weights, traj, self.chunk)
+                for traj in traj_list]
+        else:
+            # parallelize over trajectories, so that each trajectory is
+            # only sent to one worker
+            results = Parallel(n_jobs=self.n_jobs)(
+                delayed(_union_partial_transform)(
+                    self.transformer_list, self.transformer_weights, traj, self.chunk)
+                for traj in traj_list)
+
+        timings = np.sum([t for _, t in results], axis=0) if results else \
+            np.zeros(len(self.transformer_list))
+        self.timings_ = dict((name, t) for (name, _), t in
+                             zip(self.transformer_list, timings))
+
+        return [features for features, _ in results]
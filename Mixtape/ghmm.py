@@ -36,6 +36,7 @@ import sklearn.mixture
 _AVAILABLE_PLATFORMS = ['cpu', 'sklearn']
 from mixtape import _ghmm, _reversibility
 from mdtraj.utils import ensure_type
+from mixtape.utils import sample_frames_by_state
 from sklearn.utils import check_random_state
 
 try:
@@ -619,16 +620,15 @@ class GaussianFusionHMM(object):
         if scheme == 'even':
             logprob = [sklearn.mixture.log_multivariate_normal_density(x, self.means_, self.vars_, covariance_type='diag') for x in sequences]
             ass = [lp.argmax(1) for lp in logprob]
-            
-            selected_pairs_by_state = []
-            for state in range(self.n_states):
-                all_frames = [np.where(a == state)[0] for a in ass]
-                pairs = [(trj, frame) for (trj, frames) in enumerate(all_frames) for frame in frames]
-                selected_pairs_by_state.append([pairs[random.choice(len(pairs))] for i in range(n_samples)])
+            selected_pairs_by_state = sample_frames_by_state(
+                ass, self.n_states, n_samples, random_state=random)
         
         elif scheme == "maxent":
             X_concat = np.concatenate(sequences)
-            all_pairs = np.array([(trj, frame) for trj, X in enumerate(sequences) for frame in range(X.shape[0])])
+            lengths = [len(X) for X in sequences]
+            all_pairs = np.column_stack((
+                np.repeat(np.arange(len(sequences)), lengths),
+                np.concatenate([np.arange(n) for n in lengths])))
             selected_pairs_by_state = []
             for k in range(self.n_states):
                 print('computing weights for k=%d...' % k)
@@ -28,7 +28,7 @@ import operator
 import numpy as np
 import scipy.linalg
 
-from mixtape.utils import list_of_1d
+from mixtape.utils import list_of_1d, sample_frames_by_state
 from sklearn.utils import check_random_state
 from sklearn.base import BaseEstimator
 from mixtape.markovstatemodel._markovstatemodel import _transmat_mle_prinz
@@ -598,12 +598,5 @@ Timescales:
         n_states_2 = len(np.unique(np.concatenate(sequences)))
         assert n_states == n_states_2, "Must have non-empty, zero-indexed, consecutive states: found %d states and %d unique states." % (n_states, n_states_2)
 
-        random = check_random_state(random_state)
-
-        selected_pairs_by_state = []
-        for state in range(n_states):
-            all_frames = [np.where(a == state)[0] for a in sequences]
-            pairs = [(trj, frame) for (trj, frames) in enumerate(all_frames) for frame in frames]
-            selected_pairs_by_state.append([pairs[random.choice(len(pairs))] for i in range(n_samples)])
-
-        return np.array(selected_pairs_by_state)
+        return sample_frames_by_state(sequences, n_states, n_samples,
+                                      random_state=random_state)
@@ -9,19 +9,33 @@ The switch posteriors are used in the M-step to update parameter estimates.
 from __future__ import print_function, division, absolute_import
 import warnings
 import numpy as np
-from numpy.random import multivariate_normal
 import scipy.linalg
 import time
 from sklearn import cluster
 from sklearn.hmm import GaussianHMM
+from sklearn.utils import check_random_state
 from sklearn.mixture import distribute_covar_matrix_to_match_covariance_type
 from mdtraj.utils import ensure_type
 
 from mixtape.mslds_solver import MetastableSwitchingLDSSolver
-from mixtape._mslds import MetastableSLDSCPUImpl
+from mixtape._mslds import MetastableSLDSCPUImpl, _sample_linear_dynamics
 from mixtape.utils import iter_vars, categorical, bcolors
 
 
+def _noise_factor(covar):
+    """A matrix L with L L^T = covar, for drawing gaussian noise.
+
+    This is the Cholesky factor, or, if covar is only positive
+    semidefinite, a factor from its eigendecomposition.
+    """
+    covar = np.asarray(covar, dtype=np.float64)
+    try:
+        return np.linalg.cholesky(covar)
+    except np.linalg.LinAlgError:
+        w, v = np.linalg.eigh(covar)
+        return v * np.sqrt(np.maximum(w, 0))
+
+
 class MetastableSwitchingLDS(object):
 
     """
@@ -47,11 +61,15 @@ class MetastableSwitchingLDS(object):
         Controls which parameters are updated in the training process.
     backet: string
         Either FirstOpt or cvxopt
+    n_jobs : int, default=1
+        Number of worker processes used to solve the per-state
+        subproblems of the M-step in parallel. If None, use one process
+        per CPU.
     """
 
     def __init__(self, n_states, n_features, n_experiments=5,
             n_hotstart_sequences=10, params='tmcqab', n_em_iter=10,
-            n_hotstart = 5, backend='FirstOpt'):
+            n_hotstart = 5, backend='FirstOpt', n_jobs=1):
 
         self.n_states = n_states
         self.n_experiments = n_experiments
@@ -60,6 +78,7 @@ class MetastableSwitchingLDS(object):
         self.n_hotstart_sequences = n_hotstart_sequences
         self.n_em_iter = n_em_iter
         self.params = params
+        self.n_jobs = n_jobs
         self.eps = .2
         self._As_ = None
         self._bs_ = None
@@ -70,7 +89,7 @@ class MetastableSwitchingLDS(object):
         self._populations_ = None
 
         self.solver = MetastableSwitchingLDSSolver(self.n_states,
-                self.n_features)
+                self.n_features, n_jobs=n_jobs)
         self.inferrer = MetastableSLDSCPUImpl(self.n_states,
                 self.n_features, precision='mixed')
 
@@ -124,42 +143,109 @@ class MetastableSwitchingLDS(object):
         for i in range(self.n_states):
             self.Qs_[i] = self.eps * self.covars_[i]
 
-    def sample(self, n_samples, init_state=None, init_obs=None):
+    def sample(self, n_samples, init_state=None, init_obs=None,
+               random_state=None):
         """Sample a trajectory from model distribution
+
+        Parameters
+        ----------
+        n_samples : int
+            Length of the trajectory
+        init_state : int, optional
+            Initial hidden state. By default, drawn from populations_.
+        init_obs : array_like, shape=(n_features,), optional
+            Initial observation. By default, drawn from the gaussian of the
+            initial state, given by means_ and covars_.
+        random_state : RandomState or an int seed, optional
+            A random number generator instance.
+
+        Returns
+        -------
+        obs : np.ndarray, shape=(n_samples, n_features)
+        hidden_state : np.ndarray, shape=(n_samples,)
         """
-        # Allocate Memory
-        obs = np.zeros((n_samples, self.n_features))
-        hidden_state = np.zeros(n_samples, dtype=int)
+        obs, hidden_states = self.sample_trajectories(1, n_samples,
+                init_state=init_state, init_obs=init_obs,
+                random_state=random_state)
+        return obs[0], hidden_states[0]
+
+    def sample_trajectories(self, n_trajectories, n_samples,
+                            init_state=None, init_obs=None,
+                            random_state=None):
+        """Sample many independent trajectories from model distribution
+
+        All of the hidden state paths are drawn first, advancing every
+        trajectory's Markov chain together. The observations then follow
+        from the Cholesky factors of Qs_ and a compiled loop over the
+        linear dynamics.
+
+        Parameters
+        ----------
+        n_trajectories : int
+            Number of trajectories
+        n_samples : int
+            Length of each trajectory
+        init_state : int or array_like, shape=(n_trajectories,), optional
+            Initial hidden states. By default, drawn from populations_.
+        init_obs : array_like, shape=(n_features,) or
+                (n_trajectories, n_features), optional
+            Initial observations. By default, drawn from the gaussian of the
+            initial state, given by means_ and covars_.
+        random_state : RandomState or an int seed, optional
+            A random number generator instance.
+
+        Returns
+        -------
+        obs : np.ndarray, shape=(n_trajectories, n_samples, n_features)
+        hidden_states : np.ndarray, shape=(n_trajectories, n_samples)
+        """
+        random_state = check_random_state(random_state)
+        obs = np.zeros((n_trajectories, n_samples, self.n_features))
+        hidden_states = np.zeros((n_trajectories, n_samples), dtype=np.intp)
+        if n_trajectories == 0 or n_samples == 0:
+            return obs, hidden_states
 
-        # set the initial values of the sequences
+        # Hidden state paths
         if init_state is None:
-            # Sample Start conditions
-            hidden_state[0] = categorical(self.populations_)
+            # guard against populations summing to slightly below 1
+            hidden_states[:, 0] = np.minimum(categorical(self.populations_,
+                    size=(n_trajectories,), random_state=random_state),
+                    self.n_states - 1)
         else:
-            hidden_state[0] = init_state
-
+            hidden_states[:, 0] = init_state
+        cumtransmat = np.cumsum(self.transmat_, axis=1)
+        u = random_state.random_sample((n_trajectories, n_samples - 1, 1))
+        for t in range(n_samples - 1):
+            next_state = np.sum(cumtransmat[hidden_states[:, t]] < u[:, t],
+                                axis=1)
+            # guard against rows of transmat summing to slightly below 1
+            hidden_states[:, t + 1] = np.minimum(next_state,
+                                                 self.n_states - 1)
+
+        # Initial observations
         if init_obs is None:
-            obs[0] = multivariate_normal(self.means_[hidden_state[0]],
-                                         self.covars_[hidden_state[0]])
+            eps = random_state.randn(n_trajectories, self.n_features)
+            for i in range(self.n_states):
+                mask = hidden_states[:, 0] == i
+                L = _noise_factor(self.covars_[i])
+                obs[mask, 0] = self.means_[i] + np.dot(eps[mask], L.T)
         else:
-            obs[0] = init_obs
-
-        # Perform time updates
-        import pdb, traceback, sys
-        try:
-            for t in range(n_samples - 1):
-                s = hidden_state[t]
-                A = self.As_[s]
-                b = self.bs_[s]
-                Q = self.Qs_[s]
-                obs[t + 1] = multivariate_normal(np.dot(A, obs[t]) + b, Q)
-                hidden_state[t + 1] = categorical(self.transmat_[s])
-        except:
-                type, value, tb = sys.exc_info()
-                traceback.print_exc()
-                pdb.post_mortem(tb)
-
-        return obs, hidden_state
+            obs[:, 0] = init_obs
+
+        # Offsets and noise of each step, given the state of the previous
+        # frame
+        eps = random_state.randn(n_trajectories, n_samples - 1,
+                                 self.n_features)
+        steps = obs[:, 1:]
+        for i in range(self.n_states):
+            mask = hidden_states[:, :-1] == i
+            L = _noise_factor(self.Qs_[i])
+            steps[mask] = self.bs_[i] + np.dot(eps[mask], L.T)
+
+        _sample_linear_dynamics(np.asarray(self.As_, order='c',
+                                           dtype=np.float64),
+                                hidden_states, obs)
+        return obs, hidden_states
 
     def score(self, data):
         """Log-likelihood of sequences under the model
@@ -167,7 +253,8 @@ class MetastableSwitchingLDS(object):
         sequences = [ensure_type(s, dtype=np.float32, ndim=2, name='s')
                      for s in data]
         self.inferrer._sequences = data 
-        logprob, _ = self.inferrer.do_mslds_estep()
+        # the auxiliary matrices are only needed by the M-step
+        logprob, _ = self.inferrer.do_mslds_estep(compute_aux=False)
         return logprob
 
     def print_parameters(self, phase="", logprob=None, print_status=True):
@@ -206,6 +293,7 @@ class MetastableSwitchingLDS(object):
         """Estimate model parameters.
         """
         self._init(data)
+        self.solver.reset_warm_start()
         best_fit = {'params': {}, 'loglikelihood': -np.inf}
 
         fit_logprob = []
@@ -1,5 +1,7 @@
 from __future__ import division
 from __future__ import print_function
+import time
+import multiprocessing
 import numpy as np
 from mixtape._reversibility import reversible_transmat
 from mixtape.mslds_solvers.sparse_sdp.constraints import A_constraints
@@ -21,12 +23,53 @@ class MetastableSwitchingLDSSolver(object):
     This class should be a functional wrapper that takes in lists of
     parameters As, Qs, bs, covars, means along with sufficient statistics
     and returns updated lists. Not much state should stored.
+
+    Parameters
+    ----------
+    n_components : int
+        Number of hidden states
+    n_features : int
+        Dimensionality of the space
+    n_jobs : int, default=1
+        Number of worker processes used to solve the (independent)
+        per-state A, Q and b subproblems in the M-step. If None, use
+        one process per CPU. If 1, the states are solved serially in this
+        process. No more than n_components workers are started.
+    warm_start : bool, default=True
+        Start each state's A and Q semidefinite programs from their
+        solutions in the previous M-step. Consecutive EM iterations give
+        nearly identical subproblems, so this lets the later M-steps
+        converge in a few iterations.
+
+    Attributes
+    ----------
+    solve_times_ : np.ndarray, shape=(n_components,)
+        Wall-clock time, in seconds, spent solving each state's
+        subproblems during the last M-step.
+    sdp_n_iter_ : list of np.ndarray, shape=(n_components, 2)
+        For each M-step, the number of bounded trace solver iterations
+        spent on each state's A (column 0) and Q (column 1) subproblems.
     """
-    def __init__(self, n_components, n_features):
+    def __init__(self, n_components, n_features, n_jobs=1,
+                 warm_start=True):
         self.covars_prior = 1e-2
         self.covars_weight = 1.
         self.n_components = n_components
         self.n_features = n_features
+        if n_jobs is not None and n_jobs < 1:
+            raise ValueError('n_jobs must be a positive integer or None. '
+                             'you supplied %s' % n_jobs)
+        self.n_jobs = n_jobs
+        self.warm_start = warm_start
+        self.reset_warm_start()
+
+    def reset_warm_start(self):
+        """Forget the solutions of the previous M-steps, which are used
+        to warm start the A and Q semidefinite programs"""
+        # keyed by (state, 'A') and (state, 'Q')
+        self._sdp_cache = {}
+        self.solve_times_ = None
+        self.sdp_n_iter_ = []
 
     def do_hmm_mstep(self, stats):
         print("Starting hmm mstep")
@@ -114,22 +157,68 @@ class MetastableSwitchingLDSSolver(object):
 
     def AQb_update(self, As, Qs, bs, means, covars, stats, N_iter=400,
                     verbose=False, gamma=.5, tol=1e-1, num_biconvex=2):
-        Bs, Cs, Es, Ds, Fs = compute_aux_matrices(self.n_components,
-                self.n_features, As, bs, covars, stats)
+        if all(key in stats for key in ['B', 'C', 'D', 'E', 'F']):
+            # Assembled by the native E-step for these As, bs and covars
+            Bs, Cs, Ds, Es, Fs = [stats[key] for key in
+                                  ['B', 'C', 'D', 'E', 'F']]
+        else:
+            Bs, Cs, Es, Ds, Fs = compute_aux_matrices(self.n_components,
+                    self.n_features, As, bs, covars, stats)
         self.print_aux_matrices(Bs, Cs, Es, Ds, Fs)
         A_upds, Q_upds, b_upds = [], [], []
 
-        for i in range(self.n_components):
-            B, C, D, E, F = Bs[i], Cs[i], Ds[i], Es[i], Fs[i]
-            A, Q, mu = As[i], Qs[i], means[i]
-            A_upd, Q_upd, b_upd = AQb_solve(self.n_features, A, Q, mu, B,
-                    C, D, E, F, N_iter=N_iter, verbose=verbose,
-                    gamma=gamma, tol=tol, num_biconvex=num_biconvex)
+        # The subproblems for the different states are independent
+        if not self.warm_start:
+            self._sdp_cache = {}
+        tasks = [(self.n_features, As[i], Qs[i], means[i], Bs[i], Cs[i],
+                  Ds[i], Es[i], Fs[i], N_iter, verbose, gamma, tol,
+                  num_biconvex, self._sdp_cache.get((i, 'A'), {}),
+                  self._sdp_cache.get((i, 'Q'), {}))
+                 for i in range(self.n_components)]
+        n_jobs = self.n_jobs
+        if n_jobs is None:
+            n_jobs = multiprocessing.cpu_count()
+        n_jobs = min(n_jobs, self.n_components)
+
+        if n_jobs == 1:
+            results = [_AQb_solve_task(task) for task in tasks]
+        else:
+            pool = multiprocessing.Pool(n_jobs)
+            try:
+                results = pool.map(_AQb_solve_task, tasks, chunksize=1)
+            finally:
+                pool.terminate()
+
+        self.solve_times_ = np.zeros(self.n_components)
+        n_iter = np.zeros((self.n_components, 2), dtype=int)
+        for i, (A_upd, Q_upd, b_upd, seconds, A_cache, Q_cache) in \
+                enumerate(results):
             A_upds += [A_upd]
             Q_upds += [Q_upd]
             b_upds += [b_upd]
+            # the caches come back from the worker processes as copies
+            self._sdp_cache[(i, 'A')] = A_cache
+            self._sdp_cache[(i, 'Q')] = Q_cache
+            self.solve_times_[i] = seconds
+            n_iter[i] = A_cache.get('n_iter', 0), Q_cache.get('n_iter', 0)
+            print("State %d AQb solve time: %.3f s, SDP iterations: "
+                  "A %d, Q %d" % (i, seconds, n_iter[i, 0], n_iter[i, 1]))
+        self.sdp_n_iter_.append(n_iter)
         return A_upds, Q_upds, b_upds
 
+
+def _AQb_solve_task(task):
+    """Solve one state's A, Q and b subproblems, for
+    MetastableSwitchingLDSSolver.AQb_update. This needs to be a module level
+    function so that it can be sent to a worker process."""
+    (dim, A, Q, mu, B, C, D, E, F, N_iter, verbose, gamma, tol,
+     num_biconvex, A_cache, Q_cache) = task
+    start = time.time()
+    A_upd, Q_upd, b_upd = AQb_solve(dim, A, Q, mu, B, C, D, E, F,
+            N_iter=N_iter, verbose=verbose, gamma=gamma, tol=tol,
+            num_biconvex=num_biconvex, A_cache=A_cache, Q_cache=Q_cache)
+    return A_upd, Q_upd, b_upd, time.time() - start, A_cache, Q_cache
+
 def print_Q_test_case(test_file, A, D, F, dim):
     display_string = "Q-solve failed. Autogenerating Q test case"
     display_string = (bcolors.FAIL + display_string
@@ -195,19 +284,23 @@ def print_A_test_case(test_file, B, C, D, E, Q, mu, dim):
 
 def AQb_solve(dim, A, Q, mu, B, C, D, E, F, interactive=False, disp=True,
         verbose=False, debug=False, Rs=[10, 100, 1000], N_iter=400,
-        gamma=.5, tol=1e-1, num_biconvex=2):
+        gamma=.5, tol=1e-1, num_biconvex=2, A_cache=None, Q_cache=None):
+    # The iteration counts in the caches are totals over this call
+    for cache in [A_cache, Q_cache]:
+        if cache is not None:
+            cache['n_iter'] = 0
     # Should this be iterated for biconvex solution? Yes. Need to fix.
     for i in range(num_biconvex):
         Q_upd = Q_solve(dim, A, D, F, interactive=interactive,
                     disp=disp, debug=debug, Rs=Rs, verbose=verbose,
-                    gamma=gamma, tol=tol, N_iter=N_iter)
+                    gamma=gamma, tol=tol, N_iter=N_iter, cache=Q_cache)
         if Q_upd != None:
             Q = Q_upd
         else:
             print_Q_test_case("autogen_Q_tests.py", A, D, F, dim)
         A_upd = A_solve(dim, B, C, D, E, Q, mu, interactive=interactive,
                         disp=disp, debug=debug, Rs=Rs, N_iter=N_iter, 
-                        verbose=verbose, tol=tol)
+                        verbose=verbose, tol=tol, cache=A_cache)
         if A_upd != None:
             A = A_upd
         else:
@@ -271,10 +364,37 @@ def b_solve(n_features, A, mu):
     #return mu
     #return b 
 
+def _warm_start(cache, dim, X_init, R):
+    """The starting point for an A or Q solve: the cached solution of the
+    previous solve, if there is one, and X_init otherwise.
+
+    The solver embeds X / R in a matrix of unit trace, so a cached solution
+    whose trace is above the trace bound R of this solve is scaled down
+    onto the bound (which keeps it PSD).
+    """
+    if cache is None or cache.get('X') is None:
+        return X_init
+    X = cache['X']
+    if np.shape(X) != (dim, dim):
+        return X_init
+    trace = np.trace(X)
+    if not np.isfinite(trace) or trace <= 0:
+        return X_init
+    if trace > R:
+        X = X * (R / trace)
+    return X
+
+def _update_cache(cache, solver, X, succeed):
+    if cache is None:
+        return
+    cache['n_iter'] = cache.get('n_iter', 0) + solver.n_iter_
+    if succeed:
+        cache['X'] = X
+
 def A_solve(block_dim, B, C, D, E, Q, mu, interactive=False,
         disp=True, verbose=False, debug=False, Rs=[10, 100, 1000],
         N_iter=400, tol=1e-1, min_step_size=1e-6,
-        methods=['frank_wolfe']):
+        methods=['frank_wolfe'], cache=None):
     """
     Solves A optimization.
 
@@ -288,6 +408,11 @@ def A_solve(block_dim, B, C, D, E, Q, mu, interactive=False,
           --------------------
     A mu == 0
     X is PSD
+
+    If `cache` is a dict, the solution X of a previous call on a similar
+    problem, cache['X'], is used as the starting point. The new solution is
+    stored in cache['X'] and the solver iterations are added to
+    cache['n_iter'].
     """
     dim = 4*block_dim
     search_tol = 1.
@@ -361,6 +486,7 @@ def A_solve(block_dim, B, C, D, E, Q, mu, interactive=False,
             break
     if X_init == None:
         print("A_SOLVE INIT FAILED!")
+    X_init = _warm_start(cache, dim, X_init, R)
 
 
     def obj(X):
@@ -374,6 +500,7 @@ def A_solve(block_dim, B, C, D, E, Q, mu, interactive=False,
             interactive=interactive, disp=disp, verbose=verbose,
             debug=debug, Rs=Rs, min_step_size=min_step_size,
             methods=methods, X_init=X_init)
+    _update_cache(cache, g, X, succeed)
     if succeed:
         A_1 = get_entries(X, A_1_cds)
         A_T_1 = get_entries(X, A_T_1_cds)
@@ -387,7 +514,7 @@ def A_solve(block_dim, B, C, D, E, Q, mu, interactive=False,
 def Q_solve(block_dim, A, D, F, interactive=False, disp=True,
         verbose=False, debug=False, Rs=[10, 100, 1000], N_iter=400,
         gamma=.5, tol=1e-1, min_step_size=1e-6,
-        methods=['frank_wolfe']):
+        methods=['frank_wolfe'], cache=None):
     """
     Solves Q optimization.
 
@@ -399,6 +526,9 @@ def Q_solve(block_dim, A, D, F, interactive=False, disp=True,
          |           cI   R  |
           -------------------
     X is PSD
+
+    If `cache` is a dict, it is used to warm start the solver, as in
+    A_solve.
     """
     dim = 4*block_dim
     search_tol = 1.
@@ -454,6 +584,7 @@ def Q_solve(block_dim, A, D, F, interactive=False, disp=True,
         X_init == None
     else:
         print("Q_SOLVE SUCCESS!")
+    X_init = _warm_start(cache, dim, X_init, R)
 
     g = GeneralSolver()
     def obj(X):
@@ -466,6 +597,7 @@ def Q_solve(block_dim, A, D, F, interactive=False, disp=True,
         interactive=interactive, disp=disp, verbose=verbose, 
         debug=debug, Rs=Rs, min_step_size=min_step_size,
         methods=methods, X_init=X_init)
+    _update_cache(cache, g, X, succeed)
     if succeed:
         R_1 = scale*get_entries(X, R_1_cds)
         R_2 = scale*get_entries(X, R_2_cds)
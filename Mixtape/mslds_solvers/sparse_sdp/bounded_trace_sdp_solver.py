@@ -16,6 +16,130 @@ import numpy as np
 import scipy.linalg
 import scipy.sparse.linalg
 
+class LeadingEigenvectorOracle(object):
+    """
+    Computes the leading eigenvector of each of a sequence of slowly
+    varying symmetric matrices, such as the gradients in successive
+    Frank-Wolfe iterations.
+
+    Uses the implicitly restarted Lanczos method (ARPACK), started from
+    the eigenvector found in the previous call, so that only a few
+    restarts are needed when the matrix has changed little. Shifted
+    matrices are applied through a LinearOperator and are never formed.
+    The number of restarts ARPACK may use is adapted to the problem: it
+    is doubled when ARPACK fails to converge and halved after each
+    success. If ARPACK still fails, falls back to a dense
+    np.linalg.eigh.
+    """
+    def __init__(self, dim, tol=1e-9, shifts=[0., 1., 10., 100., 1000.],
+                 min_maxiter=10, max_maxiter=None, dense_dim=8):
+        """
+        Arguments
+        _________
+        dim: int
+            The dimensionality of the matrices
+        tol: float
+            Relative accuracy of the eigenvalue
+        shifts: list
+            Multiples of the identity added to the matrix when ARPACK
+            fails, in order. These do not change the eigenvectors, but
+            make the convergence criterion well behaved when the leading
+            eigenvalue is close to zero.
+        min_maxiter: int
+            Smallest allowed number of Lanczos restarts
+        max_maxiter: int
+            Largest allowed number of Lanczos restarts. Defaults to
+            10*dim, ARPACK's default.
+        dense_dim: int
+            Matrices of at most this dimension go straight to
+            np.linalg.eigh, which is faster than ARPACK for them.
+        """
+        self.dim = dim
+        self.tol = tol
+        self.shifts = shifts
+        self.min_maxiter = min_maxiter
+        if max_maxiter is None:
+            max_maxiter = max(10*dim, min_maxiter)
+        self.max_maxiter = max_maxiter
+        self.dense_dim = dense_dim
+        self.reset()
+
+    def reset(self):
+        """Forget the eigenvector of the previous call"""
+        self.v = None
+        self.maxiter = self.min_maxiter
+
+    def __call__(self, A, disp=True):
+        """
+        Parameters
+        __________
+        A: np.ndarray or scipy.sparse.linalg.LinearOperator
+            Symmetric (dim, dim) matrix
+        disp: bool
+            Report when falling back to np.linalg.eigh
+
+        Returns
+        _______
+        v: np.ndarray
+            Unit-norm eigenvector of A with the largest eigenvalue
+        stable: bool
+            Whether Lanczos failed, and v was found by the dense fallback.
+            Always False for matrices of at most dense_dim, which are
+            solved with np.linalg.eigh directly.
+        """
+        if self.dim <= self.dense_dim and isinstance(A, np.ndarray):
+            self.v = self._dense(A)
+            return self.v, False
+        op = scipy.sparse.linalg.aslinearoperator(A)
+        for shift in self.shifts:
+            v = self._lanczos(op, shift)
+            if v is not None:
+                self.v = v
+                return v, False
+        if disp:
+            print("sparse.linalg.eigsh failed; "
+                  "going to np.linalg.eigh")
+        if not isinstance(A, np.ndarray):
+            A = op.matmat(np.eye(self.dim))
+        self.v = self._dense(A)
+        self.maxiter = self.min_maxiter
+        return self.v, True
+
+    def _dense(self, A):
+        ws, vs = np.linalg.eigh(A)
+        return vs[:, np.argmax(ws)]
+
+    def _lanczos(self, op, shift):
+        if shift != 0:
+            shifted = scipy.sparse.linalg.LinearOperator(op.shape,
+                    matvec=lambda x: op.matvec(x) + shift*x,
+                    dtype=op.dtype)
+        else:
+            shifted = op
+        v0 = self.v
+        while True:
+            try:
+                _, vs = scipy.sparse.linalg.eigsh(shifted, k=1,
+                        which='LA', tol=self.tol, v0=v0,
+                        maxiter=self.maxiter)
+            except scipy.sparse.linalg.ArpackNoConvergence as e:
+                if self.maxiter >= self.max_maxiter:
+                    return None
+                self.maxiter = min(2*self.maxiter, self.max_maxiter)
+                # continue from the best approximation so far
+                if len(e.eigenvalues) > 0 and \
+                        np.all(np.isfinite(e.eigenvectors)):
+                    v0 = e.eigenvectors[:, 0]
+                continue
+            except (scipy.sparse.linalg.ArpackError, ValueError):
+                return None
+            break
+        v = vs[:, 0]
+        if not np.all(np.isfinite(v)):
+            return None
+        self.maxiter = max(self.maxiter // 2, self.min_maxiter)
+        return v
+
 class BoundedTraceSolver(object):
     """
     Implementation of Hazan's Algorithm, which solves
@@ -39,33 +163,15 @@ class BoundedTraceSolver(object):
         self.f = f
         self.gradf = gradf
         self.dim = dim
+        # Warm starts each Frank-Wolfe iteration from the previous one's
+        # eigenvector. It's kept across calls of solve on this object, but
+        # FeasibilitySolver creates a new solver, and so a new oracle, for
+        # each trace bound and each step of the binary search in
+        # GeneralSolver, so different problems don't share it.
+        self.oracle = LeadingEigenvectorOracle(dim)
 
     def rank_one_approximation(self, grad, disp=True):
-        epsj = 1e-9
-        # Use Implicitly Restarted Arnoldi Method (IRAM)
-        # (stable version of Lanczos's algorithm)
-        shifts = [1., 10., 100., 1000.]
-        vj = None
-        stable = False
-        for shift in shifts:
-            try:
-                _, vj = scipy.sparse.linalg.eigsh(grad
-                        + shift*np.eye(self.dim),
-                        k=1, tol=epsj, which='LA')
-            except (scipy.sparse.linalg.ArpackError,
-                    scipy.sparse.linalg.ArpackNoConvergence):
-                continue
-            if not np.isnan(np.min(vj)):
-                break
-        if vj == None or np.isnan(np.min(vj)):
-            if disp:
-                print("sparse.linalg.eigsh failed; "
-                      "going to np.linalg.eigh")
-            ws, vs = np.linalg.eigh(grad)
-            i = np.argmax(np.real(ws))
-            vj = vs[:, i]
-            stable = True
-        return vj, stable
+        return self.oracle(grad, disp=disp)
 
     def stable_rank_one_approximation(self, grad):
         ws, vs = np.linalg.eigh(grad)
@@ -131,8 +237,12 @@ class BoundedTraceSolver(object):
         __________
         N_iter: int
             The desired number of iterations
+
+        The number of iterations actually performed is stored in
+        self.n_iter_.
         """
         f, gradf = self.f, self.gradf
+        self.n_iter_ = 0
         if X_init == None:
             v = np.random.rand(self.dim, 1)
             # orthonormalize v
@@ -143,6 +253,7 @@ class BoundedTraceSolver(object):
         fX = f(X)
         stable_so_far = 0
         for j in range(N_iter):
+            self.n_iter_ += 1
             grad = gradf(X)
             results = []
             if good_enough != None:
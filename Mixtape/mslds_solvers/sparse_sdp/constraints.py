@@ -282,6 +282,114 @@ def grad_many_batch_linear_equals(X, constraints):
 
     return (1./dim**2) * grad
 
+def _block_indices(coord):
+    x_low, x_hi, y_low, y_hi = coord
+    rows, cols = np.mgrid[x_low:x_hi, y_low:y_hi]
+    return rows.ravel(), cols.ravel()
+
+def _concatenate(arrays, dtype):
+    if len(arrays) == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.concatenate(arrays).astype(dtype)
+
+class BatchEquals(object):
+    """
+    Compiled form of many_batch_equals and grad_many_batch_equals.
+
+    The coordinates of all the blocks and their target values are
+    stored in flat arrays, so that the penalty and its gradient are each
+    computed in a few vectorized operations rather than a Python loop
+    over the blocks.
+
+    Calling the object evaluates the penalty. The gradient is given by
+    the grad method. Both accept X of any shape that contains the
+    blocks.
+
+    Parameters
+    ----------
+    constraints : list
+        (coords, mat) pairs, as for many_batch_equals
+    """
+    def __init__(self, constraints):
+        rows, cols, targets = [], [], []
+        for coord, mat in constraints:
+            r, c = _block_indices(coord)
+            rows.append(r)
+            cols.append(c)
+            targets.append((np.zeros((coord[1]-coord[0],
+                coord[3]-coord[2])) + mat).ravel())
+        self.rows = _concatenate(rows, np.intp)
+        self.cols = _concatenate(cols, np.intp)
+        self.targets = _concatenate(targets, np.float64)
+
+    def residuals(self, X):
+        return X[self.rows, self.cols] - self.targets
+
+    def __call__(self, X):
+        (dim, _) = np.shape(X)
+        r = self.residuals(X)
+        return (1./dim**2) * np.dot(r, r)
+
+    def grad(self, X):
+        (dim, n) = np.shape(X)
+        r = self.residuals(X)
+        # The blocks may overlap, so accumulate rather than assign
+        grad = np.bincount(self.rows*n + self.cols, weights=2*r,
+                minlength=dim*n)
+        return (1./dim**2) * grad.reshape((dim, n))
+
+class BatchLinearEquals(object):
+    """
+    Compiled form of many_batch_linear_equals and
+    grad_many_batch_linear_equals.
+
+    Parameters
+    ----------
+    constraints : list
+        (c, P_coords, Q, R_coords) tuples, each asking that
+        R_coords = c * P_coords + Q, as for many_batch_linear_equals
+    """
+    def __init__(self, constraints):
+        P_rows, P_cols, R_rows, R_cols, cs, Qs = [], [], [], [], [], []
+        for c, P_coords, Q, R_coords in constraints:
+            r, col = _block_indices(P_coords)
+            P_rows.append(r)
+            P_cols.append(col)
+            r, col = _block_indices(R_coords)
+            R_rows.append(r)
+            R_cols.append(col)
+            cs.append(c * np.ones(len(r)))
+            Qs.append((np.zeros((R_coords[1]-R_coords[0],
+                R_coords[3]-R_coords[2])) + Q).ravel())
+        self.P_rows = _concatenate(P_rows, np.intp)
+        self.P_cols = _concatenate(P_cols, np.intp)
+        self.R_rows = _concatenate(R_rows, np.intp)
+        self.R_cols = _concatenate(R_cols, np.intp)
+        self.cs = _concatenate(cs, np.float64)
+        self.Qs = _concatenate(Qs, np.float64)
+        # The P block gets no gradient when c == 0
+        self.P_weights = np.zeros(len(self.cs))
+        nonzero = self.cs != 0
+        self.P_weights[nonzero] = -2. / self.cs[nonzero]
+
+    def residuals(self, X):
+        return (X[self.R_rows, self.R_cols]
+                - self.cs * X[self.P_rows, self.P_cols] - self.Qs)
+
+    def __call__(self, X):
+        (dim, _) = np.shape(X)
+        r = self.residuals(X)
+        return (1./dim**2) * np.dot(r, r)
+
+    def grad(self, X):
+        (dim, n) = np.shape(X)
+        r = self.residuals(X)
+        indices = np.concatenate([self.R_rows*n + self.R_cols,
+                                  self.P_rows*n + self.P_cols])
+        weights = np.concatenate([2*r, self.P_weights*r])
+        grad = np.bincount(indices, weights=weights, minlength=dim*n)
+        return (1./dim**2) * grad.reshape((dim, n))
+
 def A_coords(dim):
     """
       ----------------------
@@ -358,12 +466,9 @@ C =  | _     D^{-1}  _   _ |
             (I_1_cds, np.eye(block_dim)), (I_2_cds, np.eye(block_dim))]
 
     # Add constraints to Gs
-    def const_regions(X):
-        return many_batch_equals(X, constraints)
-    def grad_const_regions(X):
-        return grad_many_batch_equals(X, constraints)
+    const_regions = BatchEquals(constraints)
     Gs.append(const_regions)
-    gradGs.append(grad_const_regions)
+    gradGs.append(const_regions.grad)
 
     """
     We need to enforce linear inequalities
@@ -378,12 +483,9 @@ C =  | _     D^{-1}  _   _ |
     linear_constraints = [(1., A_1_cds, np.zeros((block_dim, block_dim)),
                             A_2_cds)]
 
-    def linear_regions(X):
-        return many_batch_linear_equals(X, linear_constraints)
-    def grad_linear_regions(X):
-        return grad_many_batch_linear_equals(X, linear_constraints)
+    linear_regions = BatchLinearEquals(linear_constraints)
     Gs.append(linear_regions)
-    gradGs.append(grad_linear_regions)
+    gradGs.append(linear_regions.grad)
 
     if stability:
         """
@@ -527,12 +629,9 @@ C =  | I        _    _  _  |
                     (c_I_1_cds, c*np.eye(dim)), (c_I_2_cds, c*np.eye(dim))]
 
     # Add constraints to Gs
-    def const_regions(X):
-        return many_batch_equals(X, constraints)
-    def grad_const_regions(X):
-        return grad_many_batch_equals(X, constraints)
+    const_regions = BatchEquals(constraints)
     Gs.append(const_regions)
-    gradGs.append(grad_const_regions)
+    gradGs.append(const_regions.grad)
 
     """ We need to enforce linear inequalities
           -----------
@@ -543,11 +642,8 @@ C =  | I        _    _  _  |
     """
     linear_constraints = [(1., R_1_cds, np.zeros((dim,dim)), R_2_cds)]
 
-    def linear_regions(X):
-        return many_batch_linear_equals(X, linear_constraints)
-    def grad_linear_regions(X):
-        return grad_many_batch_linear_equals(X, linear_constraints)
+    linear_regions = BatchLinearEquals(linear_constraints)
     Gs.append(linear_regions)
-    gradGs.append(grad_linear_regions)
+    gradGs.append(linear_regions.grad)
 
     return As, bs, Cs, ds, Fs, gradFs, Gs, gradGs
@@ -82,23 +82,20 @@ class FeasibilitySolver(object):
         Transform input into correct form for feasibility solver.
         """
         m, n, p, q = len(As), len(Cs), len(Fs), len(Gs)
-        Aprimes, Cprimes, Fprimes, gradFprimes, Gprimes, gradGprimes = \
-                [], [], [], [], [], []
+        Fprimes, gradFprimes, Gprimes, gradGprimes = [], [], [], []
         dim = self.dim
 
         # Rescale the trace bound and expand all constraints to be
-        # expressed in terms of Y
-        for i in range(m):
-            A = R * As[i]
-            Aprime = np.zeros((dim+1,dim+1))
-            Aprime[:dim, :dim] = A
-            Aprimes.append(Aprime)
+        # expressed in terms of Y. The linear constraint matrices are
+        # stacked into (m, dim+1, dim+1) arrays, so that the penalties
+        # can evaluate them all at once.
+        Aprimes = np.zeros((m, dim+1, dim+1))
+        if m > 0:
+            Aprimes[:, :dim, :dim] = R * np.asarray(As)
         bprimes = bs
-        for j in range(n):
-            C = R * Cs[j]
-            Cprime = np.zeros((dim+1,dim+1))
-            Cprime[:dim, :dim] = C
-            Cprimes.append(Cprime)
+        Cprimes = np.zeros((n, dim+1, dim+1))
+        if n > 0:
+            Cprimes[:, :dim, :dim] = R * np.asarray(Cs)
         dprimes = ds
         for k in range(p):
             fk = Fs[k]
@@ -161,7 +158,11 @@ class FeasibilitySolver(object):
             Tr(A_i X) <= b_i, Tr(C_j X)  = d_j
             f_k(X) <= 0, g_l(X) == 0
             Tr(X) <= R
+
+        The total number of bounded trace solver iterations, over all
+        the trace bounds tried, is stored in self.n_iter_.
         """
+        self.n_iter_ = 0
         for R in Rs:
             if debug:
                 print("R: ", R)
@@ -180,6 +181,7 @@ class FeasibilitySolver(object):
                     methods=methods, early_exit=early_exit, disp=verbose,
                     min_step_size=min_step_size, good_enough=-tol,
                     num_stable=num_stable)
+            self.n_iter_ += self._solver.n_iter_
             fY = self.f(Y)
             X, fX = R*Y[:self.dim, :self.dim], fY
             succeed = not (fX < -tol)
@@ -130,6 +130,9 @@ class GeneralSolver(object):
         __________
         N_iter: int
             Max number of iterations for each feasibility search.
+
+        The total number of bounded trace solver iterations, over all
+        the feasibility searches, is stored in self.n_iter_.
         """
         # Do the binary search
         X = None
@@ -142,6 +145,7 @@ class GeneralSolver(object):
                 methods=methods, disp=disp,
                 verbose=verbose, debug=debug, X_init = X_init, Rs=Rs,
                 min_step_size=min_step_size)
+        self.n_iter_ = f_init.n_iter_
         if not succeed:
             self.print_status(disp, debug, "Problem infeasible", X_orig,
                     -np.inf, np.inf)
@@ -166,6 +170,7 @@ class GeneralSolver(object):
             X_L, fX_L, succeed_L = f_lower.feasibility_solve(N_iter, tol,
                 methods=methods, disp=disp, debug=debug, verbose=verbose,
                 Rs=Rs, X_init=X, num_stable=num_stable)
+            self.n_iter_ += f_lower.n_iter_
 
             if succeed_L:
                 status = "Feasible"
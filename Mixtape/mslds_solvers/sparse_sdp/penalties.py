@@ -1,6 +1,5 @@
 from __future__ import division
 import numpy as np
-import scipy.misc
 """
 Various Useful penalty Functions.
 
@@ -33,6 +32,32 @@ def compute_scale(m, n, p, q, eps):
                 + np.log(p+1) + np.log(q+1)), 1.) / eps
     return M
 
+def _logsumexp(a):
+    """
+    log(sum(exp(a))) for a 1-d array. The penalties are evaluated on short
+    arrays many times per iteration, where the overhead of
+    scipy.misc.logsumexp dominates.
+    """
+    a_max = np.amax(a)
+    if not np.isfinite(a_max):
+        return a_max
+    return a_max + np.log(np.sum(np.exp(a - a_max)))
+
+def _traces(X, As, bs):
+    """
+    Computes Tr(A_i X) - b_i for all i at once. As may be a list of
+    (dim, dim) arrays or a (m, dim, dim) array.
+    """
+    if len(As) == 0:
+        return np.zeros(0)
+    As = np.asarray(As)
+    # Tr(A_i X) = sum_jk A_i[j,k] X[k,j]
+    return np.tensordot(As, X.T, axes=2) - np.asarray(bs, dtype=float)
+
+def _signs(vals):
+    # the subgradient of |x| at 0 is taken to be 1
+    return np.where(vals < 0, -1., 1.)
+
 def penalties(X, As, bs, Cs, ds, Fs, Gs):
     """
     Computes penalties
@@ -40,23 +65,13 @@ def penalties(X, As, bs, Cs, ds, Fs, Gs):
      (max_i {Tr(Ai,X) - bi}, max_j{|Tr(Cj,X) - dj|},
       max_k {Fk(x)}, max_l {|Gl(x)|})
 
+    As and Cs may be lists of matrices or stacked into 3-d arrays.
     """
-    (dim, _) = np.shape(X)
-    m, n, p, q = len(As), len(Cs), len(Fs), len(Gs)
-    penalties = np.zeros(n+m+p+q)
-    # Handle linear inequalities
-    for i in range(m):
-        penalties[i] = np.trace(np.dot(As[i],X)) - bs[i]
-    # Handle linear equalities
-    for j in range(n):
-        penalties[j+m] = np.abs(np.trace(np.dot(Cs[j],X)) - ds[j])
-    # Handle convex inequalities
-    for k in range(p):
-        penalties[k+m+n] = Fs[k](X)
-    # Handle convex equalities
-    for l in range(q):
-        penalties[l+p+m+n] = np.abs(Gs[l](X))
-    return penalties
+    return np.concatenate([_traces(X, As, bs),
+                           np.abs(_traces(X, Cs, ds)),
+                           np.array([Fk(X) for Fk in Fs], dtype=float),
+                           np.abs(np.array([Gl(X) for Gl in Gs],
+                                           dtype=float))])
 
 def log_sum_exp_penalty(X, M, As, bs, Cs, ds, Fs, Gs):
     """
@@ -76,11 +91,11 @@ def log_sum_exp_penalty(X, M, As, bs, Cs, ds, Fs, Gs):
        Input matrix
     M: float
         Rescaling Factor
-    As: list
+    As: list or numpy.ndarray
         Inequality matrices
     bs: list
         Inequality vectors
-    Cs: list
+    Cs: list or numpy.ndarray
         Equality matrices
     ds: list
         Equality vectors
@@ -91,11 +106,9 @@ def log_sum_exp_penalty(X, M, As, bs, Cs, ds, Fs, Gs):
     """
     pens = penalties(X, As, bs, Cs, ds, Fs, Gs)
     retval = 0.
-    m, n, p, q = len(As), len(Cs), len(Fs), len(Gs)
-    if m + n + p + q > 0:
+    if len(pens) > 0:
         try:
-            retval = scipy.misc.logsumexp(M*np.array(pens), axis=0)
-            retval = -(1.0/M) * retval
+            retval = -(1.0/M) * _logsumexp(M*pens)
         except FloatingPointError:
             if np.amax(pens) == np.inf:
                 return -np.inf
@@ -116,49 +129,31 @@ def log_sum_exp_grad_penalty(X, M, As, bs, Cs, ds, Fs, gradFs, Gs, gradGs):
     As[i] and Cs[j] should be symmetric real matrices and Fs[k], Gs[l] to
     be convex functions.
     """
-    (dim, _) = np.shape(X)
     m, n, p, q = len(As), len(Cs), len(Fs), len(Gs)
-    retval = 0.
-    num_mats = []
     if m+n+p+q <= 0:
         return None
-    log_nums = np.zeros(m+n+p+q)
-    for i in range(m):
-        log_nums[i] = M*(np.trace(np.dot(As[i],X)) - bs[i])
-        num_mats.append(M*As[i].T)
-    for j in range(n):
-        log_nums[j+m] = M*np.abs(np.trace(np.dot(Cs[j],X)) - ds[j])
-        val = np.trace(np.dot(Cs[j],X)) - ds[j]
-        if val < 0 :
-            sgn = -1.
-        else:
-            sgn = 1.
-        num_mats.append(sgn*M*Cs[j].T)
+    A_vals = _traces(X, As, bs)
+    C_vals = _traces(X, Cs, ds)
+    F_vals = np.array([Fk(X) for Fk in Fs], dtype=float)
+    G_vals = np.array([Gl(X) for Gl in Gs], dtype=float)
+    log_nums = M*np.concatenate([A_vals, np.abs(C_vals), F_vals,
+                                 np.abs(G_vals)])
+    # The weight of each constraint's gradient, c'_i / c
+    weights = np.exp(log_nums - _logsumexp(log_nums))
+
+    # Now construct gradient. The factors of M cancel.
+    grad = np.zeros(np.shape(X))
+    if m > 0:
+        grad += np.tensordot(weights[:m], np.asarray(As), axes=1).T
+    if n > 0:
+        grad += np.tensordot(weights[m:m+n] * _signs(C_vals),
+                             np.asarray(Cs), axes=1).T
     for k in range(p):
-        log_nums[k+n+m] = M*Fs[k](X)
-        num_mats.append(M*gradFs[k](X))
+        grad += weights[m+n+k] * gradFs[k](X)
+    G_weights = weights[m+n+p:] * _signs(G_vals)
     for l in range(q):
-        log_nums[l+n+m+p] = M*np.abs(Gs[l](X))
-        val = Gs[l](X)
-        if val < 0 :
-            sgn = -1.
-        else:
-            sgn = 1.
-        num_mats.append(sgn*M*gradGs[l](X))
-    log_nums = np.array(log_nums)
-    log_denom = scipy.misc.logsumexp(log_nums, axis=0)
-
-    # Now subtract from numerator
-    log_nums -= log_denom
-
-    # Undo logarithmic storage
-    nums = np.exp(log_nums)
-
-    # Now construct gradient
-    grad = np.zeros(np.shape(X))
-    for ind in range(m+n+p+q):
-        grad += nums[ind] * num_mats[ind]
-    grad = -(1.0/M) * grad
+        grad += G_weights[l] * gradGs[l](X)
+    grad = -grad
     return grad
 
 def neg_max_penalty(X, As, bs, Cs, ds, Fs, Gs):
@@ -219,3 +219,25 @@ def run_experiment(B, N_iter, methods=[], disp=True,
             early_exit=early_exit)
     elapsed = (time.clock() - start)
     return X, elapsed
+
+def test_leading_eigenvector_oracle():
+    # The warm started oracle should follow the leading eigenvector of a
+    # slowly varying sequence of matrices, given either as arrays or as
+    # LinearOperators
+    from ..bounded_trace_sdp_solver import LeadingEigenvectorOracle
+    random = np.random.RandomState(0)
+    for dim in [4, 50]:
+        oracle = LeadingEigenvectorOracle(dim)
+        B = random.randn(dim, dim)
+        G = B + B.T
+        for j in range(10):
+            B = random.randn(dim, dim)
+            G = G + 1e-2 * (B + B.T)
+            for A in [G, scipy.sparse.linalg.aslinearoperator(G)]:
+                v, stable = oracle(A, disp=False)
+                ws, vs = np.linalg.eigh(G)
+                assert not stable
+                assert np.abs(np.dot(v, vs[:, -1])) > 1 - 1e-6
+        # warm starting from the exact eigenvector
+        v, _ = oracle(G, disp=False)
+        assert np.abs(np.dot(v, vs[:, -1])) > 1 - 1e-6
@@ -2,6 +2,7 @@ from __future__ import division, print_function, absolute_import
 
 from ..constraints import *
 from ..utils import numerical_derivative
+import time
 import numpy as np
 from nose.plugins.attrib import attr
 
@@ -174,3 +175,70 @@ def test_A_constraints():
                 num_grad = numerical_derivative(g, X, eps)
                 print("num_grad:\n", num_grad)
                 assert np.sum(np.abs(grad - num_grad)) < tol
+
+def _compiled_batch_equals():
+    # (compiled, closure, closure gradient) triples over overlapping
+    # blocks, and the Q program's equality constraints
+    block_dim = 8
+    D = np.eye(block_dim)
+    A = 0.5 * np.eye(block_dim)
+    As, bs, Cs, ds, Fs, gradFs, Gs, gradGs = \
+        Q_constraints(block_dim, A, D, D, 0.5)
+    (D_ADA_T_cds, I_1_cds, I_2_cds, R_1_cds,
+        D_cds, c_I_1_cds, c_I_2_cds, R_2_cds) = Q_coords(block_dim)
+    constraints = [((2*block_dim, 4*block_dim, 0, 2*block_dim),
+                    np.zeros((2*block_dim, 2*block_dim))),
+                   (D_ADA_T_cds, D - np.dot(A, np.dot(D, A.T))),
+                   (I_1_cds, np.eye(block_dim)), (D_cds, D),
+                   # overlaps the I_1 block
+                   ((0, block_dim, 0, 2*block_dim), 2.)]
+    linear_constraints = [(1., R_1_cds, np.zeros((block_dim, block_dim)),
+                           R_2_cds),
+                          (2., D_cds, np.ones((block_dim, block_dim)),
+                           D_ADA_T_cds),
+                          (0., c_I_1_cds, np.eye(block_dim), c_I_2_cds)]
+    compiled = [(BatchEquals(constraints),
+                 lambda X: many_batch_equals(X, constraints),
+                 lambda X: grad_many_batch_equals(X, constraints)),
+                (BatchLinearEquals(linear_constraints),
+                 lambda X: many_batch_linear_equals(X, linear_constraints),
+                 lambda X: grad_many_batch_linear_equals(X,
+                     linear_constraints))]
+    return 4*block_dim, compiled, Gs
+
+def test_compiled_batch_equals():
+    # The compiled constraints agree with the closures over
+    # many_batch_equals and many_batch_linear_equals
+    dim, compiled, Gs = _compiled_batch_equals()
+    random = np.random.RandomState(0)
+    X = random.rand(dim, dim)
+    for fast, g, gradg in compiled:
+        np.testing.assert_almost_equal(fast(X), g(X))
+        np.testing.assert_array_almost_equal(fast.grad(X), gradg(X))
+
+    # The Q and A programs are built from the compiled constraints
+    for g in Gs:
+        assert isinstance(g, (BatchEquals, BatchLinearEquals))
+
+@attr('slow')
+def test_compiled_batch_equals_speed():
+    # The compiled constraints are faster than the closures
+    dim, compiled, _ = _compiled_batch_equals()
+    random = np.random.RandomState(0)
+    X = random.rand(dim, dim)
+    N_evals = 200
+    for fast, g, gradg in compiled:
+        t0 = time.time()
+        for i in range(N_evals):
+            g(X)
+            gradg(X)
+        t1 = time.time()
+        for i in range(N_evals):
+            fast(X)
+            fast.grad(X)
+        t2 = time.time()
+        print("%s timings for %d evaluations" % (type(fast).__name__,
+              N_evals))
+        print('closures time ', t1-t0)
+        print('compiled time ', t2-t1)
+        assert t2-t1 < t1-t0
@@ -17,12 +17,16 @@
 # License along with Mixtape. If not, see <http://www.gnu.org/licenses/>.
 
 from __future__ import print_function, division, absolute_import
-from sklearn import decomposition
 import numpy as np
+import scipy.linalg
+from sklearn import decomposition
+from sklearn.base import BaseEstimator, TransformerMixin
+from sklearn.utils import array2d
+from sklearn.utils.extmath import randomized_svd
 
 from six import PY2
 
-__all__ = ['PCA']
+__all__ = ['PCA', 'IncrementalPCA']
 
 
 class MultiSequenceDecompositionMixin(object):
@@ -94,3 +98,307 @@ class MultiSequenceDecompositionMixin(object):
 
 class PCA(MultiSequenceDecompositionMixin, decomposition.PCA):
     pass
+
+
+class IncrementalPCA(BaseEstimator, TransformerMixin):
+    """Principal component analysis by streaming accumulation of the covariance
+
+    Unlike :class:`PCA`, which concatenates all of the sequences into a
+    single array before fitting, this estimator only ever holds one
+    sequence in memory at a time. The mean and covariance matrix of the
+    data are accumulated in double precision as sequences are passed to
+    `partial_fit()`, and the eigenproblem is solved lazily when the
+    components are first requested. Peak memory is therefore
+    O(n_features^2) rather than O(n_samples * n_features).
+
+    Parameters
+    ----------
+    n_components : int, None
+        Number of components to keep. If None, all components are kept.
+    whiten : bool, default=False
+        If True, the projected data is divided by the square root of the
+        explained variance, so that each component has unit variance.
+    solver : {'auto', 'full', 'randomized'}, default='auto'
+        Eigensolver used for the covariance matrix. 'full' performs a
+        dense symmetric eigendecomposition. 'randomized' uses a randomized
+        range finder to extract only the top `n_components` eigenvectors,
+        which is much faster for wide feature sets. 'auto' uses the
+        randomized solver when `n_components` is less than 80% of a large
+        (more than 500) number of features.
+    n_oversamples : int, default=10
+        Number of additional random vectors used by the randomized solver.
+    n_iter : int, default=4
+        Number of power iterations used by the randomized solver.
+    random_state : int or RandomState, optional
+        Random number generator used by the randomized solver.
+
+    Attributes
+    ----------
+    components_ : array-like, shape (n_components, n_features)
+        Principal axes in feature space, sorted by explained variance.
+    explained_variance_ : array-like, shape (n_components,)
+        The variance explained by each of the selected components.
+    explained_variance_ratio_ : array-like, shape (n_components,)
+        Fraction of the total variance explained by each of the
+        selected components.
+    mean_ : array, shape (n_features,)
+        The mean of the data along each feature.
+    covariance_ : array, shape (n_features, n_features)
+        The unbiased sample covariance matrix of the data (normalized by
+        ``n_observations_ - 1``, as in :class:`sklearn.decomposition.PCA`).
+    n_components_ : int
+        The number of components kept.
+    noise_variance_ : float
+        Average of the variance not explained by the kept components.
+    n_observations_ : int
+        Total number of data points fit by the model. Note that the model
+        is "reset" by calling `fit()` with new sequences, whereas
+        `partial_fit()` updates the fit with new data, and is suitable for
+        online learning.
+    n_sequences_ : int
+        Total number of sequences fit by the model.
+    """
+
+    def __init__(self, n_components=None, whiten=False, solver='auto',
+                 n_oversamples=10, n_iter=4, random_state=None):
+        self.n_components = n_components
+        self.whiten = whiten
+        self.solver = solver
+        self.n_oversamples = n_oversamples
+        self.n_iter = n_iter
+        self.random_state = random_state
+
+        self.n_features = None
+        self.n_observations_ = None
+        self.n_sequences_ = None
+
+        self._initialized = False
+
+        # running mean of the data
+        self._mean = None
+        # running sum of the centered outer products (the scatter matrix)
+        self._scatter = None
+
+        # Cached results of the eigendecompsition
+        self._components_ = None
+        self._explained_variance_ = None
+
+        # are our current components dirty? this indicates that we've updated
+        # the model with more data since the last time we solved the
+        # eigenproblem, and is set by _fit
+        self._is_dirty = True
+
+    def _initialize(self, n_features):
+        if self._initialized:
+            return
+
+        self.n_features = n_features
+        self.n_observations_ = 0
+        self.n_sequences_ = 0
+        self._mean = np.zeros(n_features)
+        self._scatter = np.zeros((n_features, n_features))
+        self._initialized = True
+
+    @property
+    def n_components_(self):
+        if self.n_components is None:
+            return self.n_features
+        return min(self.n_components, self.n_features)
+
+    @property
+    def mean_(self):
+        return self._mean
+
+    @property
+    def covariance_(self):
+        if not self.n_observations_:
+            raise ValueError('The model has not been fit with any data. '
+                             'Call fit() or partial_fit() with a non-empty '
+                             'sequence first.')
+        # with a single observation the scatter matrix is zero
+        return self._scatter / max(self.n_observations_ - 1, 1)
+
+    def _solve(self):
+        if not self._is_dirty:
+            return
+        covariance = self.covariance_
+        if self.solver not in ('auto', 'full', 'randomized'):
+            raise ValueError("solver must be one of 'auto', 'full', or "
+                             "'randomized'. you supplied %r" % self.solver)
+
+        k = self.n_components_
+        solver = self.solver
+        if solver == 'auto':
+            if self.n_features > 500 and k < 0.8 * self.n_features:
+                solver = 'randomized'
+            else:
+                solver = 'full'
+
+        if solver == 'full' or k == self.n_features:
+            vals, vecs = scipy.linalg.eigh(covariance)
+            # sort in order of decreasing value
+            ind = np.argsort(vals)[::-1][:k]
+            vals = vals[ind]
+            vecs = vecs[:, ind]
+        else:
+            # the covariance matrix is symmetric positive semidefinite, so
+            # its singular value decomposition is also its eigendecomposition
+            vecs, vals, _ = randomized_svd(
+                covariance, k, n_oversamples=self.n_oversamples,
+                n_iter=self.n_iter, random_state=self.random_state)
+
+        self._explained_variance_ = np.maximum(vals, 0)
+        self._components_ = vecs.T
+        self._is_dirty = False
+
+    @property
+    def components_(self):
+        self._solve()
+        return self._components_
+
+    @property
+    def explained_variance_(self):
+        self._solve()
+        return self._explained_variance_
+
+    @property
+    def explained_variance_ratio_(self):
+        total = np.trace(self.covariance_)
+        return self.explained_variance_ / total
+
+    @property
+    def noise_variance_(self):
+        if self.n_components_ >= self.n_features:
+            return 0.0
+        total = np.trace(self.covariance_)
+        residual = total - np.sum(self.explained_variance_)
+        return max(residual, 0.0) / (self.n_features - self.n_components_)
+
+    def fit(self, sequences, y=None):
+        """Fit the model with a collection of sequences.
+
+        This method is not online.  Any state accumulated from previous calls
+        to fit() or partial_fit() will be cleared. For online learning, use
+        `partial_fit`.
+
+        Parameters
+        ----------
+        sequences: list of array-like, each of shape (n_samples_i, n_features)
+            Training data, where n_samples_i in the number of samples
+            in sequence i and n_features is the number of features.
+        y : None
+            Ignored
+
+        Returns
+        -------
+        self : object
+            Returns the instance itself.
+        """
+        self._initialized = False
+        self.n_observations_ = 0
+        self.n_sequences_ = 0
+        for X in sequences:
+            self._fit(X)
+        return self
+
+    def partial_fit(self, X):
+        """Fit the model with X.
+
+        This method is suitable for online learning. The state of the model
+        will be updated with the new data `X`.
+
+        Parameters
+        ----------
+        X: array-like, shape (n_samples, n_features)
+            Training data, where n_samples in the number of samples
+            and n_features is the number of features.
+
+        Returns
+        -------
+        self : object
+            Returns the instance itself.
+        """
+        self._fit(X)
+        return self
+
+    def _fit(self, X):
+        X = np.asarray(array2d(X), dtype=np.float64)
+        self._initialize(X.shape[1])
+        if X.shape[1] != self.n_features:
+            raise ValueError('X has %d features, but the model was fit with '
+                             '%d features' % (X.shape[1], self.n_features))
+        n_new = X.shape[0]
+        if n_new == 0:
+            return
+
+        # merge the centered scatter matrix of this batch into the running
+        # one using the pairwise update of Chan et al., which avoids the
+        # catastrophic cancellation of accumulating raw second moments.
+        mean_new = X.mean(axis=0)
+        X_centered = X - mean_new
+        scatter_new = np.dot(X_centered.T, X_centered)
+
+        n_old = self.n_observations_
+        n_total = n_old + n_new
+        delta = mean_new - self._mean
+        self._scatter += scatter_new
+        self._scatter += np.outer(delta, delta) * (n_old * n_new / float(n_total))
+        self._mean += delta * (n_new / float(n_total))
+
+        self.n_observations_ = n_total
+        self.n_sequences_ += 1
+        self._is_dirty = True
+
+    def partial_transform(self, X):
+        """Apply the dimensionality reduction to a single sequence.
+
+        Parameters
+        ----------
+        X: array-like, shape (n_samples, n_features)
+            A single sequence of data, where n_samples in the number of
+            samples and n_features is the number of features.
+
+        Returns
+        -------
+        X_new : array-like, shape (n_samples, n_components)
+            Projection of X onto the principal components
+        """
+        X = array2d(X)
+        X_transformed = np.dot(X - self.mean_, self.components_.T)
+        if self.whiten:
+            X_transformed /= np.sqrt(self.explained_variance_)
+        return X_transformed
+
+    def transform(self, sequences):
+        """Apply the dimensionality reduction to a collection of sequences.
+
+        Parameters
+        ----------
+        sequences: list of array-like, each of shape (n_samples_i, n_features)
+            Data, where n_samples_i in the number of samples
+            in sequence i and n_features is the number of features.
+
+        Returns
+        -------
+        sequence_new : list of array-like, each of shape (n_samples_i, n_components)
+        """
+        return [self.partial_transform(X) for X in sequences]
+
+    def fit_transform(self, sequences, y=None):
+        """Fit the model with a collection of sequences and apply the
+        dimensionality reduction to them.
+
+        Parameters
+        ----------
+        sequences: list of array-like, each of shape (n_samples_i, n_features)
+            Training data, where n_samples_i in the number of samples
+            in sequence i and n_features is the number of features.
+        y : None
+            Ignored
+
+        Returns
+        -------
+        sequence_new : list of array-like, each of shape (n_samples_i, n_components)
+        """
+        self.fit(sequences)
+        return self.transform(sequences)
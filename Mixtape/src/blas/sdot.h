@@ -31,3 +31,27 @@ float sdot_(const int N, const float* x, const float* y)
 
     return dot1 + dot2 + dot3 + dot4;
 }
+
+/**
+ * Double precision version of sdot_. Unlike the BLAS DDOT pointer, this
+ * can be inlined into the OpenMP loops that call it once per sample, and
+ * it never enters a (possibly threaded) BLAS from many threads at once.
+ */
+double ddot_c(const int N, const double* x, const double* y)
+{
+    int i;
+    double dot1 = 0, dot2 = 0, dot3 = 0, dot4 = 0;
+
+    for (i = 0; i < N-4; i += 4) {
+        dot1 += x[i] * y[i];
+        dot2 += x[i + 1] * y[i + 1];
+        dot3 += x[i + 2] * y[i + 2];
+        dot4 += x[i + 3] * y[i + 3];
+    }
+
+    for (; i < N; i++) {
+        dot1 += x[i] * y[i];
+    }
+
+    return dot1 + dot2 + dot3 + dot4;
+}
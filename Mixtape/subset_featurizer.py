@@ -1,6 +1,7 @@
 import itertools
 import numpy as np
 import mixtape.featurizer, mixtape.tica
+from mixtape.feature_cache import FeatureCache
 import mdtraj as md
 
 ATOM_NAMES = ["N", "CA", "CB", "C", "O", "H"]
@@ -111,6 +112,11 @@ class BaseSubsetFeaturizer(mixtape.featurizer.Featurizer):
         Reference Trajectory for checking consistency
     subset : np.ndarray, default=None, dtype=int
         The values in subset specify which of all possible features 
+    cache_dir : str, default=None
+        If not None, the full matrix of all `n_max` possible features is
+        computed once per trajectory and cached, memory-mapped, in this
+        directory. Changing `subset` then only selects different columns
+        of the cached matrix, rather than recomputing the geometry.
     
     Notes
     -----
@@ -120,10 +126,15 @@ class BaseSubsetFeaturizer(mixtape.featurizer.Featurizer):
     subset is then [0, 1, 3].  The allowed values of subset (e.g. `n_max`)
     will be determined by the subclass--e.g. for example, `n_max` might be
     the number of phi backbone angles.
+
+    Subclasses implement `_compute_features(traj, indices)`, which computes
+    the features with the given indices (out of `n_max`).
     """
 
-    def __init__(self, reference_traj, subset=None):
+    def __init__(self, reference_traj, subset=None, cache_dir=None):
         self.reference_traj = reference_traj
+        self.cache_dir = cache_dir
+        self._cache = None
         if subset is not None:
             self.subset = subset
         else:
@@ -133,6 +144,45 @@ class BaseSubsetFeaturizer(mixtape.featurizer.Featurizer):
     def n_features(self):
         return len(self.subset)
 
+    def partial_transform(self, traj):
+        if self.n_features == 0:
+            return np.zeros((traj.n_frames, 0))
+        if self.cache_dir is None:
+            return self._compute_features(traj, self.subset)
+        return np.asarray(self.full_transform(traj)[:, self.subset])
+
+    def full_transform(self, traj):
+        """Compute all `n_max` possible features of a trajectory.
+
+        If `cache_dir` is set, the result is cached on disk, keyed on the
+        coordinates of `traj` and on every parameter of this featurizer
+        except `subset`, and later calls return a memory-mapped array.
+
+        Parameters
+        ----------
+        traj : mdtraj.Trajectory
+            A molecular dynamics trajectory to featurize.
+
+        Returns
+        -------
+        features : np.ndarray, shape=(n_samples, n_max)
+        """
+        if self.cache_dir is None:
+            return self._compute_features(traj, np.arange(self.n_max))
+
+        if self._cache is None or self._cache.directory != self.cache_dir:
+            self._cache = FeatureCache(self.cache_dir)
+        params = self.get_params(deep=False)
+        params.pop('subset')
+        params.pop('cache_dir')
+        key = self._cache.trajectory_key((self.__class__.__name__, params), traj)
+
+        features = self._cache.get(key)
+        if features is None:
+            features = self._compute_features(traj, np.arange(self.n_max))
+            self._cache.put(key, features)
+        return features
+
 
 class SubsetAtomPairs(BaseSubsetFeaturizer):
     """Subset featurizer based on atom pair distances.
@@ -160,8 +210,8 @@ class SubsetAtomPairs(BaseSubsetFeaturizer):
     indices.
     
     """    
-    def __init__(self, possible_pair_indices, reference_traj, subset=None, periodic=False, exponent=1.0):
-        super(SubsetAtomPairs, self).__init__(reference_traj, subset=subset)
+    def __init__(self, possible_pair_indices, reference_traj, subset=None, periodic=False, exponent=1.0, cache_dir=None):
+        super(SubsetAtomPairs, self).__init__(reference_traj, subset=subset, cache_dir=cache_dir)
         self.possible_pair_indices = possible_pair_indices
         self.periodic = periodic
         self.exponent = exponent
@@ -175,12 +225,9 @@ class SubsetAtomPairs(BaseSubsetFeaturizer):
     def n_max(self):
         return len(self.possible_pair_indices)
 
-    def partial_transform(self, traj):
-        if self.n_features > 0:
-            features = md.geometry.compute_distances(traj, self.pair_indices, periodic=self.periodic) ** self.exponent
-        else:
-            features = np.zeros((traj.n_frames, 0))
-        return features
+    def _compute_features(self, traj, indices):
+        pair_indices = self.possible_pair_indices[indices]
+        return md.geometry.compute_distances(traj, pair_indices, periodic=self.periodic) ** self.exponent
 
     @property
     def pair_indices(self):
@@ -199,13 +246,9 @@ class SubsetTrigFeaturizer(BaseSubsetFeaturizer):
     
     """    
     
-    def partial_transform(self, traj):
-        if self.n_features > 0:
-            dih = md.geometry.dihedral.compute_dihedrals(traj, self.which_atom_ind[self.subset])
-            features = self.trig_function(dih)
-        else:
-            features = np.zeros((traj.n_frames, 0))
-        return features
+    def _compute_features(self, traj, indices):
+        dih = md.geometry.dihedral.compute_dihedrals(traj, self.which_atom_ind[indices])
+        return self.trig_function(dih)
 
     @property
     def n_max(self):
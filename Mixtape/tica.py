@@ -23,6 +23,7 @@
 from __future__ import print_function, division, absolute_import
 import numpy as np
 import scipy.linalg
+import scipy.sparse
 from sklearn.base import BaseEstimator, TransformerMixin
 from sklearn.utils import array2d
 
@@ -293,10 +294,16 @@ class tICA(BaseEstimator, TransformerMixin):
         sequences_new = []
 
         for X in sequences:
-            X = array2d(X)
-            if self.means_ is not None:
-                X = X - self.means_
-            X_transformed = np.dot(X, self.components_.T)
+            if scipy.sparse.issparse(X):
+                # project without densifying X: (X - means) V = XV - means V
+                X_transformed = np.asarray(X.dot(self.components_.T))
+                if self.means_ is not None:
+                    X_transformed -= np.dot(self.means_, self.components_.T)
+            else:
+                X = array2d(X)
+                if self.means_ is not None:
+                    X = X - self.means_
+                X_transformed = np.dot(X, self.components_.T)
 
             if self.weighted_transform:        
                 X_transformed *= self.timescales_
@@ -351,6 +358,8 @@ class tICA(BaseEstimator, TransformerMixin):
         return self.transform(sequences)
 
     def _fit(self, X):
+        if scipy.sparse.issparse(X):
+            return self._fit_sparse(X)
         X = np.asarray(array2d(X), dtype=np.float64)
         self._initialize(X.shape[1])
         if not len(X) > self.lag_time:
@@ -369,6 +378,33 @@ class tICA(BaseEstimator, TransformerMixin):
 
         self._is_dirty = True
 
+    def _fit_sparse(self, X):
+        # the same accumulation as _fit, for a scipy.sparse matrix of
+        # features (e.g. from SparseContactFeaturizer). Only the
+        # (n_features, n_features) accumulators are ever dense.
+        X = scipy.sparse.csr_matrix(X, dtype=np.float64)
+        self._initialize(X.shape[1])
+        if not X.shape[0] > self.lag_time:
+            raise ValueError('First dimension must be longer than '
+                'lag_time=%d. X has shape (%d, %d)' % ((self.lag_time,) + X.shape))
+
+        self.n_observations_ += X.shape[0]
+        self.n_sequences_ += 1
+
+        X_0 = X[:-self.lag_time]
+        X_tau = X[self.lag_time:]
+        colsum = lambda A: np.asarray(A.sum(axis=0)).ravel()
+        outer = lambda A, B: A.T.dot(B).toarray()
+
+        self._outer_0_to_T_lagged += outer(X_0, X_tau)
+        self._sum_0_to_TminusTau += colsum(X_0)
+        self._sum_tau_to_T += colsum(X_tau)
+        self._sum_0_to_T += colsum(X)
+        self._outer_0_to_TminusTau += outer(X_0, X_0)
+        self._outer_offset_to_T += outer(X_tau, X_tau)
+
+        self._is_dirty = True
+
     def score(self, sequences, y=None):
         """Score the model on new data using the generalized matrix Rayleigh quotient
 
@@ -33,6 +33,10 @@ from numpy.linalg import norm
 # Code
 #-----------------------------------------------------------------------------
 
+# frames requested from a file this far apart, on average, are read by
+# seeking to each one rather than by decoding every frame in between
+SEEK_SPACING = 10
+
 def verbosedump(value, fn, compress=1):
     """verbose wrapper around joblib.dump"""
     print('Saving "%s"... (%s)' % (fn, type(value)))
@@ -164,26 +168,259 @@ def map_drawn_samples(selected_pairs_by_state, trajectories, top=None):
     ghmm.GaussianFusionHMM.draw_centroids : Draw centroids from GHMM    
     """
 
-    frames_by_state = []
+    pairs = [np.asarray(p, dtype=int).reshape(-1, 2)
+             for p in selected_pairs_by_state]
+    bounds = np.cumsum([0] + [len(p) for p in pairs])
+    pairs = np.concatenate(pairs)
+    frames = extract_frames(trajectories, pairs[:, 0], pairs[:, 1], top=top)
+
+    return [frames[bounds[i]:bounds[i+1]] for i in range(len(bounds) - 1)]
+
+
+def extract_frames(trajectories, traj_indices, frame_indices, top=None,
+                   chunk=1000):
+    """Extract many frames from a set of trajectories.
+
+    The requests are grouped by trajectory, so that each trajectory file
+    is read only once, and the frames are copied into a single
+    preallocated array. Sparse requests are read by seeking to each frame,
+    when the file format supports it; dense ones by streaming the file
+    in chunks of `chunk` frames.
+
+    Parameters
+    ----------
+    trajectories : list(md.Trajectory) or list(np.ndarray) or list(filenames)
+        The trajectories to extract frames from.
+    traj_indices : array_like, dtype=int, shape=(n_frames,)
+        Index into `trajectories` of each requested frame.
+    frame_indices : array_like, dtype=int, shape=(n_frames,)
+        Index of each requested frame within its trajectory.
+    top : md.Topology, optional, default=None
+        Use this topology object to help mdtraj load filenames
+    chunk : int, default=1000
+        Number of frames read from a file at a time.
+
+    Returns
+    -------
+    frames : md.Trajectory or np.ndarray
+        The requested frames, in the order they were requested. If
+        trajectories are numpy arrays, this is a numpy array.
+    """
+    traj_indices = np.asarray(traj_indices, dtype=int)
+    frame_indices = np.asarray(frame_indices, dtype=int)
+    if traj_indices.shape != frame_indices.shape or traj_indices.ndim != 1:
+        raise ValueError('traj_indices and frame_indices must be 1D '
+                         'arrays of the same length')
+    groups = _group_by_trajectory(traj_indices)
+
+    if isinstance(trajectories[0], str):
+        # only the requested frames of each file are kept in memory
+        pieces = ((rows,) + _load_frames(trajectories[trj], frame_indices[rows],
+                                        top, chunk)
+                  for trj, rows in groups)
+        return _gather_frames(len(frame_indices), pieces)
+    elif hasattr(trajectories[0], 'xyz'):
+        pieces = ((rows, trajectories[trj], frame_indices[rows])
+                  for trj, rows in groups)
+        return _gather_frames(len(frame_indices), pieces)
+
+    first = np.asarray(trajectories[0])
+    out = np.empty((len(frame_indices),) + first.shape[1:], dtype=first.dtype)
+    for trj, rows in groups:
+        out[rows] = np.asarray(trajectories[trj])[frame_indices[rows]]
+    return out
+
+
+def _group_by_trajectory(traj_indices):
+    """Yield each trajectory index with the positions that request it"""
+    order = np.argsort(traj_indices, kind='mergesort')
+    trjs, starts = np.unique(traj_indices[order], return_index=True)
+    return zip(trjs, np.split(order, starts[1:]))
+
+
+def _gather_frames(n_frames, pieces):
+    """Copy frames into a preallocated trajectory.
+
+    `pieces` yields (rows, traj, frames) such that traj[frames] should be
+    placed at rows of the output.
+    """
+    import mdtraj as md
+    topology = None
+    for rows, traj, frames in pieces:
+        if topology is None:
+            topology = traj.topology
+            xyz = np.empty((n_frames, traj.n_atoms, 3), dtype=traj.xyz.dtype)
+            time = np.empty(n_frames)
+            lengths = angles = None
+            if traj.unitcell_vectors is not None:
+                lengths = np.empty((n_frames, 3))
+                angles = np.empty((n_frames, 3))
+        xyz[rows] = traj.xyz[frames]
+        time[rows] = traj.time[frames]
+        if lengths is not None:
+            lengths[rows] = traj.unitcell_lengths[frames]
+            angles[rows] = traj.unitcell_angles[frames]
+    return md.Trajectory(xyz, topology, time=time, unitcell_lengths=lengths,
+                         unitcell_angles=angles)
+
+
+def _load_frames(filename, frames, top, chunk):
+    """Read the distinct `frames` from a file.
+
+    When the requests are sparse, the file is read by seeking to each
+    requested frame. Otherwise (or when the format can't seek), the file is
+    streamed in chunks from the first requested frame, with the largest
+    stride that visits every requested frame, and reading stops after the
+    last one.
+
+    Returns
+    -------
+    traj : md.Trajectory
+        The distinct requested frames, in increasing order
+    positions : np.ndarray, dtype=int
+        Index into `traj` of each of `frames`
+    """
+    needed = np.unique(frames)
+    positions = np.searchsorted(needed, frames)
+    sparse = needed[-1] - needed[0] >= SEEK_SPACING * (len(needed) - 1)
+
+    f, kwargs = _open_seekable(filename, top)
+    if f is None:
+        # md.iterload applies `skip` after `stride` for formats that can't
+        # seek, and reads them whole anyway, so stream from the start
+        return _stream_frames(filename, needed, top, chunk, 0), positions
+    with f:
+        if needed[-1] >= len(f):
+            raise IndexError('frame %d requested from %s, which is too short'
+                             % (needed[-1], filename))
+        if sparse:
+            return _seek_frames(f, needed, kwargs), positions
+    return _stream_frames(filename, needed, top, chunk, needed[0]), positions
+
+
+def _open_seekable(filename, top):
+    """Open a trajectory file that supports random access.
+
+    Returns the open file and the keyword arguments for its read_as_traj,
+    or (None, None) if the format can't seek or its topology is unknown.
+    """
+    import mdtraj as md
+    try:
+        f = md.open(filename)
+    except (IOError, NotImplementedError):
+        return None, None
+    if hasattr(f, 'seek') and hasattr(f, 'read_as_traj'):
+        if hasattr(f, 'topology'):
+            # the file carries its own topology
+            return f, {}
+        if top is not None:
+            return f, {'topology': _as_topology(top)}
+    f.close()
+    return None, None
+
+
+def _seek_frames(f, needed, kwargs):
+    """Read the sorted frames `needed` from an open file by seeking to each"""
+    def read():
+        for i, frame in enumerate(needed):
+            f.seek(int(frame))
+            yield i, f.read_as_traj(n_frames=1, **kwargs), 0
+    return _gather_frames(len(needed), read())
+
+
+def _stream_frames(filename, needed, top, chunk, skip):
+    """Read the sorted frames `needed` from a file in a single pass,
+    starting at frame `skip`"""
+    import mdtraj as md
+    kwargs = {} if top is None else {'top': top}
+    skip = int(skip)
+    stride = max(_gcd(needed - skip), 1)
+    strided = (needed - skip) // stride
+
+    pieces = []
+    n_found = offset = 0
+    # never read a chunk past the last requested frame
+    chunk = min(chunk, int(strided[-1]) + 1)
+    for t in md.iterload(filename, chunk=chunk, stride=stride, skip=skip,
+                         **kwargs):
+        hi = np.searchsorted(strided, offset + t.n_frames)
+        if hi > n_found:
+            pieces.append(t[strided[n_found:hi] - offset])
+        n_found, offset = hi, offset + t.n_frames
+        if n_found == len(needed):
+            break
+    if n_found < len(needed):
+        raise IndexError('frame %d requested from %s, which is too short'
+                         % (needed[n_found], filename))
+
+    return pieces[0].join(pieces[1:]) if len(pieces) > 1 else pieces[0]
+
+
+def _gcd(values):
+    """Greatest common divisor of some non-negative integers (0 if they
+    are all 0)"""
+    result = 0
+    for value in values:
+        value = int(value)
+        while value:
+            result, value = value, result % value
+    return result
+
+
+def _as_topology(top):
+    """Get an md.Topology from a topology, trajectory or filename"""
+    import mdtraj as md
+    if isinstance(top, md.Topology):
+        return top
+    if isinstance(top, md.Trajectory):
+        return top.topology
+    return md.load_topology(top)
+
+
+def sample_frames_by_state(assignments, n_states, n_samples,
+                           random_state=None):
+    """Sample (trajectory, frame) pairs uniformly from the frames
+    assigned to each state.
+
+    Parameters
+    ----------
+    assignments : list of np.ndarray, dtype=int
+        The state of each frame of each trajectory.
+    n_states : int
+        Number of states
+    n_samples : int
+        Number of pairs to draw, with replacement, from each state
+    random_state : RandomState or an int seed, optional
+        A random number generator instance.
+
+    Returns
+    -------
+    selected_pairs_by_state : np.ndarray, dtype=int, shape=(n_states, n_samples, 2)
+        selected_pairs_by_state[state] gives an array of randomly selected
+        (trj, frame) pairs from the specified state.
+    """
+    random = check_random_state(random_state)
+    states = np.concatenate([np.asarray(a, dtype=int) for a in assignments])
+    lengths = [len(a) for a in assignments]
+    trjs = np.repeat(np.arange(len(assignments)), lengths)
+    frames = np.arange(len(states)) - np.repeat(
+        np.cumsum([0] + lengths[:-1]), lengths)
+
+    # Frames grouped by state, in (trj, frame) order within each state
+    order = np.argsort(states, kind='mergesort')
+    counts = np.bincount(states, minlength=n_states)[:n_states]
+    if np.any(counts == 0):
+        raise ValueError('No frames are assigned to state(s) %s' %
+                         np.where(counts == 0)[0])
+    starts = np.cumsum(counts) - counts
+
+    choice = (starts[:, np.newaxis]
+              + (random.random_sample((n_states, n_samples))
+                 * counts[:, np.newaxis]).astype(int))
+    selected = order[choice]
+    return np.concatenate([trjs[selected][..., np.newaxis],
+                           frames[selected][..., np.newaxis]], axis=2)
 
-    for state, pairs in enumerate(selected_pairs_by_state):
-        if isinstance(trajectories[0], str):
-            import mdtraj as md
-            if top:
-                process = lambda x, frame: md.load_frame(x, frame, top=top)
-            else:
-                process = lambda x, frame: md.load_frame(x, frame)
-        else:
-            process = lambda x, frame: x[frame]
-
-        frames = [process(trajectories[trj], frame) for trj, frame in pairs]
-        try:  # If frames are mdtraj Trajectories
-            state_trj = frames[0][0:0].join(frames)  # Get an empty trajectory with correct shape and call the join method on it to merge trajectories
-        except AttributeError:
-            state_trj = np.array(frames)  # Just a bunch of np arrays
-        frames_by_state.append(state_trj)
-    
-    return frames_by_state
 
 # TODO: FIX THIS!
 def compute_eigenspectra(self):
@@ -31,7 +31,7 @@ from sklearn.hmm import _BaseHMM
 import scipy.special
 from sklearn.utils.extmath import logsumexp
 from scipy.stats.distributions import vonmises
-from mixtape import _vmhmm, _reversibility
+from mixtape import _vmhmm, _cpu_vmhmm, _reversibility
 
 #-----------------------------------------------------------------------------
 # Globals
@@ -88,6 +88,11 @@ class VonMisesHMM(_BaseHMM):
         training.  Can contain any combination of 't' for transmat, 'm' for
         means, and 'k' for kappas, the concentration parameters. Defaults to
         all parameters.
+    platform : {'cpu', 'sklearn'}
+        Implementation of the E-step. 'cpu' runs the forward-backward
+        algorithm in compiled code, in parallel over the sequences with
+        OpenMP, and accumulates only the statistics needed by the M-step.
+        'sklearn' uses the pure python forward-backward from sklearn.hmm.
 
     Attributes
     ----------
@@ -115,16 +120,19 @@ class VonMisesHMM(_BaseHMM):
 
     def __init__(self, n_states=1, transmat=None, transmat_prior=None,
                  reversible_type='mle', random_state=None, n_iter=10,
-                 thresh=1e-2, params='tmk', init_params='tmk'):
+                 thresh=1e-2, params='tmk', init_params='tmk', platform='cpu'):
         _BaseHMM.__init__(self, n_states, startprob=None, transmat=transmat,
                           startprob_prior=None,
                           transmat_prior=transmat_prior, algorithm='viterbi',
                           random_state=random_state, n_iter=n_iter,
                           thresh=thresh, params=params,
                           init_params=init_params)
-        self._fitkappas = self._c_fitkappas
         self.reversible_type = reversible_type
         self.n_states = n_states
+        self.platform = platform
+        if platform not in ['cpu', 'sklearn']:
+            raise ValueError('Invalid platform "%s". Available platforms are '
+                             'cpu, sklearn.' % platform)
         if self.transmat_prior is None:
             self.transmat_prior = 1.0
 
@@ -212,8 +220,9 @@ class VonMisesHMM(_BaseHMM):
         s = super(VonMisesHMM, self) if PY2 else super()
         stats = s._initialize_sufficient_statistics()
 
-        stats['posteriors'] = []
-        stats['obs'] = []
+        stats['post'] = np.zeros(self.n_components)
+        stats['cos'] = np.zeros((self.n_components, self.n_features))
+        stats['sin'] = np.zeros((self.n_components, self.n_features))
         return stats
 
     def _accumulate_sufficient_statistics(self, stats, obs, framelogprob,
@@ -223,13 +232,13 @@ class VonMisesHMM(_BaseHMM):
         s._accumulate_sufficient_statistics(
             stats, obs, framelogprob, posteriors, fwdlattice, bwdlattice,
             params)
-        # Unfortunately, I'm not quite sure how to accumulate sufficient
-        # statistics here, because we need to know the mean shifted cosine of
-        # the data, which requires knowing the mean. You could do two passes,
-        # but that is MUCH more work, since you have to redo the
-        # forwardbackward, so we'll just accumulate the data.
-        stats['posteriors'].append(posteriors)
-        stats['obs'].append(obs)
+        # The M-step needs the posterior weighted mean of cos(x - mu), with
+        # the new mu. Since cos(x - mu) = cos(x)cos(mu) + sin(x)sin(mu), the
+        # weighted sums of cos(x) and sin(x) are sufficient, and they also
+        # give the new mu.
+        stats['post'] += posteriors.sum(axis=0)
+        stats['cos'] += np.dot(posteriors.T, np.cos(obs))
+        stats['sin'] += np.dot(posteriors.T, np.sin(obs))
 
     def _py_fitkappas(self, posteriors, obs, means):
         inv_kappas = np.zeros_like(self._kappas_)
@@ -243,19 +252,26 @@ class VonMisesHMM(_BaseHMM):
     def _c_fitkappas(self, posteriors, obs, means):
         _vmhmm._fitkappa(posteriors, obs, means, self._kappas_)
 
-    def _fitmeans(self, posteriors, obs, out):
-        # this is no possible to speed up in C. the rate limiting step
-        # are the matrix multiplys, which are already in MKL with fast
-        # numpy. I tried it in C, and I'm 2x as slow for large matrix
-        # sizes.
-        np.arctan2(np.dot(posteriors.T, np.sin(obs)),
-                   np.dot(posteriors.T, np.cos(obs)),
-                   out=out)
+    def _do_estep(self):
+        """Run the E-step over all of the sequences with the compiled
+        implementation
 
-    def _do_mstep(self, stats, params):
-        posteriors = np.vstack(stats['posteriors'])
-        obs = np.vstack(stats['obs'])
+        Returns
+        -------
+        logprob : float
+            Log-likelihood of the sequences
+        stats : dict
+            Expected transition counts ('trans'), total posterior weight of
+            each state ('post'), and the posterior weighted sum of the
+            cosine ('cos') and sine ('sin') of the data in each state.
+        """
+        self._impl.means_ = self._means_.astype(np.float32)
+        self._impl.kappas_ = self._kappas_.astype(np.float32)
+        self._impl.transmat_ = self.transmat_.astype(np.float32)
+        self._impl.startprob_ = self.startprob_.astype(np.float32)
+        return self._impl.do_estep()
 
+    def _do_mstep(self, stats, params):
         if 't' in params:
             if self.reversible_type == 'mle':
                 counts = np.maximum(
@@ -273,10 +289,16 @@ class VonMisesHMM(_BaseHMM):
                                  % self.reversible_type)
             self.startprob_ = self.populations_
 
+        # The mean is the direction of the posterior weighted resultant
+        # vector, and the mean of cos(x - mu) is expanded as
+        # cos(x)cos(mu) + sin(x)sin(mu), so neither needs the data.
         if 'm' in params:
-            self._fitmeans(posteriors, obs, out=self._means_)
+            np.arctan2(stats['sin'], stats['cos'], out=self._means_)
         if 'k' in params:
-            self._fitkappas(posteriors, obs, self._means_)
+            inv_kappas = (np.cos(self._means_) * stats['cos'] +
+                          np.sin(self._means_) * stats['sin'])
+            inv_kappas /= stats['post'][:, np.newaxis]
+            self._kappas_ = inverse_mbessel_ratio(inv_kappas)
 
     def fit(self, obs):
         """Estimate model parameters.
@@ -302,22 +324,29 @@ class VonMisesHMM(_BaseHMM):
         parameter.
         """
         self._init(obs, self.init_params)
+        if self.platform == 'cpu':
+            self._impl = _cpu_vmhmm.VonMisesHMMCPUImpl(
+                self.n_states, self.n_features)
+            self._impl._sequences = obs
 
         logprob = []
         for i in range(self.n_iter):
             # Expectation step
-            stats = self._initialize_sufficient_statistics()
-            curr_logprob = 0
-            for seq in obs:
-                framelogprob = self._compute_log_likelihood(seq)
-                lpr, fwdlattice = self._do_forward_pass(framelogprob)
-                bwdlattice = self._do_backward_pass(framelogprob)
-                gamma = fwdlattice + bwdlattice
-                posteriors = np.exp(gamma.T - logsumexp(gamma, axis=1)).T
-                curr_logprob += lpr
-                self._accumulate_sufficient_statistics(
-                    stats, seq, framelogprob, posteriors, fwdlattice,
-                    bwdlattice, self.params)
+            if self.platform == 'cpu':
+                curr_logprob, stats = self._do_estep()
+            else:
+                stats = self._initialize_sufficient_statistics()
+                curr_logprob = 0
+                for seq in obs:
+                    framelogprob = self._compute_log_likelihood(seq)
+                    lpr, fwdlattice = self._do_forward_pass(framelogprob)
+                    bwdlattice = self._do_backward_pass(framelogprob)
+                    gamma = fwdlattice + bwdlattice
+                    posteriors = np.exp(gamma.T - logsumexp(gamma, axis=1)).T
+                    curr_logprob += lpr
+                    self._accumulate_sufficient_statistics(
+                        stats, seq, framelogprob, posteriors, fwdlattice,
+                        bwdlattice, self.params)
             logprob.append(curr_logprob)
 
             # Check for convergence.
@@ -417,48 +446,12 @@ class inverse_mbessel_ratio(object):
     y = A(x) = I_1(x) / I_0(x)
 
     This function computes A^(-1)(y) by way of a precomputed spline
-    interpolation
+    interpolation. The spline tables are generated by setup.py at build
+    time and evaluated in C, with typical errors around 1e-9.
     """
 
-    def __init__(self, n_points=512):
-        self._n_points = n_points
-        self._is_fit = False
-        self._min_x = 1e-5
-        self._max_x = 700
-
-    def _fit(self):
-        """We want to do the fitting once, but not at import time since it
-        slows down the loading of the interpreter"""
-        # Fitting takes about 0.5s on a laptop, and wth 512 points and cubic
-        # interpolation, gives typical errors around 1e-9
-        x = np.logspace(np.log10(self._min_x), np.log10(self._max_x),
-                        self._n_points)
-        y = self.bessel_ratio(x)
-        self._min = np.min(y)
-        self._max = np.max(y)
-
-        # Spline fit the log of the inverse function
-        from scipy.interpolate import interp1d
-        self._spline = interp1d(y, np.log(x), kind='cubic')
-        self._is_fit = True
-
     def __call__(self, y):
-        if not self._is_fit:
-            self._fit()
-
-        y = np.asarray(y)
-        y = np.clip(y, a_min=self._min, a_max=self._max)
-
-        if np.any(np.logical_or(0 > y, y > 1)):
-            raise ValueError('Domain error. y must be in (0, 1)')
-        x = np.exp(self._spline(y))
-
-        # DEBUGGING CODE
-        # for debugging, the line below prints the error in the inverse
-        # by printing y - A(A^(-1)(y
-        # print('spline inverse error', y - self.bessel_ratio(x))
-
-        return x
+        return _vmhmm._inv_mbessel_ratio(y)
 
     @staticmethod
     def bessel_ratio(x):
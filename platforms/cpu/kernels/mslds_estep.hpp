@@ -32,6 +32,98 @@ void _update_state_matrices(int k, int n, float* A, const float* alpha, const fl
     }
 }
 
+/**
+ * Assemble the per-state auxiliary matrices of the MSLDS M-step from the
+ * sufficient statistics reduced over all of the trajectories, for the
+ * current A, b and covariance of each state. With x_t the observations and
+ * g_t the posterior of the state, these are
+ *
+ *   B = sum_{t>0} g_t x_t x_{t-1}.T
+ *   C = b (sum_{t<T-1} g_t x_t).T
+ *   D = covariance
+ *   E = sum_{t<T-1} g_t x_t x_t.T
+ *   F = sum_{t>0} g_t x_t x_t.T - B A.T - A B.T + A E A.T
+ *       - (sum_{t>0} g_t x_t) b.T - b (sum_{t>0} g_t x_t).T
+ *       + (A sum_{t<T-1} g_t x_t) b.T + b (A sum_{t<T-1} g_t x_t).T
+ *       + (sum_{t>0} g_t) b b.T
+ *
+ * matching compute_aux_matrices in mslds_solver.py. They are accumulated in
+ * double precision.
+ */
+void compute_aux_matrices(const float* __restrict__ As,
+                          const float* __restrict__ bs,
+                          const float* __restrict__ covariances,
+                          const float* __restrict__ obs_but_first,
+                          const float* __restrict__ obs_but_last,
+                          const float* __restrict__ obs_obs_T_offset,
+                          const float* __restrict__ obs_obs_T_but_first,
+                          const float* __restrict__ obs_obs_T_but_last,
+                          const float* __restrict__ post_but_first,
+                          const int n_states,
+                          const int n_features,
+                          double* __restrict__ Bs,
+                          double* __restrict__ Cs,
+                          double* __restrict__ Ds,
+                          double* __restrict__ Es,
+                          double* __restrict__ Fs)
+{
+    int k, m, n, p, q;
+    const int ff = n_features*n_features;
+    const float *A, *b, *B, *E, *S, *obf, *obl;
+    double *F;
+    double *Aobl = (double*) malloc(n_features*sizeof(double));
+    double *AE = (double*) malloc(ff*sizeof(double));
+    double val;
+    if (Aobl == NULL || AE == NULL) {
+        fprintf(stderr, "Memory allocation failure in %s at %d\n", __FILE__, __LINE__); exit(EXIT_FAILURE);
+    }
+
+    for (k = 0; k < n_states; k++) {
+        A = &As[k*ff];
+        b = &bs[k*n_features];
+        B = &obs_obs_T_offset[k*ff];
+        E = &obs_obs_T_but_last[k*ff];
+        S = &obs_obs_T_but_first[k*ff];
+        obf = &obs_but_first[k*n_features];
+        obl = &obs_but_last[k*n_features];
+        F = &Fs[k*ff];
+
+        for (m = 0; m < n_features; m++) {
+            Aobl[m] = 0;
+            for (p = 0; p < n_features; p++)
+                Aobl[m] += (double) A[m*n_features + p] * obl[p];
+            for (q = 0; q < n_features; q++) {
+                val = 0;
+                for (p = 0; p < n_features; p++)
+                    val += (double) A[m*n_features + p] * E[p*n_features + q];
+                AE[m*n_features + q] = val;
+            }
+        }
+
+        for (m = 0; m < n_features; m++) {
+            for (n = 0; n < n_features; n++) {
+                Bs[k*ff + m*n_features + n] = B[m*n_features + n];
+                Cs[k*ff + m*n_features + n] = (double) b[m] * obl[n];
+                Ds[k*ff + m*n_features + n] = covariances[k*ff + m*n_features + n];
+                Es[k*ff + m*n_features + n] = E[m*n_features + n];
+
+                val = S[m*n_features + n];
+                for (p = 0; p < n_features; p++) {
+                    val -= (double) B[m*n_features + p] * A[n*n_features + p];
+                    val -= (double) A[m*n_features + p] * B[n*n_features + p];
+                    val += AE[m*n_features + p] * A[n*n_features + p];
+                }
+                val += - (double) obf[m] * b[n] - (double) b[m] * obf[n]
+                       + Aobl[m] * b[n] + (double) b[m] * Aobl[n]
+                       + (double) post_but_first[k] * b[m] * b[n];
+                F[m*n_features + n] = val;
+            }
+        }
+    }
+    free(Aobl);
+    free(AE);
+}
+
 /**
  * Run the Metastable Switching Linear Dynamical System E-step, computing
  * sufficient statistics over all of the trajectories
@@ -39,6 +131,12 @@ void _update_state_matrices(int k, int n, float* A, const float* alpha, const fl
  * The template parameter controls the precision of the foward and backward
  * lattices which are subject to accumulated floating point error during long
  * trajectories.
+ *
+ * If compute_aux is true, the auxiliary matrices of the M-step (see
+ * compute_aux_matrices) are also assembled from the reduced statistics,
+ * into Bs, Cs, Ds, Es and Fs, so that the E-step is a single call with no
+ * per-state work left to the caller. This works in both the HMM hot-start
+ * and the MSLDS likelihood modes.
  */
 template<typename REAL>
 void do_mslds_estep(const float* __restrict__ log_transmat,
@@ -55,6 +153,7 @@ void do_mslds_estep(const float* __restrict__ log_transmat,
               const int n_features,
               const int n_states,
               const bool hmm_hotstart,
+              const bool compute_aux,
               float* __restrict__ transcounts,
               float* __restrict__ obs,
               float* __restrict__ obs_but_first,
@@ -66,7 +165,12 @@ void do_mslds_estep(const float* __restrict__ log_transmat,
               float* __restrict__ post,
               float* __restrict__ post_but_first,
               float* __restrict__ post_but_last,
-              float* __restrict__ logprob)
+              float* __restrict__ logprob,
+              double* __restrict__ Bs,
+              double* __restrict__ Cs,
+              double* __restrict__ Ds,
+              double* __restrict__ Es,
+              double* __restrict__ Fs)
 {
     int i, j, k, m, n, length, length_minus_1;
     float tlocallogprob;
@@ -82,14 +186,7 @@ void do_mslds_estep(const float* __restrict__ log_transmat,
     REAL *fwdlattice, *bwdlattice;
 
     #ifdef _OPENMP
-    #pragma omp parallel for default(none)                      \
-        shared(log_transmat, log_transmat_T, log_startprob,     \
-               As, bs, Qs, means, covariances, sequences,       \
-               sequence_lengths, transcounts, obs,              \
-               obs_but_first, obs_but_last,                     \
-               obs_obs_T,obs_obs_T_offset,obs_obs_T_but_first,  \
-               obs_obs_T_but_last, post, post_but_first,        \
-               post_but_last, logprob, stderr)                  \
+    #pragma omp parallel for                                    \
         private(sequence, framelogprob, fwdlattice, bwdlattice, \
                 posteriors, seq_transcounts, seq_obs,           \
                 seq_obs_but_first, seq_obs_but_last,            \
@@ -261,6 +358,10 @@ void do_mslds_estep(const float* __restrict__ log_transmat,
         free(frame_obs_obs_T);
     }
 
+    if (compute_aux)
+        compute_aux_matrices(As, bs, covariances, obs_but_first, obs_but_last,
+                obs_obs_T_offset, obs_obs_T_but_first, obs_obs_T_but_last,
+                post_but_first, n_states, n_features, Bs, Cs, Ds, Es, Fs);
 }
 
 } // namespace
@@ -0,0 +1,179 @@
+/*****************************************************************/
+/*    Copyright (c) 2014, Stanford University and the Authors    */
+/*    Contributors:                                              */
+/*                                                               */
+/*****************************************************************/
+#ifndef MIXTAPE_CPU_VMHMM_ESTEP
+#define MIXTAPE_CPU_VMHMM_ESTEP
+
+#include "stdlib.h"
+#include "stdio.h"
+#ifdef _OPENMP
+#include "omp.h"
+#endif
+#include "math.h"
+
+#include "forward.hpp"
+#include "backward.hpp"
+#include "posteriors.hpp"
+#include "transitioncounts.hpp"
+#include "cblas.h"
+
+namespace Mixtape {
+
+/**
+ * Log likelihood of each observation in each state under a product of
+ * von Mises distributions.
+ *
+ * Using cos(x - mu) = cos(x)cos(mu) + sin(x)sin(mu), the likelihood is
+ * two matrix products of the cos and sin of the data with kappa*cos(mu)
+ * and kappa*sin(mu), minus the per-state log normalization constant,
+ * sum_j log(2 pi I_0(kappa_j)).
+ */
+void vonmises_loglikelihood(float* __restrict__ cos_sequence,
+                            float* __restrict__ sin_sequence,
+                            const float* __restrict__ kappa_cos_means,
+                            const float* __restrict__ kappa_sin_means,
+                            const float* __restrict__ log_normalizers,
+                            const int n_observations,
+                            const int n_states,
+                            const int n_features,
+                            float* __restrict__ loglikelihoods)
+{
+    int t, i;
+    const float alpha = 1.0;
+    const float zero = 0.0;
+    const float one = 1.0;
+
+    sgemm_("T", "N", &n_states, &n_observations, &n_features, &alpha, kappa_cos_means, &n_features,
+           cos_sequence, &n_features, &zero, loglikelihoods, &n_states);
+    sgemm_("T", "N", &n_states, &n_observations, &n_features, &alpha, kappa_sin_means, &n_features,
+           sin_sequence, &n_features, &one, loglikelihoods, &n_states);
+    for (t = 0; t < n_observations; t++)
+        for (i = 0; i < n_states; i++)
+            loglikelihoods[t*n_states + i] -= log_normalizers[i];
+}
+
+
+/**
+ * Run the VMHMM E-step, computing sufficient statistics over all of the trajectories
+ *
+ * Only the reduced statistics needed by the M-step are returned: the expected
+ * transition counts, the total posterior weight of each state, and the
+ * posterior-weighted sums of the cosine and sine of the data in each state.
+ *
+ * The template parameter controls the precision of the foward and backward lattices
+ * which are subject to accumulated floating point error during long trajectories.
+ */
+template<typename REAL>
+void do_vmhmm_estep(const float* __restrict__ log_transmat,
+                    const float* __restrict__ log_transmat_T,
+                    const float* __restrict__ log_startprob,
+                    const float* __restrict__ kappa_cos_means,
+                    const float* __restrict__ kappa_sin_means,
+                    const float* __restrict__ log_normalizers,
+                    const float** __restrict__ sequences,
+                    const int n_sequences,
+                    const int* __restrict__ sequence_lengths,
+                    const int n_features,
+                    const int n_states,
+                    float* __restrict__ transcounts,
+                    float* __restrict__ obs_cos,
+                    float* __restrict__ obs_sin,
+                    float* __restrict__ post,
+                    float* logprob)
+{
+    int i, j, k;
+    float tlocallogprob;
+    const float alpha = 1.0;
+    const float beta = 1.0;
+    const float *sequence;
+    float *cos_sequence, *sin_sequence;
+    float *framelogprob, *posteriors, *seq_transcounts, *seq_obs_cos, *seq_obs_sin, *seq_post;
+    REAL *fwdlattice, *bwdlattice;
+
+    #ifdef _OPENMP
+    #pragma omp parallel for schedule(dynamic) \
+        private(sequence, cos_sequence, sin_sequence, framelogprob, fwdlattice, \
+                bwdlattice, posteriors, seq_transcounts, seq_obs_cos, \
+                seq_obs_sin, seq_post, tlocallogprob, j, k)
+    #endif
+    for (i = 0; i < n_sequences; i++) {
+        sequence = sequences[i];
+        cos_sequence = (float*) malloc(sequence_lengths[i]*n_features*sizeof(float));
+        sin_sequence = (float*) malloc(sequence_lengths[i]*n_features*sizeof(float));
+        framelogprob = (float*) malloc(sequence_lengths[i]*n_states*sizeof(float));
+        fwdlattice = (REAL*) malloc(sequence_lengths[i]*n_states*sizeof(REAL));
+        bwdlattice = (REAL*) malloc(sequence_lengths[i]*n_states*sizeof(REAL));
+        posteriors = (float*) malloc(sequence_lengths[i]*n_states*sizeof(float));
+        seq_transcounts = (float*) calloc(n_states*n_states, sizeof(float));
+        seq_obs_cos = (float*) calloc(n_states*n_features, sizeof(float));
+        seq_obs_sin = (float*) calloc(n_states*n_features, sizeof(float));
+        seq_post = (float*) calloc(n_states, sizeof(float));
+        if (cos_sequence == NULL || sin_sequence == NULL || framelogprob == NULL || fwdlattice == NULL
+            || bwdlattice == NULL || posteriors == NULL || seq_transcounts == NULL || seq_obs_cos == NULL
+            || seq_obs_sin == NULL || seq_post == NULL) {
+            fprintf(stderr, "Memory allocation failure in %s at %d\n", __FILE__, __LINE__); exit(EXIT_FAILURE);
+        }
+
+        for (j = 0; j < sequence_lengths[i]*n_features; j++) {
+            cos_sequence[j] = cos(sequence[j]);
+            sin_sequence[j] = sin(sequence[j]);
+        }
+
+        // Do work for this sequence
+        vonmises_loglikelihood(cos_sequence, sin_sequence, kappa_cos_means, kappa_sin_means,
+                               log_normalizers, sequence_lengths[i], n_states, n_features,
+                               framelogprob);
+
+        forward(log_transmat_T, log_startprob, framelogprob, sequence_lengths[i], n_states, fwdlattice);
+        backward(log_transmat, log_startprob, framelogprob, sequence_lengths[i], n_states, bwdlattice);
+        compute_posteriors(fwdlattice, bwdlattice, sequence_lengths[i], n_states, posteriors);
+
+        // Compute sufficient statistics for this sequence
+        tlocallogprob = 0;
+        transitioncounts(fwdlattice, bwdlattice, log_transmat, framelogprob, sequence_lengths[i], n_states, seq_transcounts, &tlocallogprob);
+        sgemm_("N", "T", &n_features, &n_states, &sequence_lengths[i], &alpha, cos_sequence, &n_features, posteriors, &n_states, &beta, seq_obs_cos, &n_features);
+        sgemm_("N", "T", &n_features, &n_states, &sequence_lengths[i], &alpha, sin_sequence, &n_features, posteriors, &n_states, &beta, seq_obs_sin, &n_features);
+        for (k = 0; k < n_states; k++)
+            for (j = 0; j < sequence_lengths[i]; j++)
+                seq_post[k] += posteriors[j*n_states + k];
+
+        // Update the sufficient statistics. This needs to be threadsafe.
+        #ifdef _OPENMP
+        #pragma omp critical
+        {
+        #endif
+        *logprob += tlocallogprob;
+        for (j = 0; j < n_states; j++) {
+            post[j] += seq_post[j];
+            for (k = 0; k < n_features; k++) {
+                obs_cos[j*n_features+k] += seq_obs_cos[j*n_features+k];
+                obs_sin[j*n_features+k] += seq_obs_sin[j*n_features+k];
+            }
+            for (k = 0; k < n_states; k++) {
+                transcounts[j*n_states+k] += seq_transcounts[j*n_states+k];
+            }
+        }
+        #ifdef _OPENMP
+        }
+        #endif
+
+        // Free iteration-local memory
+        free(cos_sequence);
+        free(sin_sequence);
+        free(framelogprob);
+        free(fwdlattice);
+        free(bwdlattice);
+        free(posteriors);
+        free(seq_transcounts);
+        free(seq_obs_cos);
+        free(seq_obs_sin);
+        free(seq_post);
+    }
+}
+
+
+} // namespace
+
+#endif
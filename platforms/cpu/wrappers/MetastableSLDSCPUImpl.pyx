@@ -3,6 +3,7 @@ from sklearn.hmm import GaussianHMM
 
 
 from libcpp cimport bool
+cimport cython
 cimport numpy as np
 from libc.stdlib cimport malloc, free
 
@@ -14,11 +15,13 @@ cdef extern from "mslds_estep.hpp" namespace "Mixtape":
         const float* covariances, const float** sequences,
         const int n_sequences, const int* sequence_lengths,
         const int n_features, const int n_states, const bool hmm_hotstart,
+        const bool compute_aux,
         float* transcounts, float* obs, float* obs_but_first,
         float* obs_but_last, float* obs_obs_t, float* obs_obs_T_offset,
         float* obs_obs_T_but_first, float* obs_obs_T_but_last,
         float* post, float* post_but_first, float* post_but_last,
-        float* logprob) nogil
+        float* logprob, double* Bs, double* Cs, double* Ds, double* Es,
+        double* Fs) nogil
 
 
     void do_estep_mixed "Mixtape::do_mslds_estep<double>"(
@@ -28,11 +31,13 @@ cdef extern from "mslds_estep.hpp" namespace "Mixtape":
         const float* covariances, const float** sequences,
         const int n_sequences, const int* sequence_lengths,
         const int n_features, const int n_states, const bool hmm_hotstart,
+        const bool compute_aux,
         float* transcounts, float* obs, float* obs_but_first,
         float* obs_but_last, float* obs_obs_t, float* obs_obs_T_offset,
         float* obs_obs_T_but_first, float* obs_obs_T_but_last,
         float* post, float* post_but_first, float* post_but_last,
-        float* logprob) nogil
+        float* logprob, double* Bs, double* Cs, double* Ds, double* Es,
+        double* Fs) nogil
 
 
 cdef class MetastableSLDSCPUImpl:
@@ -173,13 +178,34 @@ cdef class MetastableSLDSCPUImpl:
                                 (self.n_states, s.shape[0]))
             self.log_startprob = np.log(s)
 
-    def do_mslds_estep(self):
-        return self.do_estep(hmm_hotstart=False)
+    def do_mslds_estep(self, compute_aux=True):
+        return self.do_estep(hmm_hotstart=False, compute_aux=compute_aux)
 
-    def do_hmm_estep(self):
-        return self.do_estep(hmm_hotstart=True)
+    def do_hmm_estep(self, compute_aux=False):
+        return self.do_estep(hmm_hotstart=True, compute_aux=compute_aux)
     
-    def do_estep(self, hmm_hotstart=False):
+    def do_estep(self, hmm_hotstart=False, compute_aux=True):
+        """Run the E-step in a single pass over the data.
+
+        Parameters
+        ----------
+        hmm_hotstart : bool
+            Score the frames with the gaussian HMM emission model, given by
+            means_ and covars_, rather than with the switching linear
+            dynamics, given by As_, bs_ and Qs_.
+        compute_aux : bool
+            Also assemble the auxiliary matrices of the A, Q and b M-step
+            for the current As_, bs_ and covars_. They are returned in the
+            statistics as 'B', 'C', 'D', 'E' and 'F', each of shape
+            (n_states, n_features, n_features).
+
+        Returns
+        -------
+        logprob : float
+            Log probability of the sequences
+        stats : dict
+            The sufficient statistics
+        """
         cdef np.ndarray[ndim=2, mode='c', 
                 dtype=np.float32_t] log_transmat = self.log_transmat
         cdef np.ndarray[ndim=2, mode='c', 
@@ -232,7 +258,20 @@ cdef class MetastableSLDSCPUImpl:
                 post_but_first = np.zeros(self.n_states, dtype=np.float32)
         cdef np.ndarray[ndim=1, mode='c', dtype=np.float32_t] \
                 post_but_last = np.zeros(self.n_states, dtype=np.float32)
-        cdef float logprob
+        cdef float logprob = 0
+
+        # The auxiliary matrices of the M-step
+        aux_shape = (self.n_states, self.n_features, self.n_features)
+        cdef np.ndarray[ndim=3, mode='c', dtype=np.float64_t] \
+                Bs = np.zeros(aux_shape, dtype=np.float64)
+        cdef np.ndarray[ndim=3, mode='c', dtype=np.float64_t] \
+                Cs = np.zeros(aux_shape, dtype=np.float64)
+        cdef np.ndarray[ndim=3, mode='c', dtype=np.float64_t] \
+                Ds = np.zeros(aux_shape, dtype=np.float64)
+        cdef np.ndarray[ndim=3, mode='c', dtype=np.float64_t] \
+                Es = np.zeros(aux_shape, dtype=np.float64)
+        cdef np.ndarray[ndim=3, mode='c', dtype=np.float64_t] \
+                Fs = np.zeros(aux_shape, dtype=np.float64)
 
         seq_pointers = <float**> malloc(self.n_sequences * sizeof(float*))
         cdef np.ndarray[ndim=2, mode='c', dtype=np.float32_t] sequence
@@ -250,7 +289,7 @@ cdef class MetastableSLDSCPUImpl:
                 <float*> &covariances[0,0,0],
                 <const float**> seq_pointers,
                 self.n_sequences, <int*> &seq_lengths[0], self.n_features,
-                self.n_states, hmm_hotstart,
+                self.n_states, hmm_hotstart, compute_aux,
                 <float*> &transcounts[0,0], <float*>
                 &obs[0,0], <float*> &obs_but_first[0,0],
                 <float*> &obs_but_last[0,0], <float*> &obs_obs_T[0,0,0],
@@ -258,7 +297,8 @@ cdef class MetastableSLDSCPUImpl:
                 <float*> &obs_obs_T_but_first[0,0,0],
                 <float*> &obs_obs_T_but_last[0,0,0], <float*> &post[0],
                 <float*> &post_but_first[0], <float*> &post_but_last[0],
-                &logprob)
+                &logprob, &Bs[0,0,0], &Cs[0,0,0], &Ds[0,0,0], &Es[0,0,0],
+                &Fs[0,0,0])
         elif self.precision == 'mixed':
             do_estep_mixed(
                 <float*> &log_transmat[0,0], 
@@ -268,7 +308,7 @@ cdef class MetastableSLDSCPUImpl:
                 <float*> &covariances[0,0,0], 
                 <const float**> seq_pointers, 
                 self.n_sequences, <int*> &seq_lengths[0], 
-                self.n_features, self.n_states, hmm_hotstart,
+                self.n_features, self.n_states, hmm_hotstart, compute_aux,
                 <float*> &transcounts[0,0], <float*> &obs[0,0],
                 <float*> &obs_but_first[0,0], <float*> &obs_but_last[0,0],
                 <float*> &obs_obs_T[0,0,0], 
@@ -276,7 +316,8 @@ cdef class MetastableSLDSCPUImpl:
                 <float*> &obs_obs_T_but_first[0,0,0],
                 <float*> &obs_obs_T_but_last[0,0,0], <float*> &post[0],
                 <float*> &post_but_first[0], <float*> &post_but_last[0],
-                &logprob)
+                &logprob, &Bs[0,0,0], &Cs[0,0,0], &Ds[0,0,0], &Es[0,0,0],
+                &Fs[0,0,0])
         else:
             raise RuntimeError('Invalid precision')
 
@@ -294,8 +335,55 @@ cdef class MetastableSLDSCPUImpl:
             'post[1:]': post_but_first,
             'post[:-1]': post_but_last,
         }
+        if compute_aux:
+            result.update({'B': Bs, 'C': Cs, 'D': Ds, 'E': Es, 'F': Fs})
         return logprob, result
 
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def _sample_linear_dynamics(
+        np.ndarray[ndim=3, dtype=np.float64_t, mode='c'] As not None,
+        np.ndarray[ndim=2, dtype=np.intp_t, mode='c'] states not None,
+        np.ndarray[ndim=3, dtype=np.float64_t, mode='c'] obs not None):
+    """Run the linear dynamics of many trajectories, in place.
+
+    On entry, obs[:, 0] holds the initial observations and obs[:, t+1] the
+    offset plus noise of step t, b[s_t] + eps_t. On exit,
+
+        obs[:, t+1] = A[s_t] obs[:, t] + b[s_t] + eps_t
+
+    Parameters
+    ----------
+    As : np.ndarray, shape=(n_states, n_features, n_features)
+    states : np.ndarray, shape=(n_trajectories, n_samples)
+        The hidden state paths
+    obs : np.ndarray, shape=(n_trajectories, n_samples, n_features)
+    """
+    cdef Py_ssize_t n_trajectories = obs.shape[0]
+    cdef Py_ssize_t n_samples = obs.shape[1]
+    cdef Py_ssize_t n_features = obs.shape[2]
+    cdef Py_ssize_t n_states = As.shape[0]
+    cdef Py_ssize_t n, t, i, j, s
+    cdef double val
+    if (As.shape[1] != n_features or As.shape[2] != n_features
+            or states.shape[0] != n_trajectories
+            or states.shape[1] != n_samples):
+        raise ValueError('Shapes of As, states and obs do not match')
+    if n_trajectories*n_samples > 0 and (np.min(states) < 0
+            or np.max(states) >= n_states):
+        raise ValueError('states must be in [0, %d)' % n_states)
+
+    with nogil:
+        for n in range(n_trajectories):
+            for t in range(n_samples - 1):
+                s = states[n, t]
+                for i in range(n_features):
+                    val = 0
+                    for j in range(n_features):
+                        val += As[s, i, j] * obs[n, t, j]
+                    obs[n, t+1, i] += val
+
+
 ###############################################################################
 # Tests. These are exposed to nose by being called from one of the python
 # test files
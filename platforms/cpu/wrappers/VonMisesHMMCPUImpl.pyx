@@ -0,0 +1,164 @@
+#################################################################
+#    Copyright (c) 2014, Stanford University and the Authors    #
+#    Contributors:                                              #
+#                                                               #
+#################################################################
+
+import numpy as np
+cimport numpy as np
+from libc.stdlib cimport malloc, free
+from scipy.special import i0e
+
+
+cdef extern from "vmhmm_estep.hpp" namespace "Mixtape":
+    void do_estep_single "Mixtape::do_vmhmm_estep<float>"(
+        const float* log_transmat, const float* log_transmat_T,
+        const float* log_startprob, const float* kappa_cos_means,
+        const float* kappa_sin_means, const float* log_normalizers,
+        const float** sequences, const int n_sequences,
+        const int* sequence_lengths, const int n_features,
+        const int n_states, float* transcounts, float* obs_cos,
+        float* obs_sin, float* post, float* logprob) nogil
+    void do_estep_mixed "Mixtape::do_vmhmm_estep<double>"(
+        const float* log_transmat, const float* log_transmat_T,
+        const float* log_startprob, const float* kappa_cos_means,
+        const float* kappa_sin_means, const float* log_normalizers,
+        const float** sequences, const int n_sequences,
+        const int* sequence_lengths, const int n_features,
+        const int n_states, float* transcounts, float* obs_cos,
+        float* obs_sin, float* post, float* logprob) nogil
+
+
+cdef class VonMisesHMMCPUImpl:
+    cdef list sequences
+    cdef int n_sequences
+    cdef np.ndarray seq_lengths
+    cdef int n_states, n_features
+    cdef str precision
+    cdef np.ndarray means, kappas, log_transmat, log_transmat_T, log_startprob
+
+    def __cinit__(self, n_states, n_features, precision='mixed'):
+        self.n_states = n_states
+        self.n_features = n_features
+        self.precision = str(precision)
+        if self.precision not in ['single', 'mixed']:
+            raise ValueError('This platform only supports single or mixed precision')
+
+    def __reduce__(self):
+        return (self.__class__, (self.n_states, self.n_features, self.precision))
+
+    property _sequences:
+        def __set__(self, value):
+            self.sequences = list(value)
+            self.n_sequences = len(value)
+            if self.n_sequences <= 0:
+                raise ValueError('More than 0 sequences must be provided')
+
+            cdef np.ndarray[ndim=1, dtype=np.int32_t] seq_lengths = np.zeros(self.n_sequences, dtype=np.int32)
+            cdef np.ndarray[ndim=2, dtype=np.float32_t] S
+            for i in range(self.n_sequences):
+                self.sequences[i] = np.asarray(self.sequences[i], order='c', dtype=np.float32)
+                S = self.sequences[i]
+                seq_lengths[i] = len(S)
+                if self.n_features != S.shape[1]:
+                    raise ValueError('All sequences must be arrays of shape N by %d' %
+                                     self.n_features)
+            self.seq_lengths = seq_lengths
+
+    property means_:
+        def __set__(self, np.ndarray[ndim=2, dtype=np.float32_t, mode='c'] m):
+            if (m.shape[0] != self.n_states) or (m.shape[1] != self.n_features):
+                raise TypeError('Means must have shape (%d, %d), You supplied (%d, %d)' %
+                                (self.n_states, self.n_features, m.shape[0], m.shape[1]))
+            self.means = m
+
+        def __get__(self):
+            return self.means
+
+    property kappas_:
+        def __set__(self, np.ndarray[ndim=2, dtype=np.float32_t, mode='c'] k):
+            if (k.shape[0] != self.n_states) or (k.shape[1] != self.n_features):
+                raise TypeError('Kappas must have shape (%d, %d), You supplied (%d, %d)' %
+                                (self.n_states, self.n_features, k.shape[0], k.shape[1]))
+            self.kappas = k
+
+        def __get__(self):
+            return self.kappas
+
+    property transmat_:
+        def __set__(self, np.ndarray[ndim=2, dtype=np.float32_t, mode='c'] t):
+            if (t.shape[0] != self.n_states) or (t.shape[1] != self.n_states):
+                raise TypeError('transmat must have shape (%d, %d), You supplied (%d, %d)' %
+                                (self.n_states, self.n_states, t.shape[0], t.shape[1]))
+            self.log_transmat = np.log(t)
+            self.log_transmat_T = np.asarray(self.log_transmat.T, order='C')
+
+        def __get__(self):
+            return np.exp(self.log_transmat)
+
+    property startprob_:
+        def __get__(self):
+            return np.exp(self.log_startprob)
+
+        def __set__(self, np.ndarray[ndim=1, dtype=np.float32_t, mode='c'] s):
+            if (s.shape[0] != self.n_states):
+                raise TypeError('startprob must have shape (%d,), You supplied (%d,)' %
+                                (self.n_states, s.shape[0]))
+            self.log_startprob = np.log(s)
+
+    def do_estep(self):
+        cdef np.ndarray[ndim=2, mode='c', dtype=np.float32_t] log_transmat = self.log_transmat
+        cdef np.ndarray[ndim=2, mode='c', dtype=np.float32_t] log_transmat_T = self.log_transmat_T
+        cdef np.ndarray[ndim=1, mode='c', dtype=np.float32_t] log_startprob = self.log_startprob
+        cdef np.ndarray[ndim=1, mode='c', dtype=np.int32_t] seq_lengths = self.seq_lengths
+
+        # the emission parameters enter the likelihood only through these
+        # combinations. log(I_0(kappa)) = log(i0e(kappa)) + kappa avoids
+        # overflow for large kappa
+        means = self.means.astype(np.float64)
+        kappas = self.kappas.astype(np.float64)
+        cdef np.ndarray[ndim=2, mode='c', dtype=np.float32_t] kappa_cos_means = \
+            (kappas * np.cos(means)).astype(np.float32)
+        cdef np.ndarray[ndim=2, mode='c', dtype=np.float32_t] kappa_sin_means = \
+            (kappas * np.sin(means)).astype(np.float32)
+        cdef np.ndarray[ndim=1, mode='c', dtype=np.float32_t] log_normalizers = \
+            np.sum(np.log(2*np.pi*i0e(kappas)) + kappas, axis=1).astype(np.float32)
+
+        cdef np.ndarray[ndim=2, mode='c', dtype=np.float32_t] transcounts = np.zeros((self.n_states, self.n_states), dtype=np.float32)
+        cdef np.ndarray[ndim=2, mode='c', dtype=np.float32_t] obs_cos = np.zeros((self.n_states, self.n_features), dtype=np.float32)
+        cdef np.ndarray[ndim=2, mode='c', dtype=np.float32_t] obs_sin = np.zeros((self.n_states, self.n_features), dtype=np.float32)
+        cdef np.ndarray[ndim=1, mode='c', dtype=np.float32_t] post = np.zeros(self.n_states, dtype=np.float32)
+        cdef float logprob = 0
+
+        seq_pointers = <float**>malloc(self.n_sequences * sizeof(float*))
+        cdef np.ndarray[ndim=2, mode='c', dtype=np.float32_t] sequence
+        for i in range(self.n_sequences):
+            sequence = self.sequences[i]
+            seq_pointers[i] = &sequence[0,0]
+
+        if self.precision == 'single':
+            with nogil:
+                do_estep_single(
+                    <float*> &log_transmat[0,0], <float*> &log_transmat_T[0,0],
+                    <float*> &log_startprob[0], <float*> &kappa_cos_means[0,0],
+                    <float*> &kappa_sin_means[0,0], <float*> &log_normalizers[0],
+                    <const float**> seq_pointers, self.n_sequences,
+                    <int*> &seq_lengths[0], self.n_features, self.n_states,
+                    <float*> &transcounts[0,0], <float*> &obs_cos[0,0],
+                    <float*> &obs_sin[0,0], <float*> &post[0], &logprob)
+        elif self.precision == 'mixed':
+            with nogil:
+                do_estep_mixed(
+                    <float*> &log_transmat[0,0], <float*> &log_transmat_T[0,0],
+                    <float*> &log_startprob[0], <float*> &kappa_cos_means[0,0],
+                    <float*> &kappa_sin_means[0,0], <float*> &log_normalizers[0],
+                    <const float**> seq_pointers, self.n_sequences,
+                    <int*> &seq_lengths[0], self.n_features, self.n_states,
+                    <float*> &transcounts[0,0], <float*> &obs_cos[0,0],
+                    <float*> &obs_sin[0,0], <float*> &post[0], &logprob)
+        else:
+            free(seq_pointers)
+            raise RuntimeError('Invalid precision')
+
+        free(seq_pointers)
+        return logprob, {'trans': transcounts, 'post': post, 'cos': obs_cos, 'sin': obs_sin}
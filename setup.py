@@ -369,13 +369,15 @@ extensions.append(
 extensions.append(
     Extension('mixtape.cluster._kcentersc',
               sources=['Mixtape/cluster/_kcentersc.pyx'],
-              libraries=['m'],
+              libraries=['m'] + libraries,
+              extra_compile_args=extra_compile_args,
               include_dirs=['Mixtape/src/f2py', 'Mixtape/src/blas', np.get_include()]))
 
 extensions.append(
     Extension('mixtape.cluster._commonc',
               sources=['Mixtape/cluster/_commonc.pyx'],
-              libraries=['m'],
+              libraries=['m'] + libraries,
+              extra_compile_args=extra_compile_args,
               include_dirs=['Mixtape/src/f2py', 'Mixtape/src/blas', np.get_include()]))
 
 extensions.append(
@@ -402,6 +404,16 @@ extensions.append(
               include_dirs=[np.get_include(), 'platforms/cpu/kernels/include/',
                             'platforms/cpu/kernels/']))
 
+extensions.append(
+    Extension('mixtape._cpu_vmhmm',
+              language='c++',
+              sources=['platforms/cpu/wrappers/VonMisesHMMCPUImpl.pyx'],
+              libraries=libraries + lapack_info['libraries'],
+              extra_compile_args=extra_compile_args,
+              extra_link_args=lapack_info['extra_link_args'],
+              include_dirs=[np.get_include(), 'platforms/cpu/kernels/include/',
+                            'platforms/cpu/kernels/']))
+
 extensions.append(
     Extension('mixtape._vmhmm',
               sources=['src/vonmises/vmhmm.c', 'src/vonmises/vmhmmwrap.pyx',
@@ -9,7 +9,7 @@ cdef extern int fitinvkappa(long n_samples, long n_features, long n_components,
 cdef extern int compute_log_likelihood(double* obs, double* means, double* kappas,
                                         long n_samples, long n_components, long n_features,
                                         double* out) nogil
-cdef extern int inv_mbessel_ratio(double* x, size_t n) nogil
+cdef extern void inv_mbessel_ratio(double* x, size_t n) nogil
 
 
 @cython.boundscheck(False)
@@ -57,3 +57,20 @@ def _compute_log_likelihood(np.ndarray[dtype=np.double_t, ndim=2, mode='c'] obs
                            n_components, n_features, &out[0,0])
 
     return out
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def _inv_mbessel_ratio(y):
+    """Inverse of the ratio of the modified Bessel functions of the first
+    kind of order 1 and 0, A(x) = I_1(x) / I_0(x), evaluated elementwise
+    from the precomputed spline tables. Inputs are clipped to the range of
+    the tables.
+    """
+    cdef np.ndarray[dtype=np.double_t, ndim=1, mode='c'] x
+    x = np.array(y, dtype=np.double, copy=True).reshape(-1)
+    cdef size_t n = x.shape[0]
+    if n > 0:
+        with nogil:
+            inv_mbessel_ratio(&x[0], n)
+    return x.reshape(np.shape(y))
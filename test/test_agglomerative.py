@@ -53,4 +53,42 @@ def test_3():
 
     data = np.random.RandomState(0).randn(100, 2)
     eq(model1.fit_predict([data])[0], model2.fit_predict([data])[0])
-    
\ No newline at end of file
+    
+
+def test_4():
+    # the nearest-neighbor chain gives the same hierarchy as scipy
+    from scipy.cluster.hierarchy import linkage, fcluster
+    from mixtape.cluster.agglomerative import nn_chain_linkage
+    data = np.random.RandomState(0).randn(100, 2)
+    for method in ['single', 'complete', 'average']:
+        Z1 = linkage(scipy.spatial.distance.pdist(data), method=method)
+        Z2 = nn_chain_linkage(data, 'euclidean', method)
+        eq(Z1[:, 2], Z2[:, 2])
+        eq(fcluster(Z1, criterion='maxclust', t=5),
+           fcluster(Z2, criterion='maxclust', t=5))
+
+
+def test_5():
+    # predict() streams the data in blocks; the result should not depend
+    # on the block size
+    import mixtape.cluster.agglomerative
+    data = np.random.RandomState(0).randn(100, 2)
+    for linkage in ['single', 'complete', 'average']:
+        model = LandmarkAgglomerative(n_clusters=5, n_landmarks=20, linkage=linkage)
+        labels1 = model.fit_predict([data])[0]
+
+        block_bytes = mixtape.cluster.agglomerative.BLOCK_BYTES
+        mixtape.cluster.agglomerative.BLOCK_BYTES = 8 * 20 * 7
+        try:
+            labels2 = model.predict([data])[0]
+        finally:
+            mixtape.cluster.agglomerative.BLOCK_BYTES = block_bytes
+        eq(labels1, labels2)
+
+
+def test_6():
+    # a callable metric fills the condensed distance matrix directly
+    from mixtape.cluster.agglomerative import pdist
+    data = np.random.RandomState(0).randn(50, 3)
+    metric = lambda target, ref, i: np.sqrt(np.sum((target-ref[i])**2, axis=1))
+    eq(pdist(data, metric), scipy.spatial.distance.pdist(data))
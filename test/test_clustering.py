@@ -21,3 +21,74 @@ def test_kcenters_rmsd():
 def test_kcenters_spatial():
     model = mixtape.cluster.KCenters(3)
     model.fit([X])
+
+def test_predict_labels_euclidean():
+    from scipy.spatial.distance import cdist
+    from mixtape.cluster._commonc import _predict_labels_euclidean
+    random = np.random.RandomState(0)
+    for n_features in [1, 3, 40]:
+        # a random walk, like a trajectory, and i.i.d. samples
+        for data in [np.cumsum(0.1 * random.randn(2000, n_features), axis=0),
+                     random.randn(2000, n_features)]:
+            for dtype in [np.float64, np.float32]:
+                data = data.astype(dtype)
+                centers = data[random.permutation(len(data))[:100]]
+                labels = _predict_labels_euclidean(data, centers)
+                np.testing.assert_array_equal(
+                    labels, np.argmin(cdist(data, centers), axis=1))
+
+def test_predict_labels_euclidean_ties():
+    # duplicated and equidistant centers must go to the lowest index, as
+    # with a brute force argmin
+    from scipy.spatial.distance import cdist
+    from mixtape.cluster._commonc import (_predict_labels_euclidean,
+                                          _assign_labels_triangle)
+    X = np.array([[0.0, 0.0]])
+    C = np.array([[1, 1], [1, 2], [2, 1], [2, 2], [1, 1], [1, 1]], dtype=float)
+    eq = np.testing.assert_array_equal
+    eq(_predict_labels_euclidean(X, C), [0])
+
+    random = np.random.RandomState(0)
+    for n_features in [1, 2, 3]:
+        # small integers, so that there are many exact ties
+        data = random.randint(-1, 4, size=(500, n_features)).astype(float)
+        centers = random.randint(0, 3, size=(30, n_features)).astype(float)
+        centers = np.concatenate([centers, centers[::-1]])
+        ref = np.argmin(cdist(data, centers, 'sqeuclidean'), axis=1)
+        for dtype in [np.float64, np.float32]:
+            for n_neighbors in [0, 4, 32]:
+                labels = np.zeros(len(data), dtype=np.int64)
+                _assign_labels_triangle(data.astype(dtype), centers.astype(dtype),
+                                        labels, np.zeros(0, dtype=dtype),
+                                        n_neighbors=n_neighbors)
+                eq(labels, ref)
+
+def test_predict_labels_euclidean_nonfinite():
+    # rows with nan or inf go to center 0, as with a brute force search, and
+    # don't disturb the assignment of the rows after them
+    from scipy.spatial.distance import cdist
+    from mixtape.cluster._commonc import _assign_labels_triangle
+    random = np.random.RandomState(0)
+    data = random.randn(600, 3)
+    centers = random.randn(50, 3)
+    data[[0, 1, 256, 300]] = np.nan
+    data[400, 1] = np.inf
+    data[-1, 0] = -np.inf
+    d2 = cdist(data, centers, 'sqeuclidean')
+    ref = np.argmin(d2, axis=1)
+    for n_neighbors in [0, 4, 32]:
+        labels = np.zeros(len(data), dtype=np.int64)
+        distances = np.zeros(len(data))
+        _assign_labels_triangle(data, centers, labels, distances,
+                                n_neighbors=n_neighbors)
+        np.testing.assert_array_equal(labels, ref)
+        np.testing.assert_allclose(distances,
+                                   np.sqrt(d2[np.arange(len(data)), ref]))
+
+def test_kmeans_predict():
+    from scipy.spatial.distance import cdist
+    model = mixtape.cluster.KMeans(n_clusters=10, random_state=0)
+    labels = model.fit([X]).labels_[0]
+    np.testing.assert_array_equal(model.predict([X])[0], labels)
+    np.testing.assert_array_equal(
+        labels, np.argmin(cdist(X, model.cluster_centers_), axis=1))
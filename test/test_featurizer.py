@@ -1,6 +1,7 @@
 import numpy as np
 from mdtraj.testing import get_fn, eq, raises
 import mdtraj as md
+import scipy.sparse
 import mixtape.featurizer, mixtape.subset_featurizer
 from mixtape.datasets import fetch_alanine_dipeptide
 
@@ -48,6 +49,32 @@ def test_SubsetAtomPairs2():
     any([eq(x, x0) for (x, x0) in zip(X_all, X_all0)])
 
 
+def test_subset_cache_dir():
+    import os, shutil, tempfile
+    dataset = fetch_alanine_dipeptide()
+    trajectories = [t[:200] for t in dataset["trajectories"][:2]]
+    trj0 = trajectories[0][0]
+    atom_indices, pair_indices = mixtape.subset_featurizer.get_atompair_indices(trj0)
+
+    tempdir = tempfile.mkdtemp()
+    try:
+        for klass, args in [
+                (mixtape.subset_featurizer.SubsetAtomPairs, (pair_indices, trj0)),
+                (mixtape.subset_featurizer.SubsetSinPsiFeaturizer, (trj0,))]:
+            featurizer = klass(*args)
+            cached = klass(*args, cache_dir=tempdir)
+            for subset in [np.array([0]), np.arange(featurizer.n_max)[::-1]]:
+                featurizer.subset = subset
+                cached.subset = subset
+                X_all0 = featurizer.transform(trajectories)
+                X_all1 = cached.transform(trajectories)
+                for x0, x1 in zip(X_all0, X_all1):
+                    eq(x0, x1)
+        assert len(os.listdir(tempdir)) == 4
+    finally:
+        shutil.rmtree(tempdir)
+
+
 def test_that_all_featurizers_run():
     dataset = fetch_alanine_dipeptide()
     trajectories = dataset["trajectories"]
@@ -81,3 +108,313 @@ def test_that_all_featurizers_run():
     
     X_all = featurizer.transform(trajectories)
     eq(X_all[0].shape[1], 1 * featurizer.n_featurizers)
+
+
+def test_featurize_all_parallel():
+    import os, shutil, tempfile
+    dataset = fetch_alanine_dipeptide()
+    trajectories = dataset["trajectories"]
+    featurizer = mixtape.featurizer.DihedralFeaturizer(["phi", "psi"])
+
+    tempdir = tempfile.mkdtemp()
+    try:
+        filenames = []
+        for i, t in enumerate(trajectories[:3]):
+            fn = os.path.join(tempdir, 'trj%d.h5' % i)
+            t[:500].save(fn)
+            filenames.append(fn)
+
+        X0, _, _ = mixtape.featurizer.featurize_all(
+            filenames, featurizer, None, chunk=50, stride=2)
+
+        out = os.path.join(tempdir, 'features')
+        manifest = mixtape.featurizer.featurize_all_parallel(
+            filenames, featurizer, None, out, chunk=50, stride=2, n_jobs=2,
+            frames_per_task=70)
+        X_all, fns = mixtape.featurizer.load_featurized(out)
+
+        eq(fns, filenames)
+        eq([m['n_frames'] for m in manifest], [250, 250, 250])
+        eq(np.concatenate(X_all), X0)
+    finally:
+        shutil.rmtree(tempdir)
+
+
+@raises(ValueError)
+def test_iterfeaturize_n_jobs_zero():
+    featurizer = mixtape.featurizer.DihedralFeaturizer(["phi", "psi"])
+    list(mixtape.featurizer.iterfeaturize([], featurizer, None, n_jobs=0))
+
+
+def test_iterfeaturize_n_jobs_negative():
+    import multiprocessing
+    n_cpus = multiprocessing.cpu_count()
+    eq(mixtape.featurizer._n_workers(-1), n_cpus)
+    eq(mixtape.featurizer._n_workers(-n_cpus - 5), 1)
+    eq(mixtape.featurizer._n_workers(None), n_cpus)
+    eq(mixtape.featurizer._n_workers(3), 3)
+
+
+def test_feature_cache():
+    import os, shutil, tempfile
+    from mixtape.feature_cache import FeatureCache, CachedFeaturizer
+    dataset = fetch_alanine_dipeptide()
+    trajectories = [t[:200] for t in dataset["trajectories"][:3]]
+    featurizer = mixtape.featurizer.DihedralFeaturizer(["phi", "psi"])
+    X_all0 = featurizer.transform(trajectories)
+
+    tempdir = tempfile.mkdtemp()
+    try:
+        cached = CachedFeaturizer(featurizer, os.path.join(tempdir, 'cache'))
+        X_all1 = cached.transform(trajectories)
+        X_all2 = cached.transform(trajectories)
+        for x0, x1, x2 in zip(X_all0, X_all1, X_all2):
+            eq(x0, x1)
+            eq(x0, np.asarray(x2))
+
+        filenames = []
+        for i, t in enumerate(trajectories):
+            fn = os.path.join(tempdir, 'trj%d.h5' % i)
+            t.save(fn)
+            filenames.append(fn)
+
+        # the cache holds only ~2 of the 3 featurized trajectories
+        max_bytes = 2 * X_all0[0].nbytes + 500
+        cache = FeatureCache(os.path.join(tempdir, 'files'), max_bytes=max_bytes)
+        X0, _, _ = mixtape.featurizer.featurize_all(filenames, featurizer, None)
+        X1, _, _ = mixtape.featurizer.featurize_all(filenames, featurizer, None, cache=cache)
+        X2, _, _ = mixtape.featurizer.featurize_all(filenames, featurizer, None, cache=cache)
+        eq(X0, X1)
+        eq(X0, X2)
+        assert cache.n_bytes <= max_bytes
+    finally:
+        shutil.rmtree(tempdir)
+
+
+
+def test_feature_cache_topology():
+    # the same trajectory file loaded with two different topologies must
+    # give two cache entries
+    import os, shutil, tempfile
+    from mixtape.feature_cache import FeatureCache
+    dataset = fetch_alanine_dipeptide()
+    traj = dataset["trajectories"][0][:100]
+    featurizer = mixtape.featurizer.DihedralFeaturizer(["phi", "psi"])
+
+    tempdir = tempfile.mkdtemp()
+    try:
+        fn = os.path.join(tempdir, 'trj.dcd')
+        pdb = os.path.join(tempdir, 'top.pdb')
+        traj.save(fn)
+        traj[0].save(pdb)
+        top = traj.topology.copy()
+        top.residue(0).name = 'XXX'
+
+        cache = FeatureCache(os.path.join(tempdir, 'cache'))
+        def n_entries():
+            return len([f for f in os.listdir(cache.directory)
+                        if f.endswith('.npy')])
+        mixtape.featurizer.featurize_all([fn], featurizer, pdb, cache=cache)
+        eq(n_entries(), 1)
+        mixtape.featurizer.featurize_all([fn], featurizer, pdb, cache=cache)
+        eq(n_entries(), 1)
+        mixtape.featurizer.featurize_all([fn], featurizer, top, cache=cache)
+        eq(n_entries(), 2)
+        # an equal topology gives the same key as the original object
+        assert cache.file_key(featurizer, fn, top=top) == \
+            cache.file_key(featurizer, fn, top=top.copy())
+        assert cache.file_key(featurizer, fn, top=top) != \
+            cache.file_key(featurizer, fn, top=traj.topology)
+    finally:
+        shutil.rmtree(tempdir)
+
+
+def test_feature_cache_corrupt():
+    # a truncated entry is a miss, and is removed
+    import os, shutil, tempfile
+    from mixtape.feature_cache import FeatureCache
+    tempdir = tempfile.mkdtemp()
+    try:
+        cache = FeatureCache(tempdir)
+        cache.put('a', np.arange(1000.0))
+        path = os.path.join(tempdir, 'a.npy')
+        with open(path, 'rb') as f:
+            data = f.read()
+        for corrupt in [data[:500], data[:40], b'']:
+            with open(path, 'wb') as f:
+                f.write(corrupt)
+            assert cache.get('a') is None
+            assert not os.path.exists(path)
+        assert cache.get('a') is None
+    finally:
+        shutil.rmtree(tempdir)
+
+
+def test_feature_cache_key_functions():
+    # module-level functions are hashed by name, so keys are the same in
+    # every process
+    import hashlib
+    from mixtape.feature_cache import _hash_update
+    def digest(obj):
+        h = hashlib.sha1()
+        _hash_update(h, obj)
+        return h.hexdigest()
+    eq(digest({'function': np.sum}), digest({'function': np.sum}))
+    assert digest({'function': np.sum}) != digest({'function': np.mean})
+    assert digest(np.float64) != digest(np.float32)
+
+
+@raises(TypeError)
+def test_feature_cache_key_lambda():
+    # the repr of a lambda includes its address
+    from mixtape.feature_cache import _hash_update
+    import hashlib
+    _hash_update(hashlib.sha1(), {'function': lambda x: x})
+
+
+def test_TrajFeatureUnion_chunked():
+    dataset = fetch_alanine_dipeptide()
+    trajectories = [t[:500] for t in dataset["trajectories"][:3]]
+    trj0 = trajectories[0][0]
+    atom_indices, pair_indices = mixtape.subset_featurizer.get_atompair_indices(trj0)
+
+    dihedrals = mixtape.featurizer.DihedralFeaturizer(["phi", "psi"])
+    pairs = mixtape.featurizer.AtomPairsFeaturizer(pair_indices)
+    union = mixtape.featurizer.TrajFeatureUnion(
+        [("dihedrals", dihedrals), ("pairs", pairs)],
+        transformer_weights={"pairs": 2.0}, chunk=128)
+
+    X_all = union.transform(trajectories)
+    for X, traj in zip(X_all, trajectories):
+        X0 = np.hstack([dihedrals.partial_transform(traj),
+                        2.0 * pairs.partial_transform(traj)])
+        eq(X, X0)
+    eq(sorted(union.timings_.keys()), ["dihedrals", "pairs"])
+
+
+def test_RMSDFeaturizer():
+    dataset = fetch_alanine_dipeptide()
+    trajectories = dataset["trajectories"]
+    traj = trajectories[0][:1000]
+    trj0 = trajectories[1][::500]
+    atom_indices = np.arange(10)
+
+    featurizer = mixtape.featurizer.RMSDFeaturizer(trj0, atom_indices=atom_indices)
+    X = featurizer.partial_transform(traj)
+
+    X0 = np.array([md.rmsd(traj, trj0, atom_indices=atom_indices, frame=frame)
+                   for frame in range(trj0.n_frames)]).T
+    eq(X.shape, (traj.n_frames, trj0.n_frames))
+    np.testing.assert_array_almost_equal(X, X0, decimal=4)
+
+
+def test_GaussianSolventFeaturizer_cutoff():
+    # compare the cell list against the exact kernel truncated at the
+    # cutoff, with cutoffs small enough to give several cells per side
+    random = np.random.RandomState(0)
+    n_atoms, sigma = 2000, 0.05
+    topology = md.Topology()
+    residue = topology.add_residue('HOH', topology.add_chain())
+    for i in range(n_atoms):
+        topology.add_atom('O', md.element.oxygen, residue)
+
+    solute_indices = np.arange(20).reshape(-1, 1)
+    solvent_indices = np.arange(20, n_atoms).reshape(-1, 1)
+    lengths = np.array([2.0, 1.6, 1.3])
+    for periodic in [True, False]:
+        if periodic:
+            # some atoms lie outside of the box, and need to be wrapped
+            xyz = random.uniform(-0.5, 1.5, size=(3, n_atoms, 3)) * lengths
+            traj = md.Trajectory(xyz, topology,
+                                 unitcell_lengths=np.tile(lengths, (3, 1)),
+                                 unitcell_angles=90 * np.ones((3, 3)))
+        else:
+            xyz = random.uniform(0, 1, size=(3, n_atoms, 3)) * lengths
+            traj = md.Trajectory(xyz, topology)
+
+        for cutoff in [4, 7, 10]:
+            diff = (traj.xyz[:, 20:, np.newaxis].astype(np.float64) -
+                    traj.xyz[:, np.newaxis, :20])
+            if periodic:
+                box = traj.unitcell_lengths[:, np.newaxis, np.newaxis]
+                diff -= box * np.round(diff / box)
+            d = np.sqrt(np.sum(diff ** 2, axis=3))
+            ref = np.sum(np.where(d < cutoff * sigma,
+                                  np.exp(-d / (2 * sigma * sigma)), 0), axis=1)
+            assert np.all(ref > 0)
+
+            featurizer = mixtape.featurizer.GaussianSolventFeaturizer(
+                solute_indices, solvent_indices, sigma=sigma, cutoff=cutoff)
+            np.testing.assert_allclose(featurizer.partial_transform(traj),
+                                       ref, rtol=1e-10)
+
+        # the frames split over worker processes give the same result
+        serial = featurizer.partial_transform(traj)
+        for n_jobs in [2, -1]:
+            featurizer = mixtape.featurizer.GaussianSolventFeaturizer(
+                solute_indices, solvent_indices, sigma=sigma, cutoff=cutoff,
+                n_jobs=n_jobs)
+            eq(featurizer.partial_transform(traj), serial)
+
+
+def test_SparseContactFeaturizer():
+    from mixtape.datasets import fetch_met_enkephalin
+    dataset = fetch_met_enkephalin()
+    traj = dataset["trajectories"][0][::10]
+
+    for scheme in ['ca', 'closest', 'closest-heavy']:
+        distances, _ = md.compute_contacts(traj, 'all', scheme, periodic=False)
+
+        featurizer = mixtape.featurizer.SparseContactFeaturizer(
+            scheme=scheme, cutoff=0.45)
+        X = featurizer.partial_transform(traj)
+        eq(X.shape, distances.shape)
+        eq(X.toarray() > 0, distances < 0.45)
+
+        featurizer = mixtape.featurizer.SparseContactFeaturizer(
+            scheme=scheme, cutoff=0.45, binary=False)
+        X = featurizer.partial_transform(traj)
+        np.testing.assert_array_almost_equal(
+            X.toarray(), np.where(distances < 0.45, distances, 0), decimal=5)
+
+        # the residue-pair table is computed once and reused for each chunk
+        chunks = [featurizer.partial_transform(traj[i:i + 7])
+                  for i in range(0, traj.n_frames, 7)]
+        eq(scipy.sparse.vstack(chunks).toarray(), X.toarray())
+
+
+def test_DihedralFeaturizer():
+    dataset = fetch_alanine_dipeptide()
+    traj = dataset["trajectories"][0][:100]
+
+    for sincos in [True, False]:
+        featurizer = mixtape.featurizer.DihedralFeaturizer(
+            ["psi", "phi", "omega"], sincos=sincos)
+        X = featurizer.fit([traj]).partial_transform(traj)
+
+        X0 = []
+        for a in ["psi", "phi", "omega"]:
+            y = getattr(md, 'compute_%s' % a)(traj)[1]
+            X0.extend([np.sin(y), np.cos(y)] if sincos else [y])
+        X0 = np.hstack(X0)
+
+        eq(X.dtype, np.dtype(np.float32))
+        eq(X, X0)
+
+
+def test_SuperposeFeaturizer():
+    dataset = fetch_alanine_dipeptide()
+    traj = dataset["trajectories"][0][:100]
+    trj0 = dataset["trajectories"][1][0]
+    atom_indices = np.arange(15)
+    xyz = traj.xyz.copy()
+
+    featurizer = mixtape.featurizer.SuperposeFeaturizer(atom_indices, trj0)
+    X = featurizer.partial_transform(traj)
+    # the input trajectory is not modified
+    eq(traj.xyz, xyz)
+
+    traj.superpose(trj0, atom_indices=atom_indices)
+    X0 = np.sqrt(np.sum((traj.xyz[:, atom_indices] -
+                         trj0.xyz[0, atom_indices]) ** 2, axis=2))
+    np.testing.assert_array_almost_equal(X, X0, decimal=5)
@@ -123,3 +123,21 @@ def test_kcenters_8():
         assert np.all(np.logical_not(np.isnan(m1.distances_[0])))
         eq(m1.predict([X])[0], m2.predict([X])[0])
         eq(m1.predict([X])[0], m1.labels_[0])
+
+
+def test_kcenters_9():
+    # the optimized rmsd code path should agree with calling md.rmsd
+    random = np.random.RandomState(0)
+    x = md.Trajectory(xyz=random.randn(100, 10, 3).astype(np.float32), topology=None)
+    for metric in [md.rmsd, 'rmsd']:
+        m1 = KCenters(n_clusters=10, metric=metric, random_state=0, opt=True).fit([x])
+        m2 = KCenters(n_clusters=10, metric=metric, random_state=0, opt=False).fit([x])
+
+        eq(m1.cluster_centers_.n_frames, 10)
+        for i in range(10):
+            np.testing.assert_almost_equal(
+                md.rmsd(m1.cluster_centers_, m2.cluster_centers_, i)[i], 0, decimal=2)
+        eq(m1.labels_[0], m2.labels_[0])
+        eq(m1.distances_[0], m2.distances_[0], decimal=4)
+        eq(m1.predict([x])[0], m2.predict([x])[0])
+        eq(m1.predict([x])[0], m1.labels_[0])
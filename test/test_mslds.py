@@ -263,3 +263,70 @@ def test_alanine_dipeptide():
         type, value, tb = sys.exc_info()
         traceback.print_exc()
         pdb.post_mortem(tb)
+
+
+def test_sample_trajectories():
+    # The batched sampler follows the model's transition matrix and linear
+    # dynamics, and sample() gives the same trajectory for the same seed
+    model = MetastableSwitchingLDS(2, 2)
+    model.As_ = [[[0.9, 0.1], [0., 0.8]], [[0.5, 0.], [0.2, 0.7]]]
+    model.bs_ = [[0.1, 0.1], [-1., 0.5]]
+    model.Qs_ = [0.01 * np.eye(2), [[0.02, 0.01], [0.01, 0.03]]]
+    model.means_ = [[1., 1.], [-2., 1.]]
+    model.covars_ = [0.1 * np.eye(2), 0.1 * np.eye(2)]
+    model.transmat_ = [[0.95, 0.05], [0.1, 0.9]]
+    model.populations_ = [0.5, 0.5]
+
+    obs, states = model.sample_trajectories(500, 200, random_state=0)
+    assert obs.shape == (500, 200, 2)
+    assert states.shape == (500, 200)
+
+    counts = np.zeros((2, 2))
+    np.add.at(counts, (states[:, :-1].ravel(), states[:, 1:].ravel()), 1)
+    np.testing.assert_array_almost_equal(
+        counts / counts.sum(axis=1)[:, np.newaxis], model.transmat_,
+        decimal=2)
+
+    As = model.As_.astype(np.float64)[states[:, :-1]]
+    residuals = (obs[:, 1:] - np.einsum('ntij,ntj->nti', As, obs[:, :-1])
+                 - model.bs_[states[:, :-1]])
+    for i in range(2):
+        np.testing.assert_array_almost_equal(
+            np.cov(residuals[states[:, :-1] == i].T), model.Qs_[i],
+            decimal=3)
+
+    obs1, states1 = model.sample(50, init_state=1, init_obs=[0., 0.],
+                                 random_state=1)
+    obs2, states2 = model.sample_trajectories(1, 50, init_state=1,
+            init_obs=[0., 0.], random_state=1)
+    np.testing.assert_array_equal(obs1, obs2[0])
+    np.testing.assert_array_equal(states1, states2[0])
+    assert states1[0] == 1
+
+
+def test_sample_trajectories_degenerate():
+    # Singular (positive semidefinite) noise covariances, and populations
+    # that sum to less than 1, can still be sampled from
+    model = MetastableSwitchingLDS(2, 2)
+    model.As_ = [0.5 * np.eye(2), 0.5 * np.eye(2)]
+    model.bs_ = [[0., 0.], [1., 1.]]
+    model.Qs_ = [[[0.01, 0.01], [0.01, 0.01]], 0.01 * np.eye(2)]
+    model.means_ = [[0., 0.], [2., 2.]]
+    model.covars_ = [[[0.1, -0.1], [-0.1, 0.1]], 0.1 * np.eye(2)]
+    model.transmat_ = [[0.9, 0.1], [0.1, 0.9]]
+    model.populations_ = [0.5, 0.4]
+
+    obs, states = model.sample_trajectories(200, 20, random_state=0)
+    assert np.all(np.isfinite(obs))
+    assert np.all((states >= 0) & (states < 2))
+
+    # the initial observations of state 0 vary only along (1, -1)
+    first = obs[states[:, 0] == 0, 0]
+    np.testing.assert_array_almost_equal(first.sum(axis=1), 0, decimal=5)
+    # and its steps only along (1, 1)
+    residuals = obs[:, 1:] - 0.5 * obs[:, :-1]
+    steps = residuals[states[:, :-1] == 0]
+    np.testing.assert_array_almost_equal(steps[:, 0] - steps[:, 1], 0,
+                                         decimal=5)
+    np.testing.assert_array_almost_equal(np.cov(steps.T), model.Qs_[0],
+                                         decimal=3)
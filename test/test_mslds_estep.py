@@ -338,6 +338,34 @@ def test_randn_stats():
             stats['trans'], rstats['trans'], decimal=3)
 
 
+def test_aux_matrices():
+    # The M-step auxiliary matrices assembled by the native E-step match
+    # compute_aux_matrices on the returned statistics, with both the HMM
+    # and the MSLDS likelihoods
+    from mixtape.mslds_solver import compute_aux_matrices
+    n_states, n_features = 2, 3
+    random = np.random.RandomState(0)
+    data = [np.cumsum(random.randn(100, n_features), axis=0),
+            np.cumsum(random.randn(60, n_features), axis=0)]
+    model = MetastableSwitchingLDS(n_states=n_states,
+            n_features=n_features, n_hotstart=0)
+    model._init(data)
+    model.As_ = 0.5 * random.randn(n_states, n_features, n_features)
+    model.bs_ = random.randn(n_states, n_features)
+
+    for hmm_hotstart in [True, False]:
+        logprob, stats = model.inferrer.do_estep(hmm_hotstart=hmm_hotstart)
+        Bs, Cs, Es, Ds, Fs = compute_aux_matrices(n_states, n_features,
+                model.As_, model.bs_, model.covars_, stats)
+        for key, ref in zip('BCDEF', [Bs, Cs, Ds, Es, Fs]):
+            assert stats[key].shape == (n_states, n_features, n_features)
+            np.testing.assert_allclose(stats[key], ref, rtol=1e-3,
+                    atol=1e-3 * np.abs(ref).max())
+
+    _, stats = model.inferrer.do_estep(compute_aux=False)
+    assert 'F' not in stats
+
+
 @attr('broken')
 def test_gaussian_loglikelihood_full():
     _mslds.test_gaussian_loglikelihood_full()
@@ -17,6 +17,7 @@ from mixtape.datasets.met_enkephalin import TARGET_DIRECTORY \
 from mixtape.datasets.base import get_data_home
 from os.path import join
 from nose.plugins.attrib import attr
+from mdtraj.testing import raises
 
 def test_AQb_solve_simple():
     dim = 1
@@ -416,3 +417,92 @@ def test_met_enkephalin_mstep():
     solver = MetastableSwitchingLDSSolver(n_components, n_features)
     solver.do_mstep(As, Qs, bs, means, covars, rstats, N_iter=100,
                         verbose=True)
+
+
+def _ar1_mstep_inputs(n_features=1, n_components=2, T=500):
+    # Sufficient statistics of independent AR(1) processes, one per
+    # hidden state, with all of the posterior weight on that state
+    random = np.random.RandomState(0)
+    stats = {'post[1:]': np.zeros(n_components),
+             'obs[1:]': np.zeros((n_components, n_features)),
+             'obs[:-1]': np.zeros((n_components, n_features)),
+             'obs*obs[t-1].T': np.zeros((n_components, n_features, n_features)),
+             'obs[:-1]*obs[:-1].T': np.zeros((n_components, n_features, n_features)),
+             'obs[1:]*obs[1:].T': np.zeros((n_components, n_features, n_features))}
+    means, covars = [], []
+    for k in range(n_components):
+        mu = (-1)**k * np.ones(n_features)
+        x = np.zeros((T, n_features))
+        x[0] = mu
+        for t in range(1, T):
+            x[t] = mu + 0.5 * (x[t-1] - mu) + 0.1 * random.randn(n_features)
+        stats['post[1:]'][k] = T - 1
+        stats['obs[1:]'][k] = x[1:].sum(axis=0)
+        stats['obs[:-1]'][k] = x[:-1].sum(axis=0)
+        stats['obs*obs[t-1].T'][k] = np.dot(x[1:].T, x[:-1])
+        stats['obs[:-1]*obs[:-1].T'][k] = np.dot(x[:-1].T, x[:-1])
+        stats['obs[1:]*obs[1:].T'][k] = np.dot(x[1:].T, x[1:])
+        means.append(x.mean(axis=0))
+        covars.append(np.atleast_2d(np.cov(x.T)))
+    As = [np.zeros((n_features, n_features)) for k in range(n_components)]
+    Qs = [0.5 * covar for covar in covars]
+    return As, Qs, list(means), means, covars, stats
+
+
+def test_AQb_update_parallel():
+    # The per-state subproblems are solved in worker processes with
+    # n_jobs > 1. The SDP solver is randomized, so check that each state
+    # gets its own solution (the states have means of opposite sign) rather
+    # than comparing to the serial solution exactly
+    As, Qs, bs, means, covars, stats = _ar1_mstep_inputs()
+    for n_jobs in [1, 2]:
+        solver = MetastableSwitchingLDSSolver(2, 1, n_jobs=n_jobs)
+        A_upds, Q_upds, b_upds = solver.AQb_update(As, Qs, bs, means,
+                covars, stats, N_iter=100, num_biconvex=1)
+        assert len(A_upds) == len(Q_upds) == len(b_upds) == 2
+        assert b_upds[0][0] > 0 and b_upds[1][0] < 0
+        for Q in Q_upds:
+            assert np.all(np.linalg.eigvalsh(Q) > 0)
+        assert solver.solve_times_.shape == (2,)
+        assert np.all(solver.solve_times_ > 0)
+
+@raises(ValueError)
+def test_solver_n_jobs_zero():
+    MetastableSwitchingLDSSolver(2, 1, n_jobs=0)
+
+def test_AQb_update_warm_start():
+    # The second M-step on the same statistics starts from the solutions
+    # of the first, which are cached in the solver (also when they come
+    # back from worker processes)
+    As, Qs, bs, means, covars, stats = _ar1_mstep_inputs()
+    for n_jobs in [1, 2]:
+        solver = MetastableSwitchingLDSSolver(2, 1, n_jobs=n_jobs)
+        for _ in range(2):
+            A_upds, Q_upds, b_upds = solver.AQb_update(As, Qs, bs, means,
+                    covars, stats, N_iter=100, num_biconvex=1)
+        assert len(solver.sdp_n_iter_) == 2
+        assert solver.sdp_n_iter_[0].shape == (2, 2)
+        assert np.all(solver.sdp_n_iter_[0] > 0)
+        # starting from the previous solutions takes fewer iterations
+        assert solver.sdp_n_iter_[1].sum() < solver.sdp_n_iter_[0].sum()
+        for i in range(2):
+            assert solver._sdp_cache[(i, 'Q')]['X'] is not None
+        for Q in Q_upds:
+            assert np.all(np.linalg.eigvalsh(Q) > 0)
+
+        solver.reset_warm_start()
+        assert solver.sdp_n_iter_ == []
+        assert solver._sdp_cache == {}
+
+
+def test_warm_start_trace_bound():
+    # a cached solution is scaled down onto the trace bound of the new
+    # solve if it's above it
+    from mixtape.mslds_solver import _warm_start
+    X_init = np.eye(4)
+    cache = {'X': 2 * np.eye(4)}
+    assert _warm_start(cache, 4, X_init, 10.) is cache['X']
+    np.testing.assert_array_almost_equal(
+        _warm_start(cache, 4, X_init, 7.), 7. / 4 * np.eye(4))
+    assert _warm_start(cache, 3, X_init, 10.) is X_init
+    assert _warm_start(None, 4, X_init, 10.) is X_init
@@ -1,4 +1,5 @@
 import numpy as np
+from mdtraj.testing import raises
 from mixtape.cluster import NDGrid
 
 def test_ndgrid_1():
@@ -20,3 +21,55 @@ def test_ndgrid_2():
     assert np.all(labels[mask3] == 3)
 
 
+
+def test_ndgrid_3():
+    # the sparse grid labels the occupied cells of the dense grid with
+    # compact indices
+    X = np.random.RandomState(0).randn(500, 3)
+    dense = NDGrid(n_bins_per_feature=4).fit([X])
+    sparse = NDGrid(n_bins_per_feature=4, sparse=True).fit([X])
+    labels1 = dense.predict([X])[0]
+    labels2 = sparse.predict([X])[0]
+
+    n_occupied = len(np.unique(labels1))
+    assert sparse.n_bins == n_occupied
+    np.testing.assert_array_equal(np.unique(labels2), np.arange(n_occupied))
+    # one-to-one correspondence between the dense and sparse labels
+    assert len(set(zip(labels1, labels2))) == n_occupied
+    np.testing.assert_array_equal(
+        np.dot(sparse.occupied_bins_[labels2], 4**np.arange(3)), labels1)
+
+
+def test_ndgrid_4():
+    # in many dimensions, the dense grid would overflow
+    X = np.random.RandomState(0).randn(200, 40)
+    model = NDGrid(n_bins_per_feature=10, min=-10, max=10, sparse=True)
+    labels = model.fit([X[:100]]).predict([X])[0]
+    assert np.all(labels[:100] >= 0)
+    assert len(np.unique(labels[:100])) == model.n_bins
+    # cells that were not seen during fit get -1
+    assert np.all(labels[100:] == -1)
+
+
+@raises(ValueError)
+def test_ndgrid_5():
+    # the overflow of the dense grid is detected even when the number of
+    # bins per feature is a numpy integer (np.int64(1000)**10 wraps around)
+    X = np.random.RandomState(0).randn(10, 10)
+    NDGrid(n_bins_per_feature=np.int64(1000)).fit([X])
+
+
+def test_ndgrid_6():
+    # with unseen='nearest', samples in cells that were not seen during fit
+    # get the label of the nearest occupied cell
+    X = np.random.RandomState(0).randn(200, 3)
+    model = NDGrid(n_bins_per_feature=10, min=-5, max=5, sparse=True,
+                   unseen='nearest')
+    labels = model.fit([X[:100]]).predict([X])[0]
+    assert np.all(labels >= 0) and np.all(labels < model.n_bins)
+    centers = model._cell_centers()
+    d = np.sum((X[:, np.newaxis] - centers)**2, axis=2)
+    unseen = NDGrid(n_bins_per_feature=10, min=-5, max=5, sparse=True).fit(
+        [X[:100]]).predict([X])[0] == -1
+    assert np.any(unseen)
+    np.testing.assert_array_equal(labels[unseen], np.argmin(d[unseen], axis=1))
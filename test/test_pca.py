@@ -1,4 +1,5 @@
 import numpy as np
+from mdtraj.testing import raises
 from sklearn.decomposition import PCA as PCAr
 
 from mixtape.pca import PCA
@@ -28,3 +29,61 @@ def test_1():
     np.testing.assert_array_almost_equal(pca.noise_variance_,
                                          pcar.noise_variance_)
 
+
+
+def test_incremental():
+    # Compare the streaming covariance PCA with sklearn.decomposition
+    from mixtape.pca import IncrementalPCA
+
+    np.random.seed(42)
+    trajs = [np.random.randn(10, 3) * [1, 2, 3] + 10 for _ in range(5)]
+
+    pcar = PCAr(n_components=2)
+    pcar.fit(np.concatenate(trajs))
+
+    pca = IncrementalPCA(n_components=2)
+    for X in trajs:
+        pca.partial_fit(X)
+
+    np.testing.assert_array_almost_equal(pca.mean_, pcar.mean_)
+    np.testing.assert_array_almost_equal(pca.explained_variance_ratio_,
+                                         pcar.explained_variance_ratio_)
+    np.testing.assert_array_almost_equal(pca.explained_variance_,
+                                         pcar.explained_variance_)
+    # components are only defined up to a sign
+    overlap = np.abs(np.sum(pca.components_ * pcar.components_, axis=1))
+    np.testing.assert_array_almost_equal(overlap, np.ones(2))
+
+    y = pca.transform(trajs)[0]
+    y_ref = pcar.transform(trajs[0])
+    np.testing.assert_array_almost_equal(np.abs(y), np.abs(y_ref))
+
+
+def test_incremental_randomized():
+    from mixtape.pca import IncrementalPCA
+
+    random = np.random.RandomState(0)
+    # five strong directions on top of weak noise
+    basis = random.randn(5, 50)
+    trajs = [random.randn(200, 5).dot(basis) * 10 + random.randn(200, 50)
+             for _ in range(3)]
+
+    full = IncrementalPCA(n_components=5, solver='full').fit(trajs)
+    rand = IncrementalPCA(n_components=5, solver='randomized',
+                          random_state=0).fit(trajs)
+
+    np.testing.assert_array_almost_equal(
+        rand.explained_variance_ / full.explained_variance_, np.ones(5), decimal=3)
+
+
+
+@raises(ValueError)
+def test_incremental_empty():
+    from mixtape.pca import IncrementalPCA
+    IncrementalPCA().fit([]).components_
+
+
+@raises(ValueError)
+def test_incremental_empty_sequence():
+    from mixtape.pca import IncrementalPCA
+    IncrementalPCA().partial_fit(np.zeros((0, 3))).covariance_
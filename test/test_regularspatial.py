@@ -56,3 +56,24 @@ def test_4():
         np.testing.assert_array_equal(l1, l2)
     
     
+
+
+def test_5():
+    # test that the grid-hashed fit gives the same result as checking
+    # every center, in few (grid) and many (all centers) dimensions
+    from mixtape.cluster import _regularspatialc
+    random = np.random.RandomState(0)
+    for n_features in [1, 3, 12]:
+        x = np.cumsum(0.1 * random.randn(2000, n_features), axis=0)
+        c1 = _regularspatialc._rspatial_euclidean(x, 0.5)
+        c2 = _regularspatialc._rspatial_euclidean_grid(x, 0.5)
+        np.testing.assert_array_equal(c1, c2)
+
+
+def test_6():
+    # test that the pivot grid gives the same result as the regular code
+    # for non-euclidean metrics
+    for metric in ['cityblock', 'chebyshev']:
+        c1 = RegularSpatial(d_min=1.0, metric=metric, opt=True).fit([X]).cluster_centers_
+        c2 = RegularSpatial(d_min=1.0, metric=metric, opt=False).fit([X]).cluster_centers_
+        np.testing.assert_array_equal(c1, c2)
@@ -74,3 +74,19 @@ def test_score_1():
             tica.eigenvalues_.sum())
         X2 = np.random.randn(100, 5)
         assert tica.score([X2]) < tica.score([X])
+
+
+def test_sparse():
+    import scipy.sparse
+    random = np.random.RandomState(0)
+    X_all = [(random.rand(100, 10) > 0.8).astype(float) for _ in range(3)]
+
+    dense = tICA(n_components=2).fit(X_all)
+    sparse = tICA(n_components=2).fit([scipy.sparse.csr_matrix(X) for X in X_all])
+
+    np.testing.assert_array_almost_equal(sparse.covariance_, dense.covariance_)
+    np.testing.assert_array_almost_equal(sparse.offset_correlation_,
+                                         dense.offset_correlation_)
+    np.testing.assert_array_almost_equal(
+        dense.transform([scipy.sparse.csr_matrix(X_all[0])])[0],
+        dense.transform([X_all[0]])[0])
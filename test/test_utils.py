@@ -2,7 +2,7 @@ from __future__ import division
 import os
 import numpy as np
 import mdtraj as md
-from mdtraj.testing import eq
+from mdtraj.testing import eq, raises
 import mixtape
 import sklearn.pipeline
 
@@ -65,3 +65,85 @@ def test_subsampler_tica():
     eq(tica_0.n_features, tica_1.n_features)  # Obviously true
     eq(tica_0.n_observations_, tica_1.n_observations_)
     eq(tica_0.eigenvalues_, tica_1.eigenvalues_)  # The eigenvalues should be the same.  NOT the timescales, as tica_1 has timescales calculated in a different time unit
+
+
+def test_sample_frames_by_state():
+    assignments = [random.randint(3, size=50), random.randint(3, size=20)]
+    pairs = mixtape.utils.sample_frames_by_state(assignments, 3, 100,
+                                                 random_state=0)
+    eq(pairs.shape, (3, 100, 2))
+    for state in range(3):
+        for trj, frame in pairs[state]:
+            assert assignments[trj][frame] == state
+
+
+def test_extract_frames():
+    import shutil
+    import tempfile
+    top = md.Topology()
+    residue = top.add_residue('RES', top.add_chain())
+    for i in range(2):
+        top.add_atom('CA', md.element.carbon, residue)
+    xyz = [random.randn(n, 2, 3).astype(np.float32) for n in [130, 45]]
+    trajectories = [md.Trajectory(x, top, time=np.arange(len(x)))
+                    for x in xyz]
+
+    pairs = [[[0, 129], [1, 3], [0, 7], [0, 7]], [[1, 44], [0, 0]], [[1, 8]]]
+    ref = [np.array([xyz[trj][frame] for trj, frame in p]) for p in pairs]
+
+    samples = mixtape.utils.map_drawn_samples(pairs, xyz)
+    for s, r in zip(samples, ref):
+        eq(s, r)
+    samples = mixtape.utils.map_drawn_samples(pairs, trajectories)
+    for s, r in zip(samples, ref):
+        eq(s.xyz, r)
+
+    dirname = tempfile.mkdtemp()
+    try:
+        filenames = [os.path.join(dirname, '%d.dcd' % i) for i in range(2)]
+        for t, fn in zip(trajectories, filenames):
+            t.save(fn)
+        # sparse requests: each frame is read by seeking to it
+        frames = mixtape.utils.extract_frames(
+            filenames, [0, 1, 0, 0, 1, 0, 1], [129, 3, 7, 7, 44, 0, 8],
+            top=top)
+        eq(frames.xyz, np.concatenate(ref), decimal=4)
+        eq(frames.time, np.array([129, 3, 7, 7, 44, 0, 8], dtype=float))
+        # dense requests are streamed from the first requested frame, with
+        # the gcd of the offsets as the stride
+        requested = [100, 64, 60, 88, 76, 64, 72, 80, 68, 84, 92, 96]
+        for chunk in [1, 5, 1000]:
+            frames = mixtape.utils.extract_frames(
+                filenames, np.zeros(len(requested), dtype=int), requested,
+                top=top, chunk=chunk)
+            eq(frames.xyz, xyz[0][requested], decimal=4)
+            eq(frames.time, np.array(requested, dtype=float))
+    finally:
+        shutil.rmtree(dirname)
+
+
+def _check_extract_frames_too_short(requested):
+    import shutil
+    import tempfile
+    top = md.Topology()
+    top.add_atom('CA', md.element.carbon, top.add_residue('RES', top.add_chain()))
+    traj = md.Trajectory(random.randn(30, 1, 3).astype(np.float32), top)
+
+    dirname = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(dirname, 'traj.dcd')
+        traj.save(filename)
+        mixtape.utils.extract_frames([filename], np.zeros(len(requested)),
+                                     requested, top=top)
+    finally:
+        shutil.rmtree(dirname)
+
+
+@raises(IndexError)
+def test_extract_frames_too_short_sparse():
+    _check_extract_frames_too_short([0, 200])
+
+
+@raises(IndexError)
+def test_extract_frames_too_short_dense():
+    _check_extract_frames_too_short([25, 26, 27, 28, 29, 30])
@@ -49,6 +49,30 @@ def test_6():
     np.testing.assert_array_almost_equal(py_kappas, c_kappas)
 
 
+def test_7():
+    """The M-step from the reduced sufficient statistics is consistent with
+    the kappa update from the full posteriors"""
+    random = np.random.RandomState(42)
+    vm = VonMisesHMM(n_states=13)
+    posteriors = random.rand(100, 13)
+    obs = random.randn(100, 7)
+    vm.means_ = random.randn(13, 7)
+    vm.kappas_ = np.ones((13, 7))
+    stats = {'post': posteriors.sum(axis=0),
+             'cos': np.dot(posteriors.T, np.cos(obs)),
+             'sin': np.dot(posteriors.T, np.sin(obs))}
+
+    vm._do_mstep(stats, params='k')
+    kappas = np.copy(vm.kappas_)
+    vm._py_fitkappas(posteriors, obs, vm.means_)
+    np.testing.assert_array_almost_equal(kappas, vm.kappas_)
+
+    vm._do_mstep(stats, params='m')
+    means = np.arctan2(np.dot(posteriors.T, np.sin(obs)),
+                       np.dot(posteriors.T, np.cos(obs)))
+    np.testing.assert_array_almost_equal(vm.means_, means)
+
+
 def test_8():
     #"Sample from a VMHMM and then fit to it"
     n_states = 2
@@ -101,3 +125,28 @@ def test_log_likelihood():
     print('reference time ', t1-t0)
     print('c time         ', t2-t1)
     np.testing.assert_array_almost_equal(reference, value)
+
+
+def test_platforms():
+    # the compiled E-step gives the same EM update as the sklearn one
+    vm = VonMisesHMM(n_states=2)
+    vm.means_ = np.array([[0, 0, 0], [np.pi, np.pi, np.pi]])
+    vm.kappas_ = np.array([[1.0, 2, 3], [2, 3, 4]])
+    vm.transmat_ = np.array([[0.9, 0.1], [0.1, 0.9]])
+    x, s = vm.sample(500, random_state=0)
+
+    models = []
+    for platform in ['cpu', 'sklearn']:
+        model = VonMisesHMM(n_states=2, n_iter=1, init_params='',
+                            platform=platform)
+        model.means_ = vm.means_
+        model.kappas_ = vm.kappas_
+        model.transmat_ = vm.transmat_
+        model.startprob_ = np.array([0.5, 0.5])
+        models.append(model.fit([x, x[:100]]))
+
+    np.testing.assert_almost_equal(
+        models[0].fit_logprob_[0] / len(x), models[1].fit_logprob_[0] / len(x), decimal=4)
+    np.testing.assert_array_almost_equal(models[0].means_, models[1].means_, decimal=4)
+    np.testing.assert_array_almost_equal(models[0].kappas_, models[1].kappas_, decimal=3)
+    np.testing.assert_array_almost_equal(models[0].transmat_, models[1].transmat_, decimal=4)